@@ -1,6 +1,7 @@
 
 from pathlib import Path
 import os
+import sys
 from decouple import config
 
 
@@ -19,6 +20,9 @@ SECRET_KEY = 'django-insecure-1i2m2_41h7)^r-er9@i!k_!6lgfq)m#n&afykn!g(5)-y80pp&
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+# True under `manage.py test`, background workers stay off so tests control when they run
+TESTING = sys.argv[1:2] == ['test']
+
 ALLOWED_HOSTS = []
 
 
@@ -95,6 +99,54 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# The 'catalog' alias backs the category/product response cache in
+# api_operations/catalog_cache.py, 'carts' the active shopping carts of
+# api_operations/cart_store.py. Point them at Redis or Memcached in production.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'vintek-catalog',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+    'carts': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'vintek-carts',
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+        },
+    },
+}
+
+CATALOG_CACHE_ALIAS = 'catalog'
+CATALOG_CACHE_TIMEOUT = 60 * 15
+
+# Cart clicks are applied to the cached cart and written to the database every
+# CART_FLUSH_INTERVAL seconds. With no interval they are written through right away.
+CART_CACHE_ALIAS = 'carts'
+CART_CACHE_TIMEOUT = 60 * 60 * 24
+CART_FLUSH_INTERVAL = None if TESTING else 5
+
+# Cart lines hold their quantity of a product for STOCK_HOLD_TTL seconds after the last click on them.
+# Expired holds stop counting at once; the sweeper deletes them every STOCK_HOLD_SWEEP_INTERVAL seconds.
+STOCK_HOLD_TTL = 60 * 15
+STOCK_HOLD_SWEEP_INTERVAL = None if TESTING else 60
+
+# Carts that have not changed for this many days, by status, are deleted by purge_stale_carts
+CART_RETENTION_DAYS = {
+    'Active': 30,
+    'Inactive': 7,
+    'Ordered': 7,
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -142,6 +194,23 @@ AUTH_USER_MODEL = 'api_operations.CustomUser'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Worker processes rendering resized image variants (api_operations/image_variants.py).
+# 0 renders them inline, right after the upload's transaction commits.
+IMAGE_VARIANT_WORKERS = 2
+
+# Write-behind product view counters (api_operations/view_counters.py). Buffered views are
+# flushed every VIEW_COUNTER_FLUSH_INTERVAL seconds, or as soon as VIEW_COUNTER_FLUSH_SIZE
+# views are buffered. With no interval there is no flusher thread and full buffers flush inline.
+VIEW_COUNTER_FLUSH_INTERVAL = None if TESTING else 10
+VIEW_COUNTER_FLUSH_SIZE = 1000
+# The trending list ranks products by their views over the last TRENDING_WINDOW_HOURS hours
+TRENDING_WINDOW_HOURS = 24
+TRENDING_SIZE = 50
+
+# Seconds after which a process rebuilds its in-memory autocomplete index (api_operations/autocomplete.py)
+# in the background, to pick up product writes made by other processes
+AUTOCOMPLETE_MAX_AGE = None if TESTING else 300
+
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -150,6 +219,12 @@ REST_FRAMEWORK = {
 
     
         
+    ],
+    # orjson for JSON, MessagePack for clients sending Accept: application/msgpack
+    'DEFAULT_RENDERER_CLASSES': [
+        'api_operations.renderers.ORJSONRenderer',
+        'api_operations.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
 }
 
@@ -163,3 +238,25 @@ EMAIL_HOST_USER = 'vintek@mail.com'
 EMAIL_HOST_PASSWORD = 'Password'
 
 
+
+# Emails are queued in the outbox (api_operations/outbox.py) and sent by the run_outbox_worker command.
+# A failed message is retried up to OUTBOX_MAX_ATTEMPTS times, OUTBOX_RETRY_DELAY seconds after the first
+# failure and twice as long after each next one. A worker that dies gives its claimed messages back after
+# OUTBOX_CLAIM_TIMEOUT seconds. Sent messages are deleted after OUTBOX_RETENTION_DAYS days.
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETRY_DELAY = 30
+OUTBOX_CLAIM_TIMEOUT = 300
+OUTBOX_RETENTION_DAYS = 7
+
+# With a window of N seconds, a seller gets one email for all their sales of every N seconds,
+# instead of one per order (see api_operations/notifications.py)
+SALE_DIGEST_WINDOW = None
+
+# POSTs sent with an Idempotency-Key header keep their response for IDEMPOTENCY_KEY_TTL seconds, and retries
+# with the same key get it back (see api_operations/idempotency.py). A retry that arrives while the first
+# request is still running polls every IDEMPOTENCY_POLL_INTERVAL seconds, for up to IDEMPOTENCY_WAIT seconds,
+# for its response. A request still unfinished after IDEMPOTENCY_LOCK_TIMEOUT seconds is presumed dead.
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_WAIT = 10
+IDEMPOTENCY_POLL_INTERVAL = 0.05
+IDEMPOTENCY_LOCK_TIMEOUT = 60
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import (CustomUser, UserProfile, Category, Product, Payment, ShoppingCart,Order,OrderProduct)
+from .models import (CustomUser, UserProfile, Category, Product, Payment, ShoppingCart,Order,OrderProduct,Tag)
 
 
 admin.site.register(CustomUser)
@@ -11,3 +11,5 @@ admin.site.register(Order)
 admin.site.register(OrderProduct)
 admin.site.register(Payment)
 
+
+admin.site.register(Tag)
\ No newline at end of file
@@ -0,0 +1,221 @@
+"""
+In-memory prefix index for search-box typeahead.
+
+Every distinct product name, brand and model is a suggestion. Its lowercased
+text and each of its word-suffixes ("sony walkman", "walkman") are kept in one
+sorted list, so the suggestions matching a prefix are a contiguous range found
+with bisect. Suggestions are ranked by popularity: the number of products
+carrying them plus the lifetime views of those products.
+
+Prefixes matching more than CACHED_RANGE_SIZE entries (short ones, or common
+words like "sony") have their ranking cached until a suggestion under them
+changes. Narrower prefixes rank their small range on every lookup.
+
+The index lives in each process. It is built on first use, follows product
+writes through the receivers in models.py and view counter flushes, and is
+rebuilt in the background after AUTOCOMPLETE_MAX_AGE seconds so writes made
+by other processes show up too.
+"""
+import heapq
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections
+
+from .models import Product, ProductViewCount
+
+logger = logging.getLogger(__name__)
+
+
+KINDS = ('name', 'brand', 'model')
+MAX_SUGGESTIONS = 20
+CACHED_RANGE_SIZE = 200
+
+WORD_RE = re.compile(r'\S+')
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize(text):
+    return WHITESPACE_RE.sub(' ', (text or '').strip().lower())
+
+
+def suggestion_keys(text):
+    """The sorted-list keys of a suggestion: its text and each of its word-suffixes."""
+    return {text[match.start():] for match in WORD_RE.finditer(text)}
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = []              # sorted (key, (kind, text))
+        self._scores = Counter()        # (kind, text) -> popularity
+        self._display = {}              # (kind, text) -> spelling shown to users
+        self._product_suggestions = {}  # product id -> {(kind, text): display}
+        self._product_weights = {}      # product id -> 1 + lifetime views
+        self._carriers = Counter()      # (kind, text) -> number of products carrying it
+        self._top = {}                  # wide prefix -> ranked suggestions
+        self.built_at = None
+
+    # -------------------BUILDING-----------------------------------------------------------------
+
+    def build(self, rows, views):
+        """Fill the index from (product id, name, brand, model) rows and {product id: views}."""
+        with self._lock:
+            for product_id, *values in rows:
+                self._add_product(product_id, dict(zip(KINDS, values)), 1 + views.get(product_id, 0), building=True)
+            self._entries.sort()
+            self.built_at = time.monotonic()
+
+    def _add_product(self, product_id, values, weight, building=False):
+        suggestions = {}
+        for kind in KINDS:
+            text = normalize(values.get(kind))
+            if text:
+                suggestions[(kind, text)] = values[kind].strip()
+        self._product_suggestions[product_id] = suggestions
+        self._product_weights[product_id] = weight
+        for suggestion, display in suggestions.items():
+            self._carriers[suggestion] += 1
+            self._scores[suggestion] += weight
+            if self._carriers[suggestion] == 1:
+                self._display[suggestion] = display
+                for key in suggestion_keys(suggestion[1]):
+                    if building:
+                        # sorted once at the end of build()
+                        self._entries.append((key, suggestion))
+                    else:
+                        insort(self._entries, (key, suggestion))
+            if not building:
+                self._forget_rankings(suggestion)
+
+    def _remove_product(self, product_id):
+        suggestions = self._product_suggestions.pop(product_id, {})
+        weight = self._product_weights.pop(product_id, 0)
+        for suggestion in suggestions:
+            self._carriers[suggestion] -= 1
+            self._scores[suggestion] -= weight
+            if self._carriers[suggestion] <= 0:
+                del self._carriers[suggestion], self._scores[suggestion], self._display[suggestion]
+                for key in suggestion_keys(suggestion[1]):
+                    position = bisect_left(self._entries, (key, suggestion))
+                    if position < len(self._entries) and self._entries[position] == (key, suggestion):
+                        del self._entries[position]
+            self._forget_rankings(suggestion)
+        return weight
+
+    def _forget_rankings(self, suggestion):
+        if not self._top:
+            return
+        for key in suggestion_keys(suggestion[1]):
+            for length in range(1, len(key) + 1):
+                self._top.pop(key[:length], None)
+
+    # -------------------UPDATES------------------------------------------------------------------
+
+    def update_product(self, product_id, name, brand, model):
+        with self._lock:
+            if self.built_at is None:
+                return
+            weight = self._remove_product(product_id) or 1
+            self._add_product(product_id, {'name': name, 'brand': brand, 'model': model}, weight)
+
+    def remove_product(self, product_id):
+        with self._lock:
+            if self.built_at is not None:
+                self._remove_product(product_id)
+
+    def add_views(self, counts):
+        """Add flushed {product id: views} to the popularity of their suggestions."""
+        with self._lock:
+            if self.built_at is None:
+                return
+            for product_id, views in counts.items():
+                if product_id not in self._product_weights:
+                    continue
+                self._product_weights[product_id] += views
+                for suggestion in self._product_suggestions[product_id]:
+                    self._scores[suggestion] += views
+                    self._forget_rankings(suggestion)
+
+    # -------------------LOOKUPS------------------------------------------------------------------
+
+    def _rank(self, start, end, limit):
+        matches = {suggestion for _, suggestion in self._entries[start:end]}
+        return heapq.nsmallest(limit, matches, key=lambda suggestion: (-self._scores[suggestion], suggestion))
+
+    def suggest(self, prefix, limit=10):
+        """The `limit` most popular suggestions matching `prefix`, as [{'text', 'kind'}]."""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            ranked = self._top.get(prefix)
+            if ranked is None:
+                start = bisect_left(self._entries, (prefix,))
+                end = bisect_right(self._entries, (prefix + '\uffff',))
+                if end - start <= CACHED_RANGE_SIZE:
+                    ranked = self._rank(start, end, limit)
+                else:
+                    ranked = self._top[prefix] = self._rank(start, end, MAX_SUGGESTIONS)
+            ranked = ranked[:limit]
+            return [{'text': self._display[suggestion], 'kind': suggestion[0]} for suggestion in ranked]
+
+
+index = PrefixIndex()
+_build_lock = threading.Lock()
+
+
+def build_index():
+    """Load a fresh index from the database and swap it in. Lookups keep using the old one meanwhile."""
+    global index
+    fresh = PrefixIndex()
+    views = dict(ProductViewCount.objects.values_list('product_id', 'views'))
+    fresh.build(Product.objects.values_list('pk', *KINDS).iterator(chunk_size=2000), views)
+    index = fresh
+    return fresh
+
+
+def _rebuild_in_background():
+    try:
+        build_index()
+    except Exception:
+        logger.exception('Rebuilding the autocomplete index failed')
+    finally:
+        _build_lock.release()
+        connections.close_all()
+
+
+def get_index():
+    """The process's index, built on first use and refreshed once older than AUTOCOMPLETE_MAX_AGE."""
+    if index.built_at is None:
+        with _build_lock:
+            if index.built_at is None:
+                build_index()
+        return index
+    max_age = settings.AUTOCOMPLETE_MAX_AGE
+    if max_age and time.monotonic() - index.built_at > max_age and _build_lock.acquire(blocking=False):
+        threading.Thread(target=_rebuild_in_background, name='autocomplete-rebuild', daemon=True).start()
+    return index
+
+
+def suggest(prefix, limit=10):
+    return get_index().suggest(prefix, min(limit, MAX_SUGGESTIONS))
+
+
+# Write hooks, no-ops until the process has built its index
+
+def update_product(product_id, name, brand, model):
+    index.update_product(product_id, name, brand, model)
+
+
+def remove_product(product_id):
+    index.remove_product(product_id)
+
+
+def add_views(counts):
+    index.add_views(counts)
@@ -0,0 +1,56 @@
+"""
+Purging stale shopping carts.
+
+A cart is stale once it has not changed for CART_RETENTION_DAYS[status] days.
+Stale carts are deleted in chunks of `batch_size`. Each chunk is its own
+short transaction: select the ids, delete their lines, delete the carts. The
+database write lock is therefore held for a few milliseconds at a time, and
+API writes wait behind at most one chunk. A pause between chunks lets them
+through.
+
+The lines of a purged cart go with it through the cascade, without touching
+the cart on the way out. Stale carts are long gone from the cart cache. A
+cached copy that is flushed after its cart was purged is dropped by the
+version check in cart_store.write_cart.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import CartItem, ShoppingCart
+
+
+def stale_carts(now=None):
+    now = now or timezone.now()
+    stale = Q(pk__in=[])
+    for status, days in settings.CART_RETENTION_DAYS.items():
+        stale |= Q(status=status, updated_at__lt=now - timedelta(days=days))
+    return ShoppingCart.objects.filter(stale)
+
+
+def purge_chunk(now, batch_size):
+    """Delete up to `batch_size` carts that were stale at `now`, in one transaction. Returns (carts, lines)."""
+    with transaction.atomic():
+        # unordered, so the index scan stops after `batch_size` carts instead of sorting every stale one
+        cart_ids = list(stale_carts(now).values_list('pk', flat=True)[:batch_size])
+        if not cart_ids:
+            return 0, 0
+        # the lines go with their carts through the cascade
+        _, deleted = ShoppingCart.objects.filter(pk__in=cart_ids).delete()
+    return deleted.get(ShoppingCart._meta.label, 0), deleted.get(CartItem._meta.label, 0)
+
+
+def purge_stale_carts(batch_size=200, pause=0.05):
+    """Delete the carts stale as of now chunk by chunk, yielding (carts, lines) deleted by every chunk."""
+    now = timezone.now()
+    while True:
+        carts, lines = purge_chunk(now, batch_size)
+        if not carts:
+            return
+        yield carts, lines
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,483 @@
+"""
+Cache-backed shopping carts with write-behind persistence.
+
+Cart clicks change a copy of the cart kept in the CART_CACHE_ALIAS cache and
+mark it dirty. A daemon thread writes the dirty carts to ShoppingCart and
+CartItem every CART_FLUSH_INTERVAL seconds, in one short transaction per
+cart, and checkout flushes the cart it reads. Clicks therefore do not queue
+for the database write lock behind order writes. The one synchronous write
+left is inserting new lines, because the client addresses lines by their
+CartItem id. Clicks that change a quantity also set the stock hold of the
+line (api_operations/stock_holds.py), which has to be shared by every
+process. With no CART_FLUSH_INTERVAL the cache is not used and every
+click is written through.
+
+Consistency when the cache loses a cart:
+
+- The process that made a change keeps its latest copy of each dirty cart in
+  memory until it is flushed. A cart evicted from the cache is restored from
+  that copy, and is otherwise reloaded from the database. The database always
+  holds every line, with the quantities as of the last flush.
+- ShoppingCart.version counts flushed changes. A flush only applies on top of
+  the version its copy was loaded from, so two copies that diverged (say, two
+  processes that both reloaded the cart) never overwrite each other blindly.
+  The first flush wins. The other copy is merged into a fresh load of the
+  cart: the lines it changed since it was loaded or last flushed take its
+  quantities, and the lines it removed go. That merge is written instead.
+
+The lock of a cart is an entry in the same cache. It serializes the clicks of
+every process only when CART_CACHE_ALIAS points at a cache they share (Redis,
+Memcached); with the default locmem cache it only covers the threads of one
+process.
+
+Unflushed clicks are lost only if their process dies before flushing them,
+which is at most CART_FLUSH_INTERVAL seconds of clicks. Clean shutdowns flush
+at exit.
+"""
+import atexit
+import copy
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import stock_holds
+from .models import CartItem, CartStatus, ShoppingCart
+
+logger = logging.getLogger(__name__)
+
+
+LOCK_TIMEOUT = 5
+
+
+class CartBusy(APIException):
+    """The cart lock could not be taken within LOCK_TIMEOUT seconds."""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The shopping cart is busy, try again.'
+    default_code = 'cart_busy'
+
+
+def get_cache():
+    return caches[settings.CART_CACHE_ALIAS]
+
+
+def write_behind():
+    return bool(settings.CART_FLUSH_INTERVAL)
+
+
+def _key(user_id):
+    return f'cart:{user_id}'
+
+
+@contextmanager
+def cart_lock(user_id):
+    """
+    Serializes the clicks and flushes of one cart, across the processes sharing CART_CACHE_ALIAS. Raises CartBusy
+    when another holder keeps it for LOCK_TIMEOUT seconds.
+    """
+    cache = get_cache()
+    key = f'cart:lock:{user_id}'
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    # the lock expires on its own if its holder dies
+    while not cache.add(key, token, LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            raise CartBusy()
+        time.sleep(0.005)
+    try:
+        yield
+    finally:
+        # a lock that expired under us may belong to someone else by now
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+# -------------------STATE--------------------------------------------------------------------------------------------
+# A cart copy is a dict:
+#   cart_id, items ({CartItem id: {'product_id', 'quantity'}}), removed (CartItem ids to delete),
+#   version (bumped by every click), synced (the database version the copy was loaded or last flushed at),
+#   lineage (random, shared by the copies descending from one load), updated_at (time of the last click),
+#   base ({CartItem id: quantity} as of the load or the last flush, to tell the lines the copy changed)
+
+def load_cart(user_id, create=False):
+    """A fresh copy of the user's cart from the database, or None if there is none and `create` is False."""
+    cart = (
+        ShoppingCart.objects.filter(user_id=user_id, status=CartStatus.ACTIVE)
+        .order_by('pk').values_list('pk', 'version').first()
+    )
+    if cart is None:
+        if not create:
+            return None
+        created = ShoppingCart.objects.create(user_id=user_id)
+        cart = (created.pk, created.version)
+    cart_id, version = cart
+    items = {
+        pk: {'product_id': product_id, 'quantity': quantity}
+        for pk, product_id, quantity in CartItem.objects.filter(cart_id=cart_id).values_list('pk', 'product_id', 'quantity')
+    }
+    return {
+        'cart_id': cart_id, 'items': items, 'removed': [], 'version': version, 'synced': version,
+        'lineage': uuid.uuid4().hex, 'updated_at': None, 'base': _quantities(items),
+    }
+
+
+def _quantities(items):
+    return {pk: item['quantity'] for pk, item in items.items()}
+
+
+def _current(user_id, create=False):
+    if write_behind():
+        state = get_cache().get(_key(user_id))
+        if state is None:
+            state = buffer.pending(user_id)
+        if state is not None:
+            return state
+    return load_cart(user_id, create)
+
+
+def _save(user_id, state):
+    state['version'] += 1
+    state['updated_at'] = timezone.now()
+    if write_behind():
+        get_cache().set(_key(user_id), state, settings.CART_CACHE_TIMEOUT)
+        buffer.mark(user_id, state)
+    else:
+        _write(user_id, state)
+
+
+def write_cart(state):
+    """Write a dirty copy to the database. False if the cart moved on (or is gone) since the copy was loaded."""
+    with transaction.atomic():
+        updated = ShoppingCart.objects.filter(pk=state['cart_id'], version=state['synced']).update(
+            version=state['version'], updated_at=state['updated_at'] or timezone.now())
+        if not updated:
+            return False
+        if state['removed']:
+            CartItem.objects.filter(cart_id=state['cart_id'], pk__in=state['removed']).delete()
+        stored = dict(CartItem.objects.filter(cart_id=state['cart_id'], pk__in=state['items']).values_list('pk', 'quantity'))
+        CartItem.objects.bulk_update([
+            CartItem(pk=pk, quantity=item['quantity'])
+            for pk, item in state['items'].items() if pk in stored and stored[pk] != item['quantity']
+        ], ['quantity'])
+    return True
+
+
+def merge_stale(user_id, state):
+    """
+    A fresh copy of the user's cart with the changes of the stale copy `state` applied on top, or None when the
+    cart of `state` is no longer the active one.
+    """
+    fresh = load_cart(user_id)
+    if fresh is None or fresh['cart_id'] != state['cart_id']:
+        return None
+    base = state.get('base', {})
+    for pk, item in state['items'].items():
+        if pk in fresh['items'] and item['quantity'] != base.get(pk):
+            fresh['items'][pk]['quantity'] = item['quantity']
+    for pk in state['removed']:
+        if fresh['items'].pop(pk, None) is not None:
+            fresh['removed'].append(pk)
+    fresh['version'] = fresh['synced'] + 1
+    fresh['updated_at'] = state['updated_at']
+    return fresh
+
+
+def _write(user_id, state):
+    """Flush `state` and bring the cached copy in line. Runs under the cart lock."""
+    written = write_cart(state)
+    if not written:
+        # another copy was flushed first; ours is merged into it rather than dropped
+        merged = merge_stale(user_id, state)
+        if merged is not None:
+            logger.warning('Merged a stale copy of the cart of user %s', user_id)
+            state = merged
+            written = write_cart(state)
+        if not written:
+            logger.warning('Dropped a stale copy of the cart of user %s', user_id)
+    if write_behind():
+        if written:
+            state['synced'] = state['version']
+            state['removed'] = []
+            state['base'] = _quantities(state['items'])
+            get_cache().set(_key(user_id), state, settings.CART_CACHE_TIMEOUT)
+        else:
+            get_cache().delete(_key(user_id))
+    return written
+
+
+def _flush_locked(user_id):
+    snapshot = buffer.pending(user_id)
+    cached = get_cache().get(_key(user_id))
+    # a cached copy descending from the same load and at least as new supersedes ours
+    if cached is not None and (snapshot is None or (
+            cached['lineage'] == snapshot['lineage'] and cached['version'] >= snapshot['version'])):
+        state = cached
+    else:
+        state = snapshot
+    if state is not None and state['version'] != state['synced']:
+        _write(user_id, state)
+    buffer.forget(user_id, snapshot)
+
+
+def flush_cart(user_id):
+    """Write the user's pending clicks to the database, e.g. before reading the cart rows at checkout."""
+    if write_behind():
+        with cart_lock(user_id):
+            _flush_locked(user_id)
+
+
+@contextmanager
+def checking_out(user_id):
+    """
+    Keep the user's cart still while it is ordered: pending clicks are flushed first, so the cart rows are
+    complete, and the cached copy is forgotten afterwards, as the cart is no longer the active one.
+    """
+    with cart_lock(user_id):
+        if write_behind():
+            _flush_locked(user_id)
+        try:
+            yield
+        finally:
+            if write_behind():
+                get_cache().delete(_key(user_id))
+                buffer.forget(user_id)
+
+
+def discard(user_id):
+    """Forget the cached copy after the cart rows were changed directly in the database."""
+    if write_behind():
+        with cart_lock(user_id):
+            get_cache().delete(_key(user_id))
+            buffer.forget(user_id)
+
+
+def peek(user_id):
+    """The cached copy of the user's cart, None when there is none or carts are written through."""
+    if not write_behind():
+        return None
+    return get_cache().get(_key(user_id)) or buffer.pending(user_id)
+
+
+def apply_pending(cart_data, state):
+    """Overlay the unflushed clicks of `state` on ShoppingCartSerializer data read from the database."""
+    if state is None or state['cart_id'] != cart_data['id']:
+        return cart_data
+    removed = set(state['removed'])
+    items = []
+    for item in cart_data['items']:
+        if item['id'] in removed:
+            continue
+        if item['id'] in state['items']:
+            item['quantity'] = state['items'][item['id']]['quantity']
+        items.append(item)
+    cart_data['items'] = items
+    return cart_data
+
+
+# -------------------CLICKS-------------------------------------------------------------------------------------------
+
+def get_item(user_id, item_id):
+    """{'product_id', 'quantity'} of a line of the user's cart, or None."""
+    state = _current(user_id)
+    return state['items'].get(item_id) if state is not None else None
+
+
+def add_product(user_id, product_id, quantity=1):
+    """
+    Add `quantity` of a product to the user's cart, creating the cart or the line if needed. Raises
+    stock_holds.InsufficientStock when the line would hold more than is available.
+    """
+    with cart_lock(user_id):
+        state = _current(user_id, create=True)
+        item = next((item for item in state['items'].values() if item['product_id'] == product_id), None)
+        stock_holds.hold(user_id, {product_id: (item['quantity'] if item else 0) + quantity})
+        if item is not None:
+            item['quantity'] += quantity
+        else:
+            state = _insert_lines(user_id, state, {product_id: quantity})
+        _save(user_id, state)
+
+
+def _insert_lines(user_id, state, quantities):
+    """Insert lines of {product id: quantity} into the cart of `state`, in one query. Returns the state to save."""
+    def insert():
+        lines = CartItem.objects.bulk_create([
+            CartItem(cart_id=state['cart_id'], product_id=product_id, quantity=quantity)
+            for product_id, quantity in quantities.items()
+        ])
+        for line in lines:
+            state['items'][line.pk] = {'product_id': line.product_id, 'quantity': line.quantity}
+
+    try:
+        with transaction.atomic():
+            insert()
+    except IntegrityError:
+        # the cart was deleted under the cached copy
+        get_cache().delete(_key(user_id))
+        buffer.forget(user_id)
+        state = load_cart(user_id, create=True)
+        insert()
+    return state
+
+
+def apply_operations(user_id, operations):
+    """
+    Apply (op, product id, quantity) operations to the user's cart as one click: 'add' adds to the line of the
+    product, 'set' replaces its quantity and 'remove' drops it, in order. Returns {product id: available} for the
+    lines that would grow past the available stock, and then changes nothing.
+    """
+    with cart_lock(user_id):
+        state = _current(user_id, create=True)
+        lines = {item['product_id']: item_id for item_id, item in state['items'].items()}
+        quantities = {}
+        for op, product_id, quantity in operations:
+            current = quantities.get(product_id)
+            if current is None:
+                current = state['items'][lines[product_id]]['quantity'] if product_id in lines else 0
+            quantities[product_id] = current + quantity if op == 'add' else quantity if op == 'set' else 0
+        current = {product_id: state['items'][item_id]['quantity'] for product_id, item_id in lines.items()}
+        try:
+            # lines that shrink are let through even when stock ran out under them
+            stock_holds.hold(user_id, quantities, checked=[
+                product_id for product_id, quantity in quantities.items() if quantity > current.get(product_id, 0)
+            ])
+        except stock_holds.InsufficientStock as e:
+            return e.available
+
+        for product_id, quantity in quantities.items():
+            item_id = lines.get(product_id)
+            if item_id is None:
+                continue
+            if quantity:
+                state['items'][item_id]['quantity'] = quantity
+            else:
+                del state['items'][item_id]
+                state['removed'].append(item_id)
+        new_lines = {product_id: quantity for product_id, quantity in quantities.items() if quantity and product_id not in lines}
+        with transaction.atomic():
+            if new_lines:
+                state = _insert_lines(user_id, state, new_lines)
+            _save(user_id, state)
+        return {}
+
+
+def change_quantity(user_id, item_id, delta):
+    """
+    Add `delta` to a line, removing it when it drops to zero. The new quantity, or None for a missing line. Raises
+    stock_holds.InsufficientStock when the line would hold more than is available.
+    """
+    with cart_lock(user_id):
+        state = _current(user_id)
+        item = state['items'].get(item_id) if state is not None else None
+        if item is None:
+            return None
+        quantity = max(item['quantity'] + delta, 0)
+        stock_holds.hold(user_id, {item['product_id']: quantity}, checked=[item['product_id']] if delta > 0 else [])
+        item['quantity'] = quantity
+        if not item['quantity']:
+            del state['items'][item_id]
+            state['removed'].append(item_id)
+        _save(user_id, state)
+        return item['quantity']
+
+
+def remove_item(user_id, item_id):
+    """Remove a line from the user's cart. False if there was no such line."""
+    with cart_lock(user_id):
+        state = _current(user_id)
+        item = state['items'].pop(item_id, None) if state is not None else None
+        if item is None:
+            return False
+        stock_holds.release(user_id, [item['product_id']])
+        state['removed'].append(item_id)
+        _save(user_id, state)
+        return True
+
+
+def clear(user_id):
+    """Remove every line from the user's cart. False if the user has no cart."""
+    with cart_lock(user_id):
+        state = _current(user_id)
+        if state is None:
+            return False
+        stock_holds.release(user_id)
+        state['removed'].extend(state['items'])
+        state['items'] = {}
+        _save(user_id, state)
+        return True
+
+
+# -------------------WRITE-BEHIND-------------------------------------------------------------------------------------
+
+class CartWriteBuffer:
+    """This process's latest copy of every cart it changed and has not flushed yet."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirty = {}
+        self._flusher = None
+
+    def mark(self, user_id, state):
+        with self._lock:
+            self._dirty[user_id] = copy.deepcopy(state)
+        self._start_flusher()
+
+    def pending(self, user_id):
+        with self._lock:
+            state = self._dirty.get(user_id)
+        return copy.deepcopy(state) if state is not None else None
+
+    def forget(self, user_id, snapshot=None):
+        """Drop the copy of `user_id`, unless a click replaced `snapshot` in the meantime."""
+        with self._lock:
+            current = self._dirty.get(user_id)
+            if current is not None and (snapshot is None or current['version'] <= snapshot['version']):
+                del self._dirty[user_id]
+
+    def dirty_users(self):
+        with self._lock:
+            return list(self._dirty)
+
+    def flush(self):
+        """Write every pending cart. Returns the number of carts flushed; failed ones stay pending."""
+        flushed = 0
+        for user_id in self.dirty_users():
+            try:
+                with cart_lock(user_id):
+                    _flush_locked(user_id)
+                flushed += 1
+            except Exception:
+                logger.exception('Flushing the cart of user %s failed', user_id)
+        return flushed
+
+    def _start_flusher(self):
+        if self._flusher is None:
+            with self._lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(
+                        target=self._run, args=(settings.CART_FLUSH_INTERVAL,), name='cart-flusher', daemon=True)
+                    self._flusher.start()
+                    atexit.register(self.flush)
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            finally:
+                connections.close_all()
+
+
+buffer = CartWriteBuffer()
+
+
+def flush_carts():
+    return buffer.flush()
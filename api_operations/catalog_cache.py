@@ -0,0 +1,133 @@
+"""
+Response cache for the read-mostly catalog endpoints.
+
+Cached responses are keyed by resource and by a per-resource version number.
+The post_save/post_delete receivers in models.py bump the versions of exactly
+the resources a write touches, once the write commits, which makes every
+older entry unreachable without having to enumerate or delete it.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+
+def get_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def _version_key(resource):
+    return f'catalog:version:{resource}'
+
+
+def _new_version():
+    # Versions must never repeat, even if a version key is evicted
+    return time.time_ns()
+
+
+def get_version(resource):
+    return get_cache().get_or_set(_version_key(resource), _new_version, None)
+
+
+def _bump(resources):
+    cache = get_cache()
+    for resource in resources:
+        try:
+            cache.incr(_version_key(resource))
+        except ValueError:
+            cache.set(_version_key(resource), _new_version(), None)
+
+
+def bump_versions(*resources):
+    # A bump inside the writing transaction would let a concurrent reader cache the rows as of before the commit
+    # under the new version, so it waits for the commit (and is dropped on rollback).
+    transaction.on_commit(lambda: _bump(resources))
+
+
+def invalidate_category(category_id):
+    bump_versions('categories', f'category:{category_id}', f'category_products:{category_id}')
+
+
+def invalidate_product(product_id, category_ids=()):
+    bump_versions(
+        f'product:{product_id}',
+        *(f'category_products:{category_id}' for category_id in category_ids if category_id is not None),
+    )
+
+
+# -------------------HIT/MISS COUNTERS--------------------------------------------------------------------------------
+
+def _record(outcome):
+    cache = get_cache()
+    key = f'catalog:stats:{outcome}'
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def get_stats():
+    cache = get_cache()
+    counters = cache.get_many(['catalog:stats:hits', 'catalog:stats:misses'])
+    hits = counters.get('catalog:stats:hits', 0)
+    misses = counters.get('catalog:stats:misses', 0)
+    lookups = hits + misses
+    return {
+        'backend': f'{cache.__class__.__module__}.{cache.__class__.__name__}',
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / lookups, 4) if lookups else None,
+    }
+
+
+def reset_stats():
+    get_cache().delete_many(['catalog:stats:hits', 'catalog:stats:misses'])
+
+
+# -------------------VIEW MIXIN-----------------------------------------------------------------------------------------
+
+class CatalogCacheMixin:
+    """
+    Serves successful list/retrieve GETs from the catalog cache.
+    Views set `cache_resource` to the name of the resource they read, or
+    override get_cache_resource() when it depends on the URL.
+    """
+    cache_resource = None
+
+    def get_cache_resource(self):
+        return self.cache_resource
+
+    def get_cache_key(self):
+        resource = self.get_cache_resource()
+        request_id = f'{self.request.get_host()}{self.request.get_full_path()}'
+        digest = hashlib.md5(request_id.encode()).hexdigest()
+        return f'catalog:{resource}:{get_version(resource)}:{digest}'
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        cache = get_cache()
+        # The key is built before reading the database, so a write that lands
+        # in between bumps the version and the stale body is never served.
+        key = self.get_cache_key()
+        data = cache.get(key)
+        if data is not None:
+            _record('hits')
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        _record('misses')
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.CATALOG_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,130 @@
+"""
+Streaming catalog export for partner feeds.
+
+The catalog is read with values().iterator(), so rows come off the database
+cursor EXPORT_CHUNK_SIZE at a time, and each chunk is turned into the same
+dicts /api/products/ returns by ProductValuesSerializer (one extra query per
+chunk for the tags) and written out as NDJSON lines or CSV rows before the
+next chunk is read. Nothing holds more than one chunk, so memory stays flat
+whatever the size of the catalog.
+
+Products are exported oldest change first, so a partner can fetch only what
+changed with updated_since=<updated_at of the last product it received>.
+"""
+import csv
+import io
+import zlib
+from datetime import datetime
+from itertools import islice
+
+import orjson
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Product
+from .values_serializers import ProductValuesSerializer
+
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def parse_updated_since(value):
+    """The datetime of an ISO 8601 date or datetime, midnight for a date. Raises ValueError."""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(value)
+        return timezone.make_aware(datetime(date.year, date.month, date.day))
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header allows gzip: listed, or covered by *, with a non-zero q-value."""
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+def export_queryset(updated_since=None):
+    queryset = Product.objects.order_by('updated_at', 'id')
+    if updated_since is not None:
+        queryset = queryset.filter(updated_at__gte=updated_since)
+    return queryset
+
+
+def export_fields():
+    return [name for name, _, _ in ProductValuesSerializer().fields]
+
+
+def export_chunks(updated_since=None, context=None, chunk_size=None):
+    """Yield the exported products as lists of their API representation, `chunk_size` rows at a time."""
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    values_serializer = ProductValuesSerializer(context)
+    rows = values_serializer.values(export_queryset(updated_since)).iterator(chunk_size=chunk_size)
+    while chunk := list(islice(rows, chunk_size)):
+        yield values_serializer.represent(chunk)
+
+
+def _csv_value(value):
+    if isinstance(value, list):
+        return ','.join(str(item) for item in value)
+    if isinstance(value, dict):
+        return orjson.dumps(value).decode() if value else ''
+    return value
+
+
+def ndjson_lines(chunks):
+    for products in chunks:
+        yield b''.join(orjson.dumps(product, option=orjson.OPT_APPEND_NEWLINE) for product in products)
+
+
+def csv_lines(chunks):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=export_fields())
+    writer.writeheader()
+    for products in chunks:
+        writer.writerows({field: _csv_value(value) for field, value in product.items()} for product in products)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # the header alone, for an empty export
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def render_export(export_format, chunks):
+    """Encoded `chunks` of products in `export_format`, one of EXPORT_FORMATS."""
+    return ndjson_lines(chunks) if export_format == 'ndjson' else csv_lines(chunks)
+
+
+def gzip_stream(chunks, flush_size=64 * 1024):
+    """Gzip `chunks` on the fly, yielding compressed data every `flush_size` bytes of input."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    pending = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        pending += len(chunk)
+        if pending >= flush_size:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,89 @@
+"""
+Cart-to-order checkout.
+
+checkout() turns the user's active cart into an Order in one transaction.
+
+- The cart lines are read in one query and the products locked in another.
+- The buyer's own stock holds are released. The lines are then checked
+  against the stock not held by other carts.
+- Stock is taken by a single conditional UPDATE. It only lowers a product
+  that still has the ordered quantity, so the stock can never go negative.
+- The order is created with its total computed from the product prices, and
+  its lines are written with one bulk_create.
+- The cart is marked Ordered.
+
+The conditional UPDATE and bulk_create bypass post_save. products_stock_taken
+stands in for it, so the listings, facet counts and catalog caches follow the
+new stock. The sale rollups are updated and the sale emails queued in the
+outbox in the same transaction.
+"""
+from collections import Counter
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from . import cart_store, stock_holds
+from .models import CartItem, CartStatus, Order, OrderProduct, Product, ShoppingCart
+from .notifications import queue_sale_notifications
+from .sales_rollups import record_order
+from .signals import products_stock_taken
+
+
+def checkout(user, shipping_address):
+    """
+    Order the lines of the user's active cart. Returns the order, or None when the cart is empty. Raises
+    stock_holds.InsufficientStock, ordering nothing, when a line asks for more than is available.
+    """
+    with cart_store.checking_out(user.pk), transaction.atomic():
+        cart_id = (
+            ShoppingCart.objects.filter(user=user, status=CartStatus.ACTIVE)
+            .order_by('pk').values_list('pk', flat=True).first()
+        )
+        quantities = Counter()
+        for product_id, quantity in CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity'):
+            quantities[product_id] += quantity
+        if not quantities:
+            return None
+
+        products = list(
+            Product.objects.select_for_update(of=('self',)).select_related('user')
+            .filter(pk__in=quantities).order_by('pk')
+        )
+        stock_holds.release(user.pk, quantities)
+        available = stock_holds.available_stock(quantities, user.pk)
+        short = {product_id: available.get(product_id, 0)
+                 for product_id, quantity in quantities.items() if quantity > available.get(product_id, 0)}
+        if short:
+            raise stock_holds.InsufficientStock(short)
+
+        now = timezone.now()
+        taken = Product.objects.filter(
+            reduce(or_, (Q(pk=product_id, quantity__gte=quantity) for product_id, quantity in quantities.items()))
+        ).update(
+            quantity=F('quantity') - Case(*(When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items())),
+            updated_at=now,
+        )
+        if taken != len(quantities):
+            raise stock_holds.InsufficientStock(stock_holds.available_stock(quantities, user.pk))
+
+        order = Order.objects.create(
+            user=user, shipping_address=shipping_address,
+            total_price=sum((product.price or Decimal(0)) * quantities[product.pk] for product in products),
+        )
+        lines = OrderProduct.objects.bulk_create([
+            OrderProduct(order=order, product=product, quantity=quantities[product.pk], price=product.price or Decimal(0))
+            for product in products
+        ])
+        ShoppingCart.objects.filter(pk=cart_id).update(status=CartStatus.ORDERED, updated_at=now)
+
+        for product in products:
+            product.quantity -= quantities[product.pk]
+            product.updated_at = now
+        products_stock_taken.send(sender=Product, instances=products)
+        record_order(order, 1)
+        queue_sale_notifications(lines)
+    return order
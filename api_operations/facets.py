@@ -0,0 +1,188 @@
+"""
+Facet counts for the product catalog.
+
+ProductFacetCount holds, per category, how many in-stock products carry each
+brand, condition, decade, country of origin and price bucket. Product writes
+apply +1/-1 deltas to the rows they touch, so reading the facets of a category
+(or of the whole catalog) is an indexed lookup on a small table. A delta
+that finds no row to subtract from means the table has drifted; it is
+logged, and rebuild_facet_counts recomputes the table from the catalog.
+"""
+import logging
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Case, CharField, Count, F, Sum, Value, When
+
+from .models import Product, ProductFacetCount
+
+
+FACETS = ('brand', 'condition', 'decade', 'country_of_origin', 'price')
+
+# (lower bound, upper bound) of each price bucket, upper bound excluded
+PRICE_BUCKETS = ((0, 50), (50, 100), (100, 250), (250, 500), (500, 1000), (1000, None))
+
+# Model columns a product's facets are computed from
+SOURCE_FIELDS = ('category_id', 'brand', 'condition', 'produced_year', 'country_of_origin', 'price', 'quantity')
+
+UNCATEGORIZED = 0
+
+logger = logging.getLogger(__name__)
+
+
+def price_bucket_label(lower, upper):
+    return f'{lower}+' if upper is None else f'{lower}-{upper}'
+
+
+def price_bucket(price):
+    for lower, upper in PRICE_BUCKETS:
+        if price >= lower and (upper is None or price < upper):
+            return price_bucket_label(lower, upper)
+    return None
+
+
+def decade_label(year):
+    return f'{year // 10 * 10}s'
+
+
+def current_facet_values(product):
+    return {field: getattr(product, field) for field in SOURCE_FIELDS}
+
+
+def loaded_facet_values(product):
+    """The facet source values the product was loaded with, or None if unknown."""
+    loaded = getattr(product, '_loaded_values', None)
+    if not loaded or any(field not in loaded for field in SOURCE_FIELDS):
+        return None
+    return {field: loaded[field] for field in SOURCE_FIELDS}
+
+
+def stored_facet_values(product_id):
+    """The facet source values of the product's row as stored, or None if there is no such row."""
+    return Product.objects.filter(pk=product_id).values(*SOURCE_FIELDS).first()
+
+
+def previous_facet_values(product):
+    """
+    The facet source values the product had before the write in progress: the loaded ones, or those read by
+    remember_stored_facet_values when the instance was built by hand or loaded with deferred fields.
+    """
+    return loaded_facet_values(product) or getattr(product, '_stored_facet_values', None)
+
+
+def product_facets(values):
+    """Return the (category_key, facet, value) keys a product contributes to."""
+    if values is None or not values['quantity']:
+        return []
+    category_key = values['category_id'] or UNCATEGORIZED
+    facets = {
+        'brand': values['brand'],
+        'condition': values['condition'],
+        'decade': decade_label(values['produced_year']) if values['produced_year'] is not None else None,
+        'country_of_origin': values['country_of_origin'],
+        'price': price_bucket(values['price']) if values['price'] is not None else None,
+    }
+    return [(category_key, facet, value) for facet, value in facets.items() if value]
+
+
+def apply_changes(changes):
+    """Apply (previous values, new values) pairs, where None means "not in the catalog"."""
+    deltas = Counter()
+    for previous, current in changes:
+        deltas.subtract(product_facets(previous))
+        deltas.update(product_facets(current))
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    with transaction.atomic():
+        for (category_key, facet, value), delta in deltas.items():
+            updated = ProductFacetCount.objects.filter(
+                category_key=category_key, facet=facet, value=value,
+            ).update(count=F('count') + delta)
+            if updated:
+                continue
+            if delta > 0:
+                ProductFacetCount.objects.create(category_key=category_key, facet=facet, value=value, count=delta)
+            else:
+                # the row should have been counted already: the table has drifted from the catalog
+                logger.warning('No facet count for %s=%r in category %s to subtract %d from; '
+                               'run rebuild_facet_counts', facet, value, category_key, -delta)
+
+
+def merge_category_into_uncategorized(category_id):
+    rows = list(ProductFacetCount.objects.filter(category_key=category_id).values_list('facet', 'value', 'count'))
+    with transaction.atomic():
+        ProductFacetCount.objects.filter(category_key=category_id).delete()
+        for facet, value, count in rows:
+            updated = ProductFacetCount.objects.filter(
+                category_key=UNCATEGORIZED, facet=facet, value=value,
+            ).update(count=F('count') + count)
+            if not updated:
+                ProductFacetCount.objects.create(category_key=UNCATEGORIZED, facet=facet, value=value, count=count)
+
+
+def rebuild_facet_counts(batch_size=2000):
+    """Recompute the whole facet table from the Product table. Returns the number of rows written."""
+    counts = Counter()
+    for values in Product.objects.values(*SOURCE_FIELDS).iterator(chunk_size=batch_size):
+        counts.update(product_facets(values))
+    with transaction.atomic():
+        ProductFacetCount.objects.all().delete()
+        ProductFacetCount.objects.bulk_create(
+            [ProductFacetCount(category_key=category_key, facet=facet, value=value, count=count)
+             for (category_key, facet, value), count in counts.items() if count],
+            batch_size=500,
+        )
+    return len(counts)
+
+
+def _format(rows):
+    facets = defaultdict(list)
+    for facet, value, count in rows:
+        if count > 0:
+            facets[facet].append({'value': value, 'count': count})
+    return {facet: sorted(facets[facet], key=lambda item: (-item['count'], item['value'])) for facet in FACETS}
+
+
+def precomputed_facet_counts(category_id=None):
+    """Facet counts of the whole catalog, or of one category, read from the facet table."""
+    rows = ProductFacetCount.objects.filter(count__gt=0)
+    if category_id is not None:
+        rows = rows.filter(category_key=category_id).values_list('facet', 'value', 'count')
+    else:
+        rows = rows.values('facet', 'value').annotate(total=Sum('count')).values_list('facet', 'value', 'total')
+    return _format(rows)
+
+
+def queryset_facet_counts(queryset):
+    """Facet counts computed with GROUP BY queries, for filter sets the facet table does not cover."""
+    queryset = queryset.filter(quantity__gt=0)
+    rows = []
+    for facet in ('brand', 'condition', 'country_of_origin'):
+        rows.extend(
+            (facet, value, count) for value, count in
+            queryset.exclude(**{f'{facet}__isnull': True}).exclude(**{facet: ''})
+            .values_list(facet).annotate(count=Count('pk')).order_by()
+        )
+
+    decades = (
+        queryset.exclude(produced_year__isnull=True)
+        .annotate(decade=F('produced_year') / 10 * 10)
+        .values_list('decade').annotate(count=Count('pk')).order_by()
+    )
+    rows.extend(('decade', decade_label(decade), count) for decade, count in decades)
+
+    bucket = Case(
+        *(When(price__gte=lower, **({'price__lt': upper} if upper is not None else {}),
+               then=Value(price_bucket_label(lower, upper)))
+          for lower, upper in PRICE_BUCKETS),
+        output_field=CharField(),
+    )
+    prices = (
+        queryset.exclude(price__isnull=True)
+        .annotate(bucket=bucket)
+        .values_list('bucket').annotate(count=Count('pk')).order_by()
+    )
+    rows.extend(('price', label, count) for label, count in prices if label)
+    return _format(rows)
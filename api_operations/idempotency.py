@@ -0,0 +1,150 @@
+"""
+Idempotency keys for the POSTs that create orders and take payments.
+
+A client that sends an Idempotency-Key header may retry the request after a
+timeout without doing its work twice.
+
+- The first request with a key inserts a Pending IdempotencyKey row before
+  running the view. The row is unique per user and key, so there is exactly
+  one first request, whichever process it lands on.
+- Its response is then stored on the row, which becomes Complete. A retry
+  gets the stored response back, with an Idempotent-Replayed header.
+- A retry that finds the row still Pending polls until it completes, for up
+  to IDEMPOTENCY_WAIT seconds, and then gets a 409.
+- A key sent again with a different method, path or body gets a 422.
+- Server errors and exceptions are not stored. Their row is deleted, so the
+  retry runs the view again.
+
+A request that died without finishing leaves a Pending row behind. It expires
+after IDEMPOTENCY_LOCK_TIMEOUT seconds, and the next request with the key
+takes it over. Complete rows expire after IDEMPOTENCY_KEY_TTL seconds, and
+purge_expired deletes them.
+"""
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey, IdempotencyStatus
+
+
+HEADER = 'Idempotency-Key'
+
+
+class KeyReused(Exception):
+    """The key was first sent with a different request."""
+
+
+class KeyInProgress(Exception):
+    """The first request with the key was still running after IDEMPOTENCY_WAIT seconds."""
+
+
+def fingerprint(request):
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    body = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def begin(user_id, key, request_fingerprint):
+    """
+    Claim `key` for a new request and return None, or return the Complete IdempotencyKey of the earlier request.
+    Waits while another request holds the key. Raises KeyReused or KeyInProgress.
+    """
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+    while True:
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(
+                    user_id=user_id, key=key, fingerprint=request_fingerprint,
+                    expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT),
+                )
+            return None
+        except IntegrityError:
+            pass
+
+        record = IdempotencyKey.objects.filter(user_id=user_id, key=key).first()
+        if record is None:
+            continue
+        if record.expires_at <= now:
+            # forgotten, or left behind by a request that died; the next create takes it over
+            IdempotencyKey.objects.filter(pk=record.pk, expires_at__lte=now).delete()
+            continue
+        if record.fingerprint != request_fingerprint:
+            raise KeyReused(key)
+        if record.status == IdempotencyStatus.COMPLETE:
+            return record
+        if time.monotonic() >= deadline:
+            raise KeyInProgress(key)
+        time.sleep(settings.IDEMPOTENCY_POLL_INTERVAL)
+
+
+def finish(user_id, key, response):
+    """Store the response of the request holding `key`, or give the key up when there is nothing to replay."""
+    keys = IdempotencyKey.objects.filter(user_id=user_id, key=key, status=IdempotencyStatus.PENDING)
+    if response is None or response.status_code >= 500 or not hasattr(response, 'data'):
+        keys.delete()
+        return
+    keys.update(
+        status=IdempotencyStatus.COMPLETE,
+        status_code=response.status_code,
+        response_body=json.loads(json.dumps(response.data, cls=DjangoJSONEncoder)),
+        expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+    )
+
+
+def replay(record):
+    return Response(record.response_body, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent(view):
+    """
+    Make a DRF view method, decorated with method_decorator, safe to retry with an Idempotency-Key header.
+    Requests without the header run as before. Meant for authenticated views: keys are scoped to the user.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view(request, *args, **kwargs)
+        if not key or len(key) > 255:
+            return Response({'error': f'{HEADER} must be 1 to 255 characters'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            record = begin(request.user.pk, key, fingerprint(request))
+        except KeyReused:
+            return Response({'error': f'{HEADER} was already used for a different request'},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        except KeyInProgress:
+            return Response({'error': f'A request with this {HEADER} is still in progress'},
+                            status=status.HTTP_409_CONFLICT)
+        if record is not None:
+            return replay(record)
+
+        response = None
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            finish(request.user.pk, key, response)
+        return response
+    return wrapper
+
+
+def purge_expired(batch_size=1000):
+    """Delete expired keys, `batch_size` at a time. Returns the count."""
+    deleted = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
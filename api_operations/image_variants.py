@@ -0,0 +1,199 @@
+"""
+Resized and recompressed variants of uploaded images.
+
+When a product, category or profile image changes, the original is rendered
+into a few fixed sizes (WebP plus a JPEG or PNG fallback) in a process pool,
+off the request thread. The results are stored through the default storage
+and recorded on the instance's `image_variants` field:
+
+    {
+        'source': 'product_images/snes.jpg',
+        'thumbnail': {'webp': 'variants/product/12/thumbnail.webp', 'fallback': 'variants/product/12/thumbnail.jpg'},
+        'card': {...},
+        'full': {...},
+    }
+"""
+import io
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .signals import image_variants_ready
+
+logger = logging.getLogger(__name__)
+
+
+# Longest side, in pixels, of each variant. Images are never upscaled.
+VARIANT_SIZES = {
+    'thumbnail': 150,
+    'card': 480,
+    'full': 1200,
+}
+
+WEBP_OPTIONS = {'quality': 80, 'method': 4}
+JPEG_OPTIONS = {'quality': 82, 'optimize': True, 'progressive': True}
+PNG_OPTIONS = {'optimize': True}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def render_variants(data):
+    """
+    Render every variant of the encoded image `data`.
+    Runs in a worker process, so it only deals with bytes.
+    Returns {variant: {'webp': (bytes, 'webp'), 'fallback': (bytes, 'jpg' or 'png')}}.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    rendered = {}
+    for variant, size in VARIANT_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+
+        webp = io.BytesIO()
+        resized.save(webp, 'WEBP', **WEBP_OPTIONS)
+        fallback = io.BytesIO()
+        if has_alpha:
+            resized.save(fallback, 'PNG', **PNG_OPTIONS)
+            fallback_extension = 'png'
+        else:
+            resized.save(fallback, 'JPEG', **JPEG_OPTIONS)
+            fallback_extension = 'jpg'
+        rendered[variant] = {
+            'webp': (webp.getvalue(), 'webp'),
+            'fallback': (fallback.getvalue(), fallback_extension),
+        }
+    return rendered
+
+
+def get_executor():
+    """The shared process pool, or None when IMAGE_VARIANT_WORKERS is 0 (render inline)."""
+    global _executor
+    workers = settings.IMAGE_VARIANT_WORKERS
+    if workers <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=workers)
+        return _executor
+
+
+def needs_variants(instance, field_name):
+    image = getattr(instance, field_name)
+    return (image.name or None) != instance.image_variants.get('source')
+
+
+def schedule_variants(instance, field_name):
+    """Render the variants of `instance.<field_name>` once the current transaction commits."""
+    if not needs_variants(instance, field_name):
+        return
+    source = getattr(instance, field_name).name or None
+    transaction.on_commit(partial(_submit, type(instance), instance.pk, field_name, source))
+
+
+def _submit(model, pk, field_name, source):
+    if source is None:
+        _record(model, pk, field_name, None, None)
+        return
+    try:
+        with default_storage.open(source, 'rb') as handle:
+            data = handle.read()
+    except OSError:
+        logger.exception('Cannot read %s to render its variants', source)
+        return
+
+    executor = get_executor()
+    if executor is None:
+        _store(model, pk, field_name, source, render_variants(data))
+        return
+    future = executor.submit(render_variants, data)
+    future.add_done_callback(partial(_on_rendered, model, pk, field_name, source))
+
+
+def _on_rendered(model, pk, field_name, source, future):
+    # Runs in the pool's management thread, which has its own database connection
+    try:
+        _store(model, pk, field_name, source, future.result())
+    except Exception:
+        logger.exception('Rendering variants of %s failed', source)
+    finally:
+        connections.close_all()
+
+
+def _store(model, pk, field_name, source, rendered):
+    prefix = f'variants/{model._meta.model_name}/{pk}'
+    variants = {'source': source}
+    for variant, formats in rendered.items():
+        variants[variant] = {
+            kind: default_storage.save(f'{prefix}/{variant}.{extension}', ContentFile(content))
+            for kind, (content, extension) in formats.items()
+        }
+    if not _record(model, pk, field_name, source, variants):
+        # the image was replaced while rendering, its own job records the newer variants
+        _delete_files(variants)
+
+
+def _record(model, pk, field_name, source, variants):
+    previous = model._default_manager.filter(pk=pk).values_list('image_variants', flat=True).first()
+    changes = {'image_variants': variants or {}}
+    if any(field.name == 'updated_at' for field in model._meta.concrete_fields):
+        changes['updated_at'] = timezone.now()
+    # only record the variants if the row still holds the image they were rendered from
+    rows = model._default_manager.filter(pk=pk)
+    if source is None:
+        rows = rows.filter(Q(**{field_name: ''}) | Q(**{f'{field_name}__isnull': True}))
+    else:
+        rows = rows.filter(**{field_name: source})
+    if not rows.update(**changes):
+        return False
+    if previous:
+        _delete_files(previous)
+    image_variants_ready.send(sender=model, pk=pk)
+    return True
+
+
+def _delete_files(variants):
+    for variant, formats in variants.items():
+        if variant == 'source':
+            continue
+        for name in formats.values():
+            default_storage.delete(name)
+
+
+def generate_missing_variants(workers=0):
+    """Render variants for every stored image that has none (or stale ones). Returns the number of images rendered."""
+    from .models import Category, Product, UserProfile
+
+    jobs = []
+    for model, field_name in ((Product, 'image'), (Category, 'image'), (UserProfile, 'profile_picture')):
+        rows = model._default_manager.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+        for pk, source, variants in rows.values_list('pk', field_name, 'image_variants').iterator():
+            if (variants or {}).get('source') != source and default_storage.exists(source):
+                jobs.append((model, pk, field_name, source))
+
+    def read(job):
+        with default_storage.open(job[3], 'rb') as handle:
+            return handle.read()
+
+    if workers > 0:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for job, rendered in zip(jobs, executor.map(render_variants, map(read, jobs))):
+                _store(*job, rendered)
+    else:
+        for job in jobs:
+            _store(*job, render_variants(read(job)))
+    return len(jobs)
@@ -0,0 +1,114 @@
+"""
+Denormalized product cards.
+
+A product card shows the product's own fields together with its category
+name, seller username, tags, stock state and wishlist count, which live in
+five tables. ProductListing keeps all of it in one row per product, so the
+catalog lists, category pages and search results page through a single
+indexed table with no joins or prefetches.
+
+Rows are rebuilt from the source tables by refresh_listings() whenever a
+product is saved, imported or gets its image variants, and patched in place
+when a category or seller is renamed or a wishlist changes (see the receivers
+in models.py). Writes that bypass signals, such as queryset.update(), leave
+the rows stale until the next refresh or rebuild_listings.
+"""
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .catalog_cache import bump_versions
+from .models import Product, ProductListing, ProductTag, UserProfile
+
+
+# Columns copied as they are from Product
+PRODUCT_FIELDS = (
+    'name', 'brand', 'model', 'produced_year', 'country_of_origin', 'description', 'keywords', 'condition',
+    'price', 'publishing_date', 'updated_at', 'quantity', 'image', 'image_variants', 'category_id', 'user_id',
+)
+UPDATE_FIELDS = [field.name for field in ProductListing._meta.concrete_fields if not field.primary_key]
+
+Wishlist = UserProfile.wishlist.through
+
+
+def build_listings(product_ids):
+    """Unsaved ProductListing rows of `product_ids`, read from the source tables in three queries."""
+    products = (
+        Product.objects.filter(pk__in=product_ids)
+        .values('id', *PRODUCT_FIELDS, 'category__name', 'user__username')
+    )
+    tags = {}
+    for product_id, slug in (
+        ProductTag.objects.filter(product_id__in=product_ids).order_by('tag__slug').values_list('product_id', 'tag__slug')
+    ):
+        tags.setdefault(product_id, []).append(slug)
+    wishlist_counts = dict(
+        Wishlist.objects.filter(product_id__in=product_ids)
+        .values_list('product_id').annotate(count=Count('pk')).order_by()
+    )
+    return [
+        ProductListing(
+            id=row['id'],
+            **{field: row[field] for field in PRODUCT_FIELDS},
+            tags=tags.get(row['id'], []),
+            category_name=row['category__name'],
+            seller_username=row['user__username'],
+            in_stock=row['quantity'] > 0,
+            wishlist_count=wishlist_counts.get(row['id'], 0),
+        )
+        for row in products
+    ]
+
+
+def refresh_listings(product_ids, batch_size=1000):
+    """Rewrite the listings of `product_ids` from the source tables, dropping those of deleted products."""
+    product_ids = list(dict.fromkeys(product_ids))
+    with transaction.atomic():
+        for start in range(0, len(product_ids), batch_size):
+            batch = product_ids[start:start + batch_size]
+            listings = build_listings(batch)
+            ProductListing.objects.filter(pk__in=set(batch) - {listing.id for listing in listings}).delete()
+            ProductListing.objects.bulk_create(
+                listings, update_conflicts=True, unique_fields=['id'], update_fields=UPDATE_FIELDS,
+            )
+
+
+def rebuild_listings(batch_size=1000):
+    """Repopulate the whole table in one transaction, so readers never see it half empty. Returns the row count."""
+    product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+    with transaction.atomic():
+        ProductListing.objects.all().delete()
+        for start in range(0, len(product_ids), batch_size):
+            ProductListing.objects.bulk_create(build_listings(product_ids[start:start + batch_size]))
+    return len(product_ids)
+
+
+def update_category_name(category_id, name):
+    ProductListing.objects.filter(category_id=category_id).update(category_name=name)
+
+
+def update_seller_username(user_id, username):
+    # runs on every user save (logins update last_login), so only touch rows that changed
+    renamed = ProductListing.objects.filter(user_id=user_id).exclude(seller_username=username)
+    category_ids = set(renamed.values_list('category_id', flat=True))
+    if not category_ids:
+        return
+    renamed.update(seller_username=username)
+    bump_versions(*(f'category_products:{category_id}' for category_id in category_ids if category_id))
+
+
+def update_wishlist_counts(product_ids):
+    product_ids = set(product_ids or ())
+    if not product_ids:
+        return
+    count = (
+        Wishlist.objects.filter(product_id=OuterRef('pk'))
+        .values('product_id').annotate(count=Count('pk')).values('count')
+    )
+    listings = ProductListing.objects.filter(pk__in=product_ids)
+    listings.update(wishlist_count=Coalesce(Subquery(count), 0))
+    # cached category pages show the counts too
+    bump_versions(*{
+        f'category_products:{category_id}'
+        for category_id in listings.values_list('category_id', flat=True) if category_id
+    })
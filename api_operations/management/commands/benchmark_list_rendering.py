@@ -0,0 +1,112 @@
+# benchmark_list_rendering.py
+
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from api_operations.models import Category, CustomUser, Order, OrderProduct, Product, ProductTag, Tag
+from api_operations.renderers import MessagePackRenderer, ORJSONRenderer
+from api_operations.serializers import OrderSerializer, ProductSerializer
+from api_operations.values_serializers import OrderValuesSerializer, ProductValuesSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+def seed(products, orders):
+    """Bulk-create a catalog of `products` products and `orders` orders of three lines each."""
+    user = CustomUser.objects.create_user(username='benchmark-list-rendering')
+    categories = Category.objects.bulk_create([Category(name=f'Benchmark {i}') for i in range(20)])
+    tags = Tag.objects.bulk_create([Tag(name=f'benchmark {i}', slug=f'benchmark-{i}') for i in range(50)])
+    created = Product.objects.bulk_create([
+        Product(
+            name=f'Benchmark product {i}', brand=f'Brand {i % 40}', model=f'Model {i % 300}',
+            produced_year=1950 + i % 70, country_of_origin='Japan',
+            description='Vintage benchmark item in good working order. ' * 4,
+            keywords=f'benchmark {i % 50}, benchmark {(i + 7) % 50}', price=Decimal(10 + i % 500),
+            quantity=1 + i % 5, category=categories[i % len(categories)], user=user,
+        )
+        for i in range(products)
+    ], batch_size=1000)
+    ProductTag.objects.bulk_create([
+        ProductTag(product=product, tag=tags[(i + offset) % len(tags)])
+        for i, product in enumerate(created) for offset in (0, 7)
+    ], batch_size=2000)
+    created_orders = Order.objects.bulk_create([
+        Order(user=user, total_price=Decimal(30), shipping_address='1 Benchmark Street') for _ in range(orders)
+    ], batch_size=1000)
+    OrderProduct.objects.bulk_create([
+        OrderProduct(order=order, product=created[(i * 3 + line) % len(created)], quantity=1, price=Decimal(10))
+        for i, order in enumerate(created_orders) for line in range(3)
+    ], batch_size=2000)
+    return user
+
+
+def timed(repeat, function):
+    """(result, best wall time in ms) of `repeat` calls."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+class Command(BaseCommand):
+    help = ('Times serializing and rendering product and order lists through the model serializers '
+            'and through the values() fast path, on a throwaway catalog that is rolled back afterwards')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000, help='Number of products to list')
+        parser.add_argument('--orders', type=int, default=1000, help='Number of orders (three lines each) to list')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs of each variant, the best one is reported')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user = seed(options['products'], options['orders'])
+                self.stdout.write(f"{options['products']} products, {options['orders']} orders")
+                request = Request(APIRequestFactory().get('/api/products/'))
+                products = Product.objects.filter(user=user).order_by('-publishing_date', '-id')
+                orders = Order.objects.filter(user=user).order_by('-order_date', '-id')
+                self.compare('products', products, ProductSerializer, ProductValuesSerializer, request, options['repeat'])
+                self.compare('orders', orders, OrderSerializer, OrderValuesSerializer, request, options['repeat'])
+                raise Rollback
+        except Rollback:
+            self.stdout.write(self.style.SUCCESS('Benchmark data rolled back'))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Benchmark failed: {e}'))
+
+    def compare(self, label, queryset, serializer_class, values_serializer_class, request, repeat):
+        context = {'request': request}
+
+        def serialize():
+            return serializer_class(serializer_class.setup_eager_loading(queryset), many=True, context=context).data
+
+        def serialize_values():
+            values_serializer = values_serializer_class(context)
+            return values_serializer.represent(values_serializer.values(queryset))
+
+        data, serializer_ms = timed(repeat, serialize)
+        values_data, values_ms = timed(repeat, serialize_values)
+        if JSONRenderer().render(values_data) != JSONRenderer().render(data):
+            raise ValueError(f'the {label} fast path does not match {serializer_class.__name__}')
+
+        rows = [
+            ('ModelSerializer + JSONRenderer', serializer_ms, JSONRenderer(), data),
+            ('values() + JSONRenderer', values_ms, JSONRenderer(), values_data),
+            ('values() + ORJSONRenderer', values_ms, ORJSONRenderer(), values_data),
+            ('values() + MessagePackRenderer', values_ms, MessagePackRenderer(), values_data),
+        ]
+        self.stdout.write(f'\n{label + ":":<32} {"serialize":>11} {"render":>10} {"total":>10} {"bytes":>11}')
+        for name, serialize_ms, renderer, rendered_data in rows:
+            body, render_ms = timed(repeat, lambda: renderer.render(rendered_data))
+            self.stdout.write(
+                f'{name:<32} {serialize_ms:8.1f} ms {render_ms:7.1f} ms {serialize_ms + render_ms:7.1f} ms {len(body):11,}'
+            )
@@ -0,0 +1,64 @@
+# explain_catalog_queries.py
+
+import re
+import time
+
+from django.core.management.base import BaseCommand
+from django.http import QueryDict
+from api_operations.models import Category, ProductListing
+from api_operations.pagination import ProductCursorPagination
+from api_operations.views import ProductListingFilter
+
+
+INDEX_RE = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+
+
+def catalog_queries(category_id):
+    """(label, filter params, ordering) of the catalog pages the listing indexes are meant to serve."""
+    return [
+        ('newest first', {}, ('-publishing_date', '-id')),
+        ('category, newest first', {'category': category_id}, ('-publishing_date', '-id')),
+        ('category, published after', {'category': category_id, 'published_after': '2000-01-01T00:00:00Z'},
+         ('-publishing_date', '-id')),
+        ('price range', {'price_min': 50, 'price_max': 250}, ('price', 'id')),
+        ('category, price range', {'category': category_id, 'price_min': 50, 'price_max': 250}, ('price', 'id')),
+        ('condition, cheapest first', {'condition': 'Excellent', 'price_max': 100}, ('price', 'id')),
+        ('year range', {'year_min': 1970, 'year_max': 1979}, ('produced_year', 'id')),
+    ]
+
+
+def catalog_queryset(params, ordering):
+    query = QueryDict(mutable=True)
+    query.update(params)
+    queryset = ProductListingFilter(query, queryset=ProductListing.objects.all()).qs
+    # one cursor page, as ProductList reads it
+    return queryset.order_by(*ordering)[:ProductCursorPagination.page_size + 1]
+
+
+def used_indexes(queryset):
+    return INDEX_RE.findall(queryset.explain())
+
+
+class Command(BaseCommand):
+    help = 'Prints the query plan and timing of the indexed catalog filters against the current database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Runs of each query to average the timing over')
+        parser.add_argument('--plans', action='store_true', help='Print the full query plans')
+
+    def handle(self, *args, **options):
+        category_id = Category.objects.values_list('pk', flat=True).first() or 1
+        self.stdout.write(f'{ProductListing.objects.count()} products')
+
+        for label, params, ordering in catalog_queries(category_id):
+            queryset = catalog_queryset(params, ordering)
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                list(queryset.all())
+            elapsed_ms = (time.perf_counter() - started) * 1000 / max(options['repeat'], 1)
+
+            indexes = used_indexes(queryset)
+            line = f'{label:<28} {elapsed_ms:8.2f} ms  {", ".join(indexes) or "no index (full scan)"}'
+            self.stdout.write(self.style.SUCCESS(line) if indexes else self.style.WARNING(line))
+            if options['plans']:
+                self.stdout.write(queryset.explain())
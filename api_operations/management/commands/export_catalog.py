@@ -0,0 +1,53 @@
+# export_catalog.py
+
+import sys
+
+from django.core.management.base import BaseCommand
+from api_operations.catalog_export import (
+    EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_chunks, gzip_stream, parse_updated_since, render_export,
+)
+
+
+class Command(BaseCommand):
+    help = 'Streams the catalog as NDJSON or CSV to a file or stdout, reading the products in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='ndjson', help='Output format')
+        parser.add_argument('--output', help='File to write, stdout when omitted')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output')
+        parser.add_argument('--updated-since', help='Only export products changed since this ISO 8601 date or datetime')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE, help='Products read per query')
+
+    def handle(self, *args, **options):
+        # progress goes to stderr when the export itself goes to stdout
+        messages = self.stderr if options['output'] is None else self.stdout
+        updated_since = None
+        if options['updated_since']:
+            try:
+                updated_since = parse_updated_since(options['updated_since'])
+            except ValueError:
+                messages.write(self.style.ERROR('--updated-since must be an ISO 8601 date or datetime'))
+                return
+
+        exported = 0
+
+        def counted(chunks):
+            nonlocal exported
+            for products in chunks:
+                exported += len(products)
+                yield products
+
+        try:
+            content = render_export(options['format'], counted(export_chunks(updated_since, chunk_size=options['chunk_size'])))
+            if options['gzip']:
+                content = gzip_stream(content)
+            output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+            try:
+                for data in content:
+                    output.write(data)
+            finally:
+                if options['output']:
+                    output.close()
+            messages.write(self.style.SUCCESS(f'Exported {exported} products'))
+        except Exception as e:
+            messages.write(self.style.ERROR(f'Error exporting the catalog: {e}'))
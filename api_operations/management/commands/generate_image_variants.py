@@ -0,0 +1,18 @@
+# generate_image_variants.py
+
+from django.core.management.base import BaseCommand
+from api_operations.image_variants import generate_missing_variants
+
+
+class Command(BaseCommand):
+    help = 'Renders the resized variants of product, category and profile images that have none yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=0, help='Worker processes, 0 renders in this process')
+
+    def handle(self, *args, **options):
+        try:
+            rendered = generate_missing_variants(workers=options['workers'])
+            self.stdout.write(self.style.SUCCESS(f'Rendered variants for {rendered} images'))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error rendering image variants: {e}'))
@@ -0,0 +1,36 @@
+# import_products.py
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from api_operations.models import CustomUser
+from api_operations.product_import import DEFAULT_BATCH_SIZE, IMPORT_FORMATS, detect_format, import_products
+
+
+class Command(BaseCommand):
+    help = 'Imports products from a CSV or JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file to import')
+        parser.add_argument('--user', required=True, help='Username of the seller that will own the products')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='File format, detected from the extension by default')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows written per transaction')
+
+    def handle(self, *args, **options):
+        try:
+            user = CustomUser.objects.get(username=options['user'])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f'User "{options["user"]}" does not exist')
+
+        import_format = options['format'] or detect_format(options['path'])
+        started = time.monotonic()
+        with open(options['path'], 'rb') as stream:
+            result = import_products(stream, user, import_format, batch_size=options['batch_size'])
+        elapsed = time.monotonic() - started
+
+        for error in result['errors']:
+            self.stdout.write(self.style.WARNING(f'Row {error["row"]}: {error["errors"]}'))
+        rate = result['created'] / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {result["created"]} products in {elapsed:.2f}s ({rate:.0f} rows/s), '
+            f'{len(result["errors"])} rows rejected'))
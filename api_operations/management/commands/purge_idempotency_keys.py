@@ -0,0 +1,18 @@
+# purge_idempotency_keys.py
+
+from django.core.management.base import BaseCommand
+from api_operations.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Deletes the expired idempotency keys and the responses stored with them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Keys deleted per transaction')
+
+    def handle(self, *args, **options):
+        try:
+            deleted = purge_expired(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired idempotency keys'))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error purging idempotency keys: {e}'))
@@ -0,0 +1,43 @@
+# purge_stale_carts.py
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from api_operations.cart_purge import purge_stale_carts
+
+
+class Command(BaseCommand):
+    help = ('Deletes the shopping carts that have not changed for CART_RETENTION_DAYS, in short chunked '
+            'transactions, once or continuously with --interval')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Carts deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to wait between chunks')
+        parser.add_argument('--interval', type=float, help='Purge again every this many seconds, until interrupted')
+        parser.add_argument('--progress-every', type=float, default=5, help='Seconds between progress reports')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                self.purge(options)
+                if not options['interval']:
+                    return
+                connections.close_all()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error purging stale carts: {e}'))
+
+    def purge(self, options):
+        carts = lines = 0
+        started = reported = time.monotonic()
+        for chunk_carts, chunk_lines in purge_stale_carts(options['batch_size'], options['pause']):
+            carts += chunk_carts
+            lines += chunk_lines
+            if time.monotonic() - reported >= options['progress_every']:
+                reported = time.monotonic()
+                self.stdout.write(f'Purged {carts} carts and {lines} lines so far')
+        self.stdout.write(self.style.SUCCESS(
+            f'Purged {carts} stale carts and {lines} lines in {time.monotonic() - started:.1f} s'))
@@ -0,0 +1,15 @@
+# rebuild_facets.py
+
+from django.core.management.base import BaseCommand
+from api_operations.facets import rebuild_facet_counts
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the product facet counts from the Product table'
+
+    def handle(self, *args, **kwargs):
+        try:
+            rows = rebuild_facet_counts()
+            self.stdout.write(self.style.SUCCESS(f'Facet counts rebuilt ({rows} rows)'))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error rebuilding facet counts: {e}'))
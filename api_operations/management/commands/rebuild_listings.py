@@ -0,0 +1,18 @@
+# rebuild_listings.py
+
+from django.core.management.base import BaseCommand
+from api_operations.listings import rebuild_listings
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the denormalized product cards (ProductListing) the catalog lists are served from'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Products read per batch')
+
+    def handle(self, *args, **options):
+        try:
+            listings = rebuild_listings(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Product listings rebuilt ({listings} products)'))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error rebuilding product listings: {e}'))
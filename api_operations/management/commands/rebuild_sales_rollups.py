@@ -0,0 +1,15 @@
+# rebuild_sales_rollups.py
+
+from django.core.management.base import BaseCommand
+from api_operations.sales_rollups import rebuild_sales_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the seller and product daily sales rollups from the orders'
+
+    def handle(self, *args, **kwargs):
+        try:
+            sellers, products = rebuild_sales_rollups()
+            self.stdout.write(self.style.SUCCESS(f'Sales rollups rebuilt ({sellers} seller days, {products} product days)'))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error rebuilding sales rollups: {e}'))
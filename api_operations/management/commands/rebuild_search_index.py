@@ -0,0 +1,18 @@
+# rebuild_search_index.py
+
+from django.core.management.base import BaseCommand
+from api_operations.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the product search index from the Product table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of products indexed per transaction')
+
+    def handle(self, *args, **options):
+        try:
+            indexed = rebuild_index(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Search index rebuilt for {indexed} products'))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error rebuilding search index: {e}'))
@@ -0,0 +1,27 @@
+# rebuild_similar_products.py
+
+import time
+
+from django.core.management.base import BaseCommand
+from api_operations.similarity import compute_pending, rebuild_similar_products
+
+
+class Command(BaseCommand):
+    help = 'Re-vectorizes every product and recomputes the similar products table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help='Number of products written per transaction')
+        parser.add_argument('--pending', action='store_true',
+                            help='Only compute the neighbour lists left pending by saves, imports and deletes')
+
+    def handle(self, *args, **options):
+        try:
+            started = time.monotonic()
+            if options['pending']:
+                products = compute_pending(batch_size=options['batch_size'])
+            else:
+                products = rebuild_similar_products(batch_size=options['batch_size'])
+            elapsed = time.monotonic() - started
+            self.stdout.write(self.style.SUCCESS(f'Similar products computed for {products} products in {elapsed:.2f}s'))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error rebuilding similar products: {e}'))
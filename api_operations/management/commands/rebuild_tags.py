@@ -0,0 +1,15 @@
+# rebuild_tags.py
+
+from django.core.management.base import BaseCommand
+from api_operations.tags import rebuild_tags
+
+
+class Command(BaseCommand):
+    help = 'Re-splits every product keyword string into tags and recounts the tag cloud'
+
+    def handle(self, *args, **kwargs):
+        try:
+            products = rebuild_tags()
+            self.stdout.write(self.style.SUCCESS(f'Tags rebuilt ({products} products)'))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error rebuilding tags: {e}'))
@@ -0,0 +1,15 @@
+# refresh_trending.py
+
+from django.core.management.base import BaseCommand
+from api_operations.view_counters import refresh_trending
+
+
+class Command(BaseCommand):
+    help = 'Re-ranks the trending products, so views age out of the window even when no new views are flushed'
+
+    def handle(self, *args, **kwargs):
+        try:
+            refresh_trending()
+            self.stdout.write(self.style.SUCCESS('Trending products refreshed'))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error refreshing trending products: {e}'))
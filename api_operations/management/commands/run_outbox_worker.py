@@ -0,0 +1,37 @@
+# run_outbox_worker.py
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from api_operations.outbox import drain, purge_sent
+
+
+class Command(BaseCommand):
+    help = 'Delivers the queued outbox messages (sale notification emails), retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Deliver what is due and exit')
+        parser.add_argument('--interval', type=float, default=2, help='Seconds to wait when nothing is due')
+        parser.add_argument('--batch-size', type=int, default=100, help='Messages claimed at a time')
+
+    def handle(self, *args, **options):
+        try:
+            purged_at = 0
+            while True:
+                delivered, failed = drain(options['batch_size'])
+                if delivered or failed:
+                    self.stdout.write(f'Delivered {delivered} messages, {failed} failed')
+                if time.monotonic() - purged_at > 3600:
+                    purge_sent()
+                    purged_at = time.monotonic()
+                if options['once'] and not (delivered or failed):
+                    self.stdout.write(self.style.SUCCESS('Outbox drained'))
+                    return
+                if not (delivered or failed):
+                    connections.close_all()
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error delivering outbox messages: {e}'))
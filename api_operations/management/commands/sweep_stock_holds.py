@@ -0,0 +1,18 @@
+# sweep_stock_holds.py
+
+from django.core.management.base import BaseCommand
+from api_operations.stock_holds import sweep
+
+
+class Command(BaseCommand):
+    help = 'Deletes the expired stock holds of cart lines, for deployments that run without the sweeper thread'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Holds deleted per transaction')
+
+    def handle(self, *args, **options):
+        try:
+            deleted = sweep(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired stock holds'))
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error sweeping stock holds: {e}'))
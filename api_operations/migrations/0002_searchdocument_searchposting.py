@@ -0,0 +1,65 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:09
+
+import re
+from collections import Counter
+from itertools import islice
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# frozen copies of the weights and tokenizer of api_operations.search as of this migration
+FIELD_WEIGHTS = {'name': 3, 'brand': 2, 'model': 2, 'keywords': 2, 'description': 1}
+TOKEN_RE = re.compile(r'\w+')
+
+
+def index_existing_products(apps, schema_editor):
+    Product = apps.get_model('api_operations', 'Product')
+    SearchDocument = apps.get_model('api_operations', 'SearchDocument')
+    SearchPosting = apps.get_model('api_operations', 'SearchPosting')
+
+    rows = Product.objects.values('id', *FIELD_WEIGHTS).iterator(chunk_size=500)
+    while batch := list(islice(rows, 500)):
+        documents, postings = [], []
+        for row in batch:
+            terms = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in TOKEN_RE.findall((row[field] or '').lower()):
+                    terms[token[:64]] += weight
+            documents.append(SearchDocument(product_id=row['id'], length=sum(terms.values())))
+            postings.extend(
+                SearchPosting(term=term, product_id=row['id'], frequency=frequency) for term, frequency in terms.items()
+            )
+        SearchDocument.objects.bulk_create(documents)
+        SearchPosting.objects.bulk_create(postings, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_operations', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('length', models.PositiveIntegerField(default=0)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='search_document', to='api_operations.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('frequency', models.PositiveIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_postings', to='api_operations.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'product'], name='search_posting_term_idx')],
+            },
+        ),
+        migrations.RunPython(index_existing_products, migrations.RunPython.noop),
+    ]
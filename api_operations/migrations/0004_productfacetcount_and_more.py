@@ -0,0 +1,69 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:13
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+# frozen copy of the facets of api_operations.facets as of this migration
+PRICE_BUCKETS = ((0, 50), (50, 100), (100, 250), (250, 500), (500, 1000), (1000, None))
+
+
+def product_facets(values):
+    if not values['quantity']:
+        return []
+    price = None
+    if values['price'] is not None:
+        for lower, upper in PRICE_BUCKETS:
+            if values['price'] >= lower and (upper is None or values['price'] < upper):
+                price = f'{lower}+' if upper is None else f'{lower}-{upper}'
+                break
+    year = values['produced_year']
+    facets = {
+        'brand': values['brand'],
+        'condition': values['condition'],
+        'decade': f'{year // 10 * 10}s' if year is not None else None,
+        'country_of_origin': values['country_of_origin'],
+        'price': price,
+    }
+    return [(values['category_id'] or 0, facet, value) for facet, value in facets.items() if value]
+
+
+def fill_facet_counts(apps, schema_editor):
+    Product = apps.get_model('api_operations', 'Product')
+    ProductFacetCount = apps.get_model('api_operations', 'ProductFacetCount')
+
+    counts = Counter()
+    for values in Product.objects.values(
+        'category_id', 'brand', 'condition', 'produced_year', 'country_of_origin', 'price', 'quantity',
+    ).iterator(chunk_size=2000):
+        counts.update(product_facets(values))
+    ProductFacetCount.objects.bulk_create([
+        ProductFacetCount(category_key=category_key, facet=facet, value=value, count=count)
+        for (category_key, facet, value), count in counts.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_operations', '0003_order_order_user_date_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category_key', models.PositiveBigIntegerField(default=0)),
+                ('facet', models.CharField(max_length=20)),
+                ('value', models.CharField(max_length=50)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='productfacetcount',
+            constraint=models.UniqueConstraint(fields=('category_key', 'facet', 'value'), name='unique_product_facet_count'),
+        ),
+        migrations.RunPython(fill_facet_counts, migrations.RunPython.noop),
+    ]
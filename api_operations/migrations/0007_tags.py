@@ -0,0 +1,92 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:24
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def parse_keywords(keywords):
+    # a frozen copy of api_operations.tags.parse_keywords as of this migration
+    tags = {}
+    for keyword in (keywords or '').split(','):
+        name = WHITESPACE_RE.sub(' ', keyword).strip().lower()[:50]
+        slug = slugify(name, allow_unicode=True)
+        if slug and slug not in tags:
+            tags[slug] = name
+    return tags
+
+
+def split_keywords(apps, schema_editor):
+    Product = apps.get_model('api_operations', 'Product')
+    Tag = apps.get_model('api_operations', 'Tag')
+    ProductTag = apps.get_model('api_operations', 'ProductTag')
+
+    product_tags = {}
+    names = {}
+    for product_id, keywords in Product.objects.exclude(keywords__isnull=True).values_list('pk', 'keywords').iterator():
+        tags = parse_keywords(keywords)
+        product_tags[product_id] = list(tags)
+        for slug, name in tags.items():
+            names.setdefault(slug, name)
+
+    counts = {slug: 0 for slug in names}
+    for slugs in product_tags.values():
+        for slug in slugs:
+            counts[slug] += 1
+    Tag.objects.bulk_create(
+        [Tag(slug=slug, name=name, product_count=counts[slug]) for slug, name in names.items()], batch_size=500)
+    tag_ids = dict(Tag.objects.values_list('slug', 'pk'))
+    ProductTag.objects.bulk_create(
+        [ProductTag(product_id=product_id, tag_id=tag_ids[slug])
+         for product_id, slugs in product_tags.items() for slug in slugs],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_operations', '0006_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('slug', models.SlugField(allow_unicode=True, unique=True)),
+                ('product_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-product_count', 'slug'], name='tag_cloud_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api_operations.product')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api_operations.tag')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='tags',
+            field=models.ManyToManyField(blank=True, related_name='products', through='api_operations.ProductTag', to='api_operations.tag'),
+        ),
+        migrations.AddIndex(
+            model_name='producttag',
+            index=models.Index(fields=['tag', 'product'], name='product_tag_tag_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='producttag',
+            constraint=models.UniqueConstraint(fields=('product', 'tag'), name='unique_product_tag'),
+        ),
+        migrations.RunPython(split_keywords, migrations.RunPython.noop),
+    ]
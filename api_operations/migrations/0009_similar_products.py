@@ -0,0 +1,45 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_operations', '0008_product_range_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarityDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='similarity_document', serialize=False, to='api_operations.product')),
+                ('neighbours_computed', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductFeature',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('feature', models.CharField(max_length=80)),
+                ('weight', models.FloatField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similarity_features', to='api_operations.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['feature', 'product', 'weight'], name='product_feature_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SimilarProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_products', to='api_operations.product')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api_operations.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', '-score'], name='similar_product_score_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_operations', '0009_similar_products'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductViewCount',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='view_count', serialize=False, to='api_operations.product')),
+                ('views', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrendingProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField(unique=True)),
+                ('views', models.PositiveIntegerField()),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api_operations.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductViewBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.PositiveIntegerField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api_operations.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hour', 'product'], name='product_view_bucket_hour_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='productviewbucket',
+            constraint=models.UniqueConstraint(fields=('product', 'hour'), name='unique_product_view_bucket'),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:54
+
+from itertools import islice
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+PRODUCT_FIELDS = (
+    'name', 'brand', 'model', 'produced_year', 'country_of_origin', 'description', 'keywords', 'condition',
+    'price', 'publishing_date', 'updated_at', 'quantity', 'image', 'image_variants', 'category_id', 'user_id',
+)
+
+
+def fill_listings(apps, schema_editor):
+    Product = apps.get_model('api_operations', 'Product')
+    ProductListing = apps.get_model('api_operations', 'ProductListing')
+    ProductTag = apps.get_model('api_operations', 'ProductTag')
+    Wishlist = apps.get_model('api_operations', 'UserProfile').wishlist.through
+
+    tags = {}
+    for product_id, slug in ProductTag.objects.order_by('tag__slug').values_list('product_id', 'tag__slug').iterator():
+        tags.setdefault(product_id, []).append(slug)
+    wishlist_counts = dict(Wishlist.objects.values_list('product_id').annotate(count=Count('pk')).order_by())
+    rows = Product.objects.values('id', *PRODUCT_FIELDS, 'category__name', 'user__username').iterator(chunk_size=1000)
+    while batch := list(islice(rows, 1000)):
+        ProductListing.objects.bulk_create([
+            ProductListing(
+                id=row['id'],
+                **{field: row[field] for field in PRODUCT_FIELDS},
+                tags=tags.get(row['id'], []),
+                category_name=row['category__name'],
+                seller_username=row['user__username'],
+                in_stock=row['quantity'] > 0,
+                wishlist_count=wishlist_counts.get(row['id'], 0),
+            )
+            for row in batch
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_operations', '0011_product_updated_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductListing',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=50)),
+                ('brand', models.CharField(blank=True, max_length=50, null=True)),
+                ('model', models.CharField(blank=True, max_length=50, null=True)),
+                ('produced_year', models.PositiveIntegerField(blank=True, null=True)),
+                ('country_of_origin', models.CharField(blank=True, max_length=50, null=True)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('keywords', models.CharField(blank=True, max_length=1000, null=True)),
+                ('condition', models.CharField(choices=[('Excellent', 'Excellent'), ('Very Good', 'Very Good'), ('Good', 'Good'), ('Acceptable', 'Acceptable'), ('As-Is', 'As Is')], default='Good', max_length=20)),
+                ('price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('publishing_date', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('quantity', models.PositiveIntegerField()),
+                ('image', models.ImageField(blank=True, null=True, upload_to='product_images/')),
+                ('image_variants', models.JSONField(blank=True, default=dict)),
+                ('tags', models.JSONField(blank=True, default=list)),
+                ('category_name', models.CharField(blank=True, max_length=255, null=True)),
+                ('seller_username', models.CharField(max_length=150)),
+                ('in_stock', models.BooleanField()),
+                ('wishlist_count', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api_operations.category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-publishing_date', '-id'], name='listing_published_idx'), models.Index(fields=['category', '-publishing_date', '-id'], name='listing_category_published_idx'), models.Index(fields=['price', 'id'], name='listing_price_idx'), models.Index(fields=['category', 'price', 'id'], name='listing_category_price_idx'), models.Index(fields=['condition', 'price', 'id'], name='listing_condition_price_idx'), models.Index(fields=['produced_year', 'id'], name='listing_year_idx')],
+            },
+        ),
+        migrations.RunPython(fill_listings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-18 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_operations', '0012_product_listings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
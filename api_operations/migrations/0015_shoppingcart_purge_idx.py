@@ -0,0 +1,17 @@
+# Generated by Django 5.0.3 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_operations', '0014_stock_holds'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shoppingcart',
+            index=models.Index(fields=['status', 'updated_at'], name='cart_status_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.0.3 on 2026-10-18 13:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def fill_sales_rollups(apps, schema_editor):
+    OrderProduct = apps.get_model('api_operations', 'OrderProduct')
+    SellerDailySales = apps.get_model('api_operations', 'SellerDailySales')
+    ProductDailySales = apps.get_model('api_operations', 'ProductDailySales')
+
+    def rows(*group_by):
+        return (
+            OrderProduct.objects.exclude(order__status='Cancelled')
+            .values(*group_by, day=TruncDate('order__order_date'))
+            .annotate(
+                total_revenue=Sum(ExpressionWrapper(F('price') * F('quantity'), output_field=DecimalField())),
+                total_units=Sum('quantity'),
+                total_orders=Count('order', distinct=True),
+            )
+            .order_by()
+        )
+
+    SellerDailySales.objects.bulk_create([
+        SellerDailySales(seller_id=row['product__user_id'], day=row['day'], revenue=row['total_revenue'],
+                         units=row['total_units'], orders=row['total_orders'])
+        for row in rows('product__user_id')
+    ], batch_size=1000)
+    ProductDailySales.objects.bulk_create([
+        ProductDailySales(product_id=row['product_id'], seller_id=row['product__user_id'], day=row['day'],
+                          revenue=row['total_revenue'], units=row['total_units'], orders=row['total_orders'])
+        for row in rows('product_id', 'product__user_id')
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_operations', '0016_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SellerDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('units', models.IntegerField(default=0)),
+                ('orders', models.IntegerField(default=0)),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('units', models.IntegerField(default=0)),
+                ('orders', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api_operations.product')),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['seller', 'day'], name='product_sales_seller_day_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='productdailysales',
+            constraint=models.UniqueConstraint(fields=('product', 'day'), name='unique_product_daily_sales'),
+        ),
+        migrations.AddConstraint(
+            model_name='sellerdailysales',
+            constraint=models.UniqueConstraint(fields=('seller', 'day'), name='unique_seller_daily_sales'),
+        ),
+        migrations.RunPython(fill_sales_rollups, migrations.RunPython.noop),
+    ]
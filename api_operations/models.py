@@ -1,5 +1,34 @@
 from django.db import models
+from django.db.models import DEFERRED
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import AbstractUser
+from .signals import products_bulk_created, image_variants_ready, products_stock_taken
+
+
+class LoadedValuesMixin:
+    """
+    Remembers the column values an instance was loaded with, keyed by attname,
+    so signal receivers can tell what a save changed. Refreshed after each save.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values) if value is not DEFERRED
+        }
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {
+            field.attname: self.__dict__[field.attname]
+            for field in self._meta.concrete_fields if field.attname in self.__dict__
+        }
+
+    def get_loaded_value(self, attname, default=None):
+        # default is returned for instances that were never loaded or saved
+        return getattr(self, '_loaded_values', {}).get(attname, default)
 
 
 # Define a custom user model that inherits from AbstractUser
@@ -28,6 +57,8 @@ class UserProfile(models.Model):
     phone_number = models.CharField(max_length=20, blank=True, null=True)
     profile_picture = models.ImageField(
     upload_to='profile_pictures/', blank=True, null=True)
+    # resized copies of profile_picture, see api_operations/image_variants.py
+    image_variants = models.JSONField(default=dict, blank=True)
     wishlist = models.ManyToManyField('Product', blank=True)
 
     def __str__(self):
@@ -38,6 +69,8 @@ class Category(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField(default='Default description')
     image = models.ImageField(upload_to='category_images/', null=True)
+    image_variants = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
 
 
@@ -53,7 +86,7 @@ class ProductCondition(models.TextChoices):
     AS_IS = 'As-Is'
 
 
-class Product(models.Model):
+class Product(LoadedValuesMixin, models.Model):
     name = models.CharField(max_length=50)
     brand = models.CharField(max_length=50, blank=True, null=True)
     model = models.CharField(max_length=50, blank=True, null=True)
@@ -72,9 +105,27 @@ class Product(models.Model):
         max_digits=10, decimal_places=2, blank=True, null=True)
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     publishing_date = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     quantity = models.PositiveIntegerField()
     image = models.ImageField(
         upload_to='product_images/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True)
+    # split from keywords on every save, see api_operations/tags.py
+    tags = models.ManyToManyField('Tag', through='ProductTag', related_name='products', blank=True)
+
+    class Meta:
+        indexes = [
+            # keyset pagination of the catalog, newest first
+            models.Index(fields=['-publishing_date', '-id'], name='product_published_idx'),
+            models.Index(fields=['category', '-publishing_date', '-id'], name='product_category_published_idx'),
+            # range filters and ?ordering= of ProductFilter / CatalogOrderingFilter
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price_idx'),
+            models.Index(fields=['condition', 'price', 'id'], name='product_condition_price_idx'),
+            models.Index(fields=['produced_year', 'id'], name='product_year_idx'),
+            # updated_since of the catalog export, in export order
+            models.Index(fields=['updated_at', 'id'], name='product_updated_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -97,11 +148,21 @@ class CartItem(models.Model):
 class ShoppingCart(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     date = models.DateTimeField(auto_now_add=True)
+    # also bumped whenever one of the cart's items changes
+    updated_at = models.DateTimeField(auto_now=True)
+    # number of cached-cart flushes, see api_operations/cart_store.py
+    version = models.PositiveIntegerField(default=0)
     status = models.CharField(
         max_length=20,
         choices=CartStatus.choices,
         default=CartStatus.ACTIVE)
 
+    class Meta:
+        indexes = [
+            # stale carts by status and last change, see api_operations/cart_purge.py
+            models.Index(fields=['status', 'updated_at'], name='cart_status_updated_idx'),
+        ]
+
     def __str__(self):
         return f'{self.user.username} - {self.status}'
 
@@ -116,17 +177,25 @@ class OrderStatus(models.TextChoices):
     CANCELLED = 'Cancelled'
 
 
-class Order(models.Model):
+class Order(LoadedValuesMixin, models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     shipping_address = models.TextField()
     order_date = models.DateTimeField(auto_now_add=True)
+    # also bumped whenever one of the order's lines changes
+    updated_at = models.DateTimeField(auto_now=True)
     status = models.CharField(
         max_length=20,
         choices=OrderStatus.choices,
         default=OrderStatus.PENDING,
     )
 
+    class Meta:
+        indexes = [
+            # keyset pagination of a user's orders, newest first
+            models.Index(fields=['user', '-order_date', '-id'], name='order_user_date_idx'),
+        ]
+
     def __str__(self):
         return f'{self.user.username} - {self.order_date}'
 
@@ -150,27 +219,11 @@ class OrderProduct(models.Model):
 @receiver(post_save, sender=OrderProduct)
 def notify_owner(sender, instance, created, **kwargs):
     if created:  # Check if the instance was created
-        product_owner = instance.product.user
-        buyer = instance.order.user
-        shipping_address = instance.order.shipping_address
-        # Create email subject and body
-        subject = f'Your product "{instance.product.name}" has been sold'
-        text_content = f'Your product "{instance.product.name}" has been sold to {buyer.username}.'
-        html_content = f'''
-        <p>Dear {product_owner.username},</p>
-        <p>Your product "<strong>{instance.product.name}</strong>" has been sold to <strong>{buyer.username} {buyer.last_name}</strong> ({buyer.email}).</p>
-        <p>Quantity: {instance.quantity}</p>
-        <p>Total Price: {instance.price * instance.quantity}</p>
-        <p>Shipping Address: {shipping_address}</p>
-        <p>Thank you for using Vintek</p>
-        '''
-        # Create email message
-        msg = EmailMultiAlternatives(subject, text_content, settings.EMAIL_HOST_USER, [product_owner.email])
-        msg.attach_alternative(html_content, "text/html")
-        # Send email
-        msg.send()
-        
-        
+        # queued in the transaction that creates the line, emailed by the outbox worker
+        from .notifications import queue_sale_notifications
+        queue_sale_notifications([instance])
+
+
 class PaymentMethod(models.TextChoices):
     CREDIT_CARD = 'Credit Card'
     PAYPAL = 'Paypal'
@@ -189,4 +242,726 @@ class Payment(models.Model):
     payment_status = models.CharField(max_length=255)
 
     def __str__(self):
-        return f'{self.order.id} - {self.amount}'
\ No newline at end of file
+        return f'{self.order.id} - {self.amount}'
+
+# -------------------SEARCH INDEX-------------------------------------------------------------------------------------------------------------------
+# Inverted index used by ProductSearchView, maintained by api_operations/search.py
+
+class SearchDocument(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='search_document')
+    # Weighted number of terms in the product, used for BM25 length normalization
+    length = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.product_id} - {self.length}'
+
+
+class SearchPosting(models.Model):
+    term = models.CharField(max_length=64)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_postings')
+    frequency = models.PositiveIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'product'], name='search_posting_term_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.term} - {self.product_id}'
+
+
+# keep the search index in sync with the catalog; deletes cascade through the foreign keys
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    from .search import index_product
+    index_product(instance)
+
+
+@receiver(products_bulk_created, sender=Product)
+def index_bulk_created_products(sender, instances, **kwargs):
+    from .search import index_products
+    index_products(instances)
+
+
+# -------------------CATALOG CACHE------------------------------------------------------------------------------------------------------------------
+
+from django.db.models.signals import post_delete
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_cache(sender, instance, **kwargs):
+    from .catalog_cache import invalidate_category
+    invalidate_category(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_cache(sender, instance, **kwargs):
+    from .catalog_cache import invalidate_product
+    # a product moved to another category leaves both category listings stale
+    invalidate_product(instance.pk, {instance.category_id, instance.get_loaded_value('category_id')})
+
+
+@receiver(products_bulk_created, sender=Product)
+def invalidate_bulk_created_product_cache(sender, instances, **kwargs):
+    from .catalog_cache import bump_versions
+    bump_versions(*{f'category_products:{product.category_id}' for product in instances if product.category_id})
+
+
+@receiver(products_stock_taken, sender=Product)
+def invalidate_stock_taken_product_cache(sender, instances, **kwargs):
+    from .catalog_cache import bump_versions
+    bump_versions(
+        *(f'product:{product.pk}' for product in instances),
+        *{f'category_products:{product.category_id}' for product in instances if product.category_id},
+    )
+
+
+# -------------------FACET COUNTS-------------------------------------------------------------------------------------------------------------------
+# Precomputed facet counts of in-stock products per category, maintained by api_operations/facets.py
+
+class ProductFacetCount(models.Model):
+    # Category.pk, or 0 for products without a category
+    category_key = models.PositiveBigIntegerField(default=0)
+    facet = models.CharField(max_length=20)
+    value = models.CharField(max_length=50)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category_key', 'facet', 'value'], name='unique_product_facet_count'),
+        ]
+
+    def __str__(self):
+        return f'{self.category_key} - {self.facet}: {self.value} ({self.count})'
+
+
+from django.db.models.signals import pre_delete, pre_save
+
+
+@receiver([pre_save, pre_delete], sender=Product)
+def remember_stored_facet_values(sender, instance, raw=False, **kwargs):
+    # without the loaded values the write could not be told from an addition, so read them while the row is there
+    from .facets import loaded_facet_values, stored_facet_values
+    if raw or instance.pk is None or loaded_facet_values(instance) is not None:
+        return
+    instance._stored_facet_values = stored_facet_values(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def update_facet_counts(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    from .facets import apply_changes, current_facet_values, previous_facet_values
+    previous = None if created else previous_facet_values(instance)
+    instance.__dict__.pop('_stored_facet_values', None)
+    apply_changes([(previous, current_facet_values(instance))])
+
+
+@receiver(products_bulk_created, sender=Product)
+def add_bulk_created_facet_counts(sender, instances, **kwargs):
+    from .facets import apply_changes, current_facet_values
+    apply_changes([(None, current_facet_values(product)) for product in instances])
+
+
+@receiver(products_stock_taken, sender=Product)
+def update_stock_taken_facet_counts(sender, instances, **kwargs):
+    from .facets import apply_changes, loaded_facet_values, current_facet_values
+    # only products that sold out leave the counts
+    apply_changes([(loaded_facet_values(product), current_facet_values(product)) for product in instances])
+
+
+@receiver(post_delete, sender=Product)
+def remove_facet_counts(sender, instance, **kwargs):
+    from .facets import apply_changes, previous_facet_values
+    apply_changes([(previous_facet_values(instance), None)])
+
+
+@receiver(post_delete, sender=Category)
+def move_facet_counts_to_uncategorized(sender, instance, **kwargs):
+    # Product.category is SET_NULL, which updates the products without sending post_save
+    from .facets import merge_category_into_uncategorized
+    merge_category_into_uncategorized(instance.pk)
+
+
+# -------------------CONDITIONAL GET VALIDATORS-----------------------------------------------------------------------------------------------------
+# Carts and orders are served together with their lines, so line writes must move the parent's updated_at
+
+from django.utils import timezone
+
+
+@receiver([post_save, post_delete], sender=CartItem)
+def touch_shopping_cart(sender, instance, raw=False, origin=None, **kwargs):
+    # lines deleted along with their cart have no cart left to touch
+    if raw or isinstance(origin, ShoppingCart) or getattr(origin, 'model', None) is ShoppingCart:
+        return
+    ShoppingCart.objects.filter(pk=instance.cart_id).update(updated_at=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=OrderProduct)
+def touch_order(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    Order.objects.filter(pk=instance.order_id).update(updated_at=timezone.now())
+
+
+# -------------------IMAGE VARIANTS-----------------------------------------------------------------------------------------------------------------
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+def schedule_image_variants(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    from .image_variants import schedule_variants
+    schedule_variants(instance, 'image')
+
+
+@receiver(post_save, sender=UserProfile)
+def schedule_profile_picture_variants(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    from .image_variants import schedule_variants
+    schedule_variants(instance, 'profile_picture')
+
+
+@receiver(image_variants_ready, sender=Product)
+def invalidate_product_cache_for_variants(sender, pk, **kwargs):
+    from .catalog_cache import invalidate_product
+    invalidate_product(pk, set(Product.objects.filter(pk=pk).values_list('category_id', flat=True)))
+
+
+@receiver(image_variants_ready, sender=Category)
+def invalidate_category_cache_for_variants(sender, pk, **kwargs):
+    from .catalog_cache import invalidate_category
+    invalidate_category(pk)
+
+
+
+# -------------------TAGS---------------------------------------------------------------------------------------------------------------------------
+# Normalized keywords used by the tag filters and the tag cloud, maintained by api_operations/tags.py
+
+from django.db.models.signals import pre_delete
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=50)
+    slug = models.SlugField(max_length=50, unique=True, allow_unicode=True)
+    # number of products carrying the tag, kept up to date by the receivers below
+    product_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-product_count', 'slug'], name='tag_cloud_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class ProductTag(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'tag'], name='unique_product_tag'),
+        ]
+        indexes = [
+            # tag filters go from tag to products
+            models.Index(fields=['tag', 'product'], name='product_tag_tag_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} - {self.tag_id}'
+
+
+@receiver(post_save, sender=Product)
+def sync_tags(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created and not instance.keywords:
+        return
+    if not created and instance.get_loaded_value('keywords', DEFERRED) == instance.keywords:
+        return
+    from .tags import sync_product_tags
+    sync_product_tags([instance])
+
+
+@receiver(products_bulk_created, sender=Product)
+def sync_bulk_created_tags(sender, instances, **kwargs):
+    from .tags import sync_product_tags
+    sync_product_tags([product for product in instances if product.keywords])
+
+
+@receiver(pre_delete, sender=Product)
+def remove_tag_counts(sender, instance, **kwargs):
+    from .tags import remove_product_tags
+    remove_product_tags(instance.pk)
+
+
+
+# -------------------SIMILAR PRODUCTS---------------------------------------------------------------------------------------------------------------
+# TF-IDF vectors and precomputed nearest neighbours, maintained by api_operations/similarity.py
+
+class SimilarityDocument(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='similarity_document')
+    # False while the product's neighbour list is pending, e.g. after a bulk import
+    neighbours_computed = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f'{self.product_id} - {self.neighbours_computed}'
+
+
+class ProductFeature(models.Model):
+    # 'brand:sony', 'decade:1970', 'term:walkman', ...
+    feature = models.CharField(max_length=80)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='similarity_features')
+    # component of the product's unit-length TF-IDF vector
+    weight = models.FloatField()
+
+    class Meta:
+        indexes = [
+            # covers the self-join that scores one product against the catalog
+            models.Index(fields=['feature', 'product', 'weight'], name='product_feature_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} - {self.feature}: {self.weight:.3f}'
+
+
+class SimilarProduct(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='similar_products')
+    similar = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    # cosine similarity of the two vectors, between 0 and 1
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', '-score'], name='similar_product_score_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} ~ {self.similar_id} ({self.score:.3f})'
+
+
+@receiver(post_save, sender=Product)
+def refresh_similar_products(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    from .similarity import SOURCE_FIELDS, refresh_products
+    if not created and all(
+        instance.get_loaded_value(field, DEFERRED) == getattr(instance, field) for field in SOURCE_FIELDS
+    ):
+        return
+    # the neighbour join and the lists it touches would run in the request, they are computed on first read instead
+    refresh_products([instance], neighbours=False)
+
+
+@receiver(products_bulk_created, sender=Product)
+def refresh_bulk_created_similar_products(sender, instances, **kwargs):
+    # one neighbour query per product would dominate an import, the lists are computed on first read instead
+    from .similarity import refresh_products
+    refresh_products(instances, neighbours=False)
+
+
+@receiver(pre_delete, sender=Product)
+def remember_similar_product_lists(sender, instance, **kwargs):
+    from .similarity import listed_by
+    instance._similar_listed_by = listed_by(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def refill_similar_product_lists(sender, instance, **kwargs):
+    # the cascade took the product out of these lists, they are refilled with the next best match on first read
+    from .similarity import mark_pending
+    mark_pending(getattr(instance, '_similar_listed_by', []))
+
+
+# -------------------VIEW COUNTERS------------------------------------------------------------------------------------------------------------------
+# Written in batches by the write-behind buffer in api_operations/view_counters.py
+
+class ProductViewCount(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='view_count')
+    views = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.product_id} - {self.views}'
+
+
+class ProductViewBucket(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    # hours since the epoch
+    hour = models.PositiveIntegerField()
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'hour'], name='unique_product_view_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['hour', 'product'], name='product_view_bucket_hour_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} @ {self.hour} - {self.views}'
+
+
+class TrendingProduct(models.Model):
+    rank = models.PositiveSmallIntegerField(unique=True)
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='+')
+    # views over the trending window when the ranking was computed
+    views = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f'{self.rank}. {self.product_id} ({self.views})'
+
+
+
+# -------------------AUTOCOMPLETE-------------------------------------------------------------------------------------------------------------------
+# Keep this process's in-memory prefix index (api_operations/autocomplete.py) in step with committed writes
+
+from django.db import transaction
+
+
+@receiver(post_save, sender=Product)
+def update_autocomplete(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if not created and all(
+        instance.get_loaded_value(field, DEFERRED) == getattr(instance, field) for field in ('name', 'brand', 'model')
+    ):
+        return
+    from . import autocomplete
+    product_id, name, brand, model = instance.pk, instance.name, instance.brand, instance.model
+    transaction.on_commit(lambda: autocomplete.update_product(product_id, name, brand, model))
+
+
+@receiver(products_bulk_created, sender=Product)
+def update_bulk_created_autocomplete(sender, instances, **kwargs):
+    from . import autocomplete
+    rows = [(product.pk, product.name, product.brand, product.model) for product in instances]
+    transaction.on_commit(lambda: [autocomplete.update_product(*row) for row in rows])
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_autocomplete(sender, instance, **kwargs):
+    from . import autocomplete
+    product_id = instance.pk
+    transaction.on_commit(lambda: autocomplete.remove_product(product_id))
+
+
+# -------------------STOCK HOLDS--------------------------------------------------------------------------------------------------------------------
+# Stock reserved by cart lines until it is ordered or the hold expires, see api_operations/stock_holds.py
+
+
+class StockHold(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='holds')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'user'], name='unique_stock_hold'),
+        ]
+        indexes = [
+            # the unexpired holds of a product, summed for its available stock
+            models.Index(fields=['product', 'expires_at'], name='stock_hold_product_idx'),
+            models.Index(fields=['expires_at'], name='stock_hold_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} holds {self.quantity} of {self.product_id} until {self.expires_at}'
+
+
+# -------------------OUTBOX-------------------------------------------------------------------------------------------------------------------------
+# Messages written in the transaction of the change they announce and delivered by a worker, see api_operations/outbox.py
+
+
+class OutboxStatus(models.TextChoices):
+    PENDING = 'Pending'
+    SENT = 'Sent'
+    FAILED = 'Failed'
+
+
+class OutboxMessage(models.Model):
+    topic = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # when the message is next due; a worker pushes it back while it has the message claimed
+    available_at = models.DateTimeField(default=timezone.now)
+    claim = models.UUIDField(blank=True, null=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=OutboxStatus.choices, default=OutboxStatus.PENDING)
+    last_error = models.TextField(blank=True, default='')
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='outbox_due_idx'),
+            models.Index(fields=['claim'], name='outbox_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.topic} #{self.pk} - {self.status}'
+
+
+# -------------------SALES ROLLUPS------------------------------------------------------------------------------------------------------------------
+# Daily sales totals per seller and per product, kept current by api_operations/sales_rollups.py. Cancelled
+# orders don't count, and every line counts on the day its order was placed.
+
+
+class SellerDailySales(models.Model):
+    seller = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units = models.IntegerField(default=0)
+    # orders with at least one line of the seller
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['seller', 'day'], name='unique_seller_daily_sales'),
+        ]
+
+    def __str__(self):
+        return f'{self.seller_id} @ {self.day} - {self.revenue}'
+
+
+class ProductDailySales(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    seller = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    units = models.IntegerField(default=0)
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'day'], name='unique_product_daily_sales'),
+        ]
+        indexes = [
+            models.Index(fields=['seller', 'day'], name='product_sales_seller_day_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id} @ {self.day} - {self.revenue}'
+
+
+@receiver(post_save, sender=OrderProduct)
+def add_line_to_sales(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    from .sales_rollups import record_lines
+    record_lines(instance.order, [instance])
+
+
+@receiver(post_delete, sender=OrderProduct)
+def remove_line_from_sales(sender, instance, **kwargs):
+    from .sales_rollups import being_deleted, forget_lines
+    # the lines of a deleted order went with the whole order in remove_order_from_sales
+    if being_deleted('order', instance.order_id):
+        return
+    forget_lines(instance.order, [instance])
+
+
+@receiver(post_save, sender=Order)
+def update_order_sales(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    was_cancelled = instance.get_loaded_value('status') == OrderStatus.CANCELLED
+    if was_cancelled != (instance.status == OrderStatus.CANCELLED):
+        from .sales_rollups import record_order
+        record_order(instance, -1 if instance.status == OrderStatus.CANCELLED else 1)
+
+
+@receiver(pre_delete, sender=Order)
+def remove_order_from_sales(sender, instance, **kwargs):
+    from .sales_rollups import begin_delete, record_order
+    begin_delete('order', instance.pk)
+    if instance.status != OrderStatus.CANCELLED:
+        record_order(instance, -1)
+
+
+@receiver(post_delete, sender=Order)
+def order_removed_from_sales(sender, instance, **kwargs):
+    from .sales_rollups import end_delete
+    end_delete('order', instance.pk)
+
+
+# The rollup rows of a deleted product or seller cascade with it. Their lines deleted by the same cascade must
+# not write them back.
+@receiver(pre_delete, sender=Product)
+@receiver(pre_delete, sender=CustomUser)
+def begin_sales_owner_delete(sender, instance, **kwargs):
+    from .sales_rollups import begin_delete
+    begin_delete('product' if sender is Product else 'seller', instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=CustomUser)
+def end_sales_owner_delete(sender, instance, **kwargs):
+    from .sales_rollups import end_delete
+    end_delete('product' if sender is Product else 'seller', instance.pk)
+
+
+# -------------------IDEMPOTENCY KEYS---------------------------------------------------------------------------------------------------------------
+# Responses of POSTs sent with an Idempotency-Key header, replayed to retries, see api_operations/idempotency.py
+
+
+class IdempotencyStatus(models.TextChoices):
+    PENDING = 'Pending'
+    COMPLETE = 'Complete'
+
+
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    # hash of the method, path and body of the request the key was first sent with
+    fingerprint = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=IdempotencyStatus.choices, default=IdempotencyStatus.PENDING)
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_body = models.JSONField(blank=True, null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # a pending key is taken over after this, a complete one forgotten
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_key_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}:{self.key} - {self.status}'
+
+
+# -------------------PRODUCT LISTINGS---------------------------------------------------------------------------------------------------------------
+# One denormalized row per product card, maintained by api_operations/listings.py. Declared last so that
+# its post_save receiver runs after the tags of the saved product are synced.
+
+from django.db.models.signals import m2m_changed
+
+
+class ProductListing(models.Model):
+    # Product.pk; kept as `id` so the catalog filters, orderings and cursors apply unchanged
+    id = models.BigIntegerField(primary_key=True)
+    name = models.CharField(max_length=50)
+    brand = models.CharField(max_length=50, blank=True, null=True)
+    model = models.CharField(max_length=50, blank=True, null=True)
+    produced_year = models.PositiveIntegerField(blank=True, null=True)
+    country_of_origin = models.CharField(max_length=50, blank=True, null=True)
+    description = models.TextField(blank=True, null=True)
+    keywords = models.CharField(max_length=1000, blank=True, null=True)
+    condition = models.CharField(max_length=20, choices=ProductCondition.choices, default=ProductCondition.GOOD)
+    price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    publishing_date = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    quantity = models.PositiveIntegerField()
+    image = models.ImageField(upload_to='product_images/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True)
+    # slugs, sorted
+    tags = models.JSONField(default=list, blank=True)
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    category_name = models.CharField(max_length=255, blank=True, null=True)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    seller_username = models.CharField(max_length=150)
+    in_stock = models.BooleanField()
+    wishlist_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # the catalog pages and filters, as on Product
+            models.Index(fields=['-publishing_date', '-id'], name='listing_published_idx'),
+            models.Index(fields=['category', '-publishing_date', '-id'], name='listing_category_published_idx'),
+            models.Index(fields=['price', 'id'], name='listing_price_idx'),
+            models.Index(fields=['category', 'price', 'id'], name='listing_category_price_idx'),
+            models.Index(fields=['condition', 'price', 'id'], name='listing_condition_price_idx'),
+            models.Index(fields=['produced_year', 'id'], name='listing_year_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+@receiver(post_save, sender=Product)
+def refresh_listing(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    from .listings import refresh_listings
+    refresh_listings([instance.pk])
+
+
+@receiver(products_bulk_created, sender=Product)
+def add_bulk_created_listings(sender, instances, **kwargs):
+    from .listings import refresh_listings
+    refresh_listings([product.pk for product in instances])
+
+
+@receiver(products_stock_taken, sender=Product)
+def refresh_stock_taken_listings(sender, instances, **kwargs):
+    from .listings import refresh_listings
+    refresh_listings([product.pk for product in instances])
+
+
+@receiver(image_variants_ready, sender=Product)
+def refresh_listing_variants(sender, pk, **kwargs):
+    from .listings import refresh_listings
+    refresh_listings([pk])
+
+
+@receiver(post_delete, sender=Product)
+def remove_listing(sender, instance, **kwargs):
+    ProductListing.objects.filter(pk=instance.pk).delete()
+
+
+@receiver(post_save, sender=Category)
+def rename_listing_category(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    from .listings import update_category_name
+    update_category_name(instance.pk, instance.name)
+
+
+@receiver(pre_delete, sender=Category)
+def clear_listing_category(sender, instance, **kwargs):
+    # ProductListing.category is SET_NULL, which leaves the copied name behind
+    from .listings import update_category_name
+    update_category_name(instance.pk, None)
+
+
+@receiver(post_save, sender=CustomUser)
+def rename_listing_seller(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    from .listings import update_seller_username
+    update_seller_username(instance.pk, instance.username)
+
+
+@receiver(m2m_changed, sender=UserProfile.wishlist.through)
+def update_listing_wishlist_counts(sender, instance, action, reverse, pk_set, **kwargs):
+    from .listings import update_wishlist_counts
+    if action == 'pre_clear':
+        # the cleared ids are gone by post_clear
+        instance._cleared_wishlist_ids = (
+            [instance.pk] if reverse else list(instance.wishlist.values_list('pk', flat=True))
+        )
+    elif action == 'post_clear':
+        update_wishlist_counts(getattr(instance, '_cleared_wishlist_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        update_wishlist_counts([instance.pk] if reverse else pk_set)
+
+
+@receiver(pre_delete, sender=UserProfile)
+def remember_wishlist(sender, instance, **kwargs):
+    instance._wishlist_product_ids = list(instance.wishlist.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=UserProfile)
+def recount_wishlist(sender, instance, **kwargs):
+    # the cascade deletes the wishlist rows without sending m2m_changed
+    from .listings import update_wishlist_counts
+    update_wishlist_counts(getattr(instance, '_wishlist_product_ids', []))
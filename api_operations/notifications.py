@@ -0,0 +1,85 @@
+"""
+Notification emails, sent by the outbox worker (see api_operations/outbox.py).
+
+Every sold order line queues a 'sale_notification' message. The handler
+folds the messages of a batch into one digest per seller and order. With
+SALE_DIGEST_WINDOW set, it folds them into one digest per seller for every
+window of that many seconds instead: the messages of a window all come due
+when it ends. Each digest is rendered once, from templates the cached
+template loader compiles once per process. All digests of a batch go out
+over a single SMTP connection.
+"""
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .models import OrderProduct
+from .outbox import enqueue
+
+
+def digest_due_at():
+    """When the sale notifications queued now are due: right away, or at the end of the current digest window."""
+    window = settings.SALE_DIGEST_WINDOW
+    if not window:
+        return timezone.now()
+    return datetime.fromtimestamp(math.ceil(timezone.now().timestamp() / window) * window, dt_timezone.utc)
+
+
+def queue_sale_notifications(order_products):
+    """Queue the notifications of newly sold order lines, in the current transaction."""
+    due_at = digest_due_at()
+    return enqueue('sale_notification', [{'order_product_id': line.pk} for line in order_products], available_at=due_at)
+
+
+def sale_email(seller, lines):
+    """The email telling `seller` about their sold order `lines`, grouped by order."""
+    orders = {}
+    for line in sorted(lines, key=lambda line: (line.order_id, line.pk)):
+        order = orders.setdefault(line.order_id, {
+            'buyer': line.order.user, 'shipping_address': line.order.shipping_address, 'lines': [],
+        })
+        order['lines'].append({'product': line.product, 'quantity': line.quantity, 'total': line.price * line.quantity})
+    context = {'seller': seller, 'orders': list(orders.values())}
+
+    if len(lines) == 1:
+        subject = f'Your product "{lines[0].product.name}" has been sold'
+    else:
+        subject = f'{len(lines)} of your products have been sold'
+    msg = EmailMultiAlternatives(
+        subject, get_template('api_operations/emails/sale_notification.txt').render(context),
+        settings.EMAIL_HOST_USER, [seller.email],
+    )
+    msg.attach_alternative(get_template('api_operations/emails/sale_notification.html').render(context), "text/html")
+    return msg
+
+
+def send_sale_notifications(messages):
+    """Outbox handler of 'sale_notification' messages, {'order_product_id'}."""
+    lines = OrderProduct.objects.select_related('product__user', 'order__user').in_bulk(
+        [message.payload['order_product_id'] for message in messages]
+    )
+    digests = {}
+    for message in messages:
+        line = lines.get(message.payload['order_product_id'])
+        # the order was deleted since, there is nothing left to tell
+        if line is None:
+            continue
+        key = line.product.user_id if settings.SALE_DIGEST_WINDOW else (line.product.user_id, line.order_id)
+        digest = digests.setdefault(key, {'seller': line.product.user, 'lines': [], 'messages': []})
+        digest['lines'].append(line)
+        digest['messages'].append(message)
+
+    failed = {}
+    if not digests:
+        return failed
+    with get_connection() as connection:
+        for digest in digests.values():
+            try:
+                connection.send_messages([sale_email(digest['seller'], digest['lines'])])
+            except Exception as e:
+                failed.update({message.pk: repr(e) for message in digest['messages']})
+    return failed
@@ -0,0 +1,114 @@
+"""
+Transactional outbox.
+
+Side effects that must not hold up a request, such as emails, are written as
+OutboxMessage rows by enqueue() in the transaction of the change they
+announce. They exist exactly when that change commits, and the request
+never waits on the mail server. The run_outbox_worker command drains the
+table with drain().
+
+A worker claims a batch of due messages with one conditional UPDATE. It
+tags the rows with a random claim id and pushes them OUTBOX_CLAIM_TIMEOUT
+seconds into the future. Concurrent workers therefore never take the same
+messages, and the messages of a worker that died come due again. Each topic's
+handler gets its claimed messages together and returns the ones that failed.
+Failed messages come due again after an exponential backoff, and are marked
+Failed once they have used up OUTBOX_MAX_ATTEMPTS. Delivery is at least once:
+a worker that dies after sending but before recording it sends again.
+"""
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboxMessage, OutboxStatus
+
+logger = logging.getLogger(__name__)
+
+
+# topic: handler(messages) -> {message pk: error} for the messages that could not be delivered
+HANDLERS = {
+    'sale_notification': 'api_operations.notifications.send_sale_notifications',
+}
+
+
+def enqueue(topic, payloads, available_at=None):
+    """Queue a message of `topic` per payload, in the current transaction, due at `available_at` or now."""
+    available_at = available_at or timezone.now()
+    return OutboxMessage.objects.bulk_create([
+        OutboxMessage(topic=topic, payload=payload, available_at=available_at) for payload in payloads
+    ])
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next attempt, after `attempts` failed ones."""
+    return settings.OUTBOX_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+def claim(batch_size):
+    """Claim up to `batch_size` due messages for this worker, oldest first."""
+    now = timezone.now()
+    token = uuid.uuid4()
+    due = OutboxMessage.objects.filter(status=OutboxStatus.PENDING, available_at__lte=now)
+    ids = list(due.order_by('available_at', 'pk').values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return []
+    # messages another worker claimed in the meantime are no longer due, and are left out
+    due.filter(pk__in=ids).update(claim=token, available_at=now + timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT))
+    return list(OutboxMessage.objects.filter(claim=token).order_by('available_at', 'pk'))
+
+
+def _deliver(topic, messages):
+    try:
+        handler = import_string(HANDLERS[topic])
+        return handler(messages)
+    except Exception as e:
+        logger.exception('Delivering %s messages failed', topic)
+        return {message.pk: repr(e) for message in messages}
+
+
+def drain(batch_size=100):
+    """Deliver one batch of due messages. Returns (delivered, failed)."""
+    messages = claim(batch_size)
+    by_topic = {}
+    for message in messages:
+        by_topic.setdefault(message.topic, []).append(message)
+    failures = {}
+    for topic, topic_messages in by_topic.items():
+        failures.update(_deliver(topic, topic_messages))
+
+    now = timezone.now()
+    with transaction.atomic():
+        delivered = [message.pk for message in messages if message.pk not in failures]
+        OutboxMessage.objects.filter(pk__in=delivered).update(
+            status=OutboxStatus.SENT, sent_at=now, claim=None, last_error='')
+        for message in messages:
+            if message.pk not in failures:
+                continue
+            message.attempts += 1
+            message.claim = None
+            message.last_error = failures[message.pk]
+            if message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                message.status = OutboxStatus.FAILED
+                logger.error('Giving up on %s', message)
+            else:
+                message.available_at = now + timedelta(seconds=retry_delay(message.attempts))
+            message.save(update_fields=['attempts', 'claim', 'last_error', 'status', 'available_at'])
+    return len(delivered), len(failures)
+
+
+def purge_sent(batch_size=1000):
+    """Delete the messages sent more than OUTBOX_RETENTION_DAYS ago, `batch_size` at a time. Returns the count."""
+    cutoff = timezone.now() - timedelta(days=settings.OUTBOX_RETENTION_DAYS)
+    deleted = 0
+    while True:
+        ids = list(
+            OutboxMessage.objects.filter(status=OutboxStatus.SENT, sent_at__lt=cutoff).values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        deleted += OutboxMessage.objects.filter(pk__in=ids).delete()[0]
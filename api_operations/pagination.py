@@ -0,0 +1,43 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class SearchResultsPagination(PageNumberPagination):
+    """
+    Paginates the ranked list of product ids returned by the search index
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class ProductCursorPagination(CursorPagination):
+    """
+    Keyset pagination for product lists, newest first. The cursor encodes the
+    last publishing_date seen so every page is an indexed range scan with no
+    COUNT(*) and no OFFSET.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-publishing_date', '-id')
+
+
+class OrderCursorPagination(CursorPagination):
+    """
+    Keyset pagination for a user's orders, newest first
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-order_date', '-id')
+
+
+class OrderProductCursorPagination(CursorPagination):
+    """
+    Keyset pagination for sold order lines. Ids grow with insertion, so they
+    follow the order date without a join.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-id'
@@ -0,0 +1,95 @@
+"""
+Streaming bulk import of products from CSV or JSON Lines.
+
+Rows are parsed one at a time from the input stream, validated with
+ProductImportSerializer and written with bulk_create, one transaction per
+batch. Invalid rows are reported with their row number and skipped, they
+never abort the import.
+"""
+import csv
+import io
+import json
+
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import as_serializer_error
+
+from .models import Category, Product
+from .serializers import ProductImportSerializer
+from .signals import products_bulk_created
+
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+DEFAULT_BATCH_SIZE = 500
+
+
+def detect_format(filename):
+    if filename and filename.lower().endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return 'csv'
+
+
+def _text_stream(stream):
+    if isinstance(stream, io.TextIOBase):
+        return stream
+    return io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+
+def iter_rows(stream, import_format):
+    """Yield (row number, data, error) for each row of the stream."""
+    text = _text_stream(stream)
+    if import_format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            # empty cells mean "not provided" so nullable columns stay null
+            yield reader.line_num, {key: value for key, value in row.items() if key and value not in ('', None)}, None
+    elif import_format == 'jsonl':
+        for row_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                yield row_number, None, {'non_field_errors': [f'Invalid JSON: {e}']}
+                continue
+            if not isinstance(data, dict):
+                yield row_number, None, {'non_field_errors': ['Each line must be a JSON object']}
+                continue
+            yield row_number, data, None
+    else:
+        raise ValueError(f'Unsupported import format "{import_format}"')
+
+
+def _write_batch(batch):
+    with transaction.atomic():
+        created = Product.objects.bulk_create(batch)
+        products_bulk_created.send(sender=Product, instances=created)
+    return len(created)
+
+
+def import_products(stream, user, import_format='csv', batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Import the products in `stream` for `user`.
+    Returns {'created': <count>, 'errors': [{'row': <row number>, 'errors': {...}}, ...]}.
+    """
+    # One serializer validates every row, so its fields are only built once
+    serializer = ProductImportSerializer(context={'categories': Category.objects.in_bulk()})
+    result = {'created': 0, 'errors': []}
+    batch = []
+
+    for row_number, data, error in iter_rows(stream, import_format):
+        if error is None:
+            try:
+                batch.append(Product(user=user, **serializer.run_validation(data)))
+            except ValidationError as e:
+                error = as_serializer_error(e)
+        if error is not None:
+            result['errors'].append({'row': row_number, 'errors': error})
+
+        if len(batch) >= batch_size:
+            result['created'] += _write_batch(batch)
+            batch = []
+
+    if batch:
+        result['created'] += _write_batch(batch)
+    return result
@@ -0,0 +1,42 @@
+"""
+Renderers for large API responses.
+
+ORJSONRenderer produces the same JSON as DRF's JSONRenderer several times
+faster. MessagePackRenderer serves the same data as application/msgpack for
+clients that ask for it in their Accept header (or with ?format=msgpack).
+"""
+import msgpack
+import orjson
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+# Serializer output is mostly str/int/dict/list already. Anything else
+# (lazy translations, Decimals from plain APIViews, ...) goes through DRF's encoder.
+_encoder = JSONEncoder()
+
+
+def _default(value):
+    return _encoder.default(value)
+
+
+class ORJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        options = orjson.OPT_NON_STR_KEYS
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_default, option=options)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_default, use_bin_type=True)
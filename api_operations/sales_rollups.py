@@ -0,0 +1,208 @@
+"""
+Seller sales rollups.
+
+SellerDailySales and ProductDailySales hold, for every seller and product, the
+revenue, units and number of orders of each day. A seller dashboard sums at
+most one row per day of the range it shows, however long the sales history.
+
+Writes apply deltas to the rows they touch, like the facet counts do:
+
+- a new order line adds its revenue and units;
+- a deleted line subtracts them;
+- cancelling an order subtracts all of its lines, and un-cancelling adds them
+  back;
+- deleting an order subtracts it once, in the Order pre_delete receiver.
+
+The rows of a product or seller being deleted are left alone: the delete
+cascades to them, and writing them again would point at a missing row.
+
+An order counts once per seller and once per product, however many lines it
+has of them. It is added with its first line of a seller or product and
+subtracted with its last one. Edits to existing lines are not followed.
+rebuild_sales_rollups recomputes everything from the orders.
+"""
+import threading
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import OrderProduct, OrderStatus, Product, ProductDailySales, SellerDailySales
+
+
+_deleting = threading.local()
+
+
+def begin_delete(kind, pk):
+    """Mark an 'order', 'product' or 'seller' as being deleted by this thread, from its pre_delete to its post_delete."""
+    if not hasattr(_deleting, kind):
+        setattr(_deleting, kind, set())
+    getattr(_deleting, kind).add(pk)
+
+
+def end_delete(kind, pk):
+    getattr(_deleting, kind, set()).discard(pk)
+
+
+def being_deleted(kind, pk):
+    return pk in getattr(_deleting, kind, ())
+
+
+def sales_day(order):
+    return timezone.localtime(order.order_date).date()
+
+
+def _deltas(lines, sign, counted_sellers=(), counted_products=()):
+    """
+    {seller id: [revenue, units, orders]} and {(product id, seller id): [revenue, units, orders]} deltas of
+    adding (sign 1) or removing (sign -1) `lines` of one order, (product id, seller id, quantity, price) tuples.
+    The order is already counted for `counted_sellers` and `counted_products` through its other lines.
+    """
+    counted_sellers, counted_products = set(counted_sellers), set(counted_products)
+    sellers = defaultdict(lambda: [Decimal(0), 0, 0])
+    products = defaultdict(lambda: [Decimal(0), 0, 0])
+    for product_id, seller_id, quantity, price in lines:
+        for key, rows, counted, counted_key in (
+            (seller_id, sellers, counted_sellers, seller_id),
+            ((product_id, seller_id), products, counted_products, product_id),
+        ):
+            row = rows[key]
+            row[0] += sign * price * quantity
+            row[1] += sign * quantity
+            if counted_key not in counted:
+                row[2] += sign
+                counted.add(counted_key)
+    return sellers, products
+
+
+def _apply_rows(model, key_field, day, deltas, extra):
+    existing = set(model.objects.filter(day=day, **{f'{key_field}__in': deltas}).values_list(key_field, flat=True))
+    for key in existing:
+        revenue, units, orders = deltas[key]
+        model.objects.filter(day=day, **{key_field: key}).update(
+            revenue=F('revenue') + revenue, units=F('units') + units, orders=F('orders') + orders)
+    model.objects.bulk_create([
+        model(day=day, revenue=revenue, units=units, orders=orders, **{key_field: key}, **extra(key))
+        for key, (revenue, units, orders) in deltas.items() if key not in existing
+    ])
+
+
+def _apply(day, sellers, products):
+    """
+    Add the deltas to the rows of `day`: one UPDATE per existing row, one INSERT for the new ones. A row that a
+    concurrent writer created in the meantime fails the INSERT, and the whole change is applied once more.
+    """
+    sellers = {seller_id: delta for seller_id, delta in sellers.items() if not being_deleted('seller', seller_id)}
+    product_deltas, product_sellers = {}, {}
+    for (product_id, seller_id), delta in products.items():
+        if not being_deleted('product', product_id) and not being_deleted('seller', seller_id):
+            product_deltas[product_id] = delta
+            product_sellers[product_id] = seller_id
+    if not sellers and not product_deltas:
+        return
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                _apply_rows(SellerDailySales, 'seller_id', day, sellers, lambda key: {})
+                _apply_rows(ProductDailySales, 'product_id', day, product_deltas,
+                            lambda key: {'seller_id': product_sellers[key]})
+            return
+        except IntegrityError:
+            if attempt:
+                raise
+
+
+def record_lines(order, lines):
+    """Add order lines that were just created to the rollups of their order's day."""
+    if order.status == OrderStatus.CANCELLED:
+        return
+    new = {line.pk for line in lines}
+    rows = OrderProduct.objects.filter(order_id=order.pk).values_list(
+        'pk', 'product_id', 'product__user_id', 'quantity', 'price')
+    added = [row[1:] for row in rows if row[0] in new]
+    others = [row[1:] for row in rows if row[0] not in new]
+    _apply(sales_day(order), *_deltas(
+        added, 1, {seller_id for _, seller_id, _, _ in others}, {product_id for product_id, _, _, _ in others},
+    ))
+
+
+def forget_lines(order, lines):
+    """Subtract order lines that were just deleted from the rollups of their order's day."""
+    if order.status == OrderStatus.CANCELLED:
+        return
+    sellers = dict(Product.objects.filter(pk__in={line.product_id for line in lines}).values_list('pk', 'user_id'))
+    others = OrderProduct.objects.filter(order_id=order.pk).values_list('product_id', 'product__user_id')
+    _apply(sales_day(order), *_deltas(
+        [(line.product_id, sellers[line.product_id], line.quantity, line.price) for line in lines if line.product_id in sellers],
+        -1, {seller_id for _, seller_id in others}, {product_id for product_id, _ in others},
+    ))
+
+
+def record_order(order, sign):
+    """Add (sign 1) or subtract (sign -1) all the lines of an order."""
+    lines = OrderProduct.objects.filter(order_id=order.pk).values_list('product_id', 'product__user_id', 'quantity', 'price')
+    _apply(sales_day(order), *_deltas(lines, sign))
+
+
+def _sales_rows(group_by):
+    return (
+        OrderProduct.objects.exclude(order__status=OrderStatus.CANCELLED)
+        .values(*group_by, day=TruncDate('order__order_date'))
+        .annotate(
+            total_revenue=Sum(ExpressionWrapper(F('price') * F('quantity'), output_field=DecimalField())),
+            total_units=Sum('quantity'),
+            total_orders=Count('order', distinct=True),
+        )
+        .order_by()
+    )
+
+
+def rebuild_sales_rollups(batch_size=1000):
+    """Recompute both rollup tables from the orders, in one transaction. Returns (seller rows, product rows)."""
+    with transaction.atomic():
+        SellerDailySales.objects.all().delete()
+        ProductDailySales.objects.all().delete()
+        sellers = SellerDailySales.objects.bulk_create([
+            SellerDailySales(
+                seller_id=row['product__user_id'], day=row['day'],
+                revenue=row['total_revenue'], units=row['total_units'], orders=row['total_orders'],
+            )
+            for row in _sales_rows(['product__user_id'])
+        ], batch_size=batch_size)
+        products = ProductDailySales.objects.bulk_create([
+            ProductDailySales(
+                product_id=row['product_id'], seller_id=row['product__user_id'], day=row['day'],
+                revenue=row['total_revenue'], units=row['total_units'], orders=row['total_orders'],
+            )
+            for row in _sales_rows(['product_id', 'product__user_id'])
+        ], batch_size=batch_size)
+    return len(sellers), len(products)
+
+
+def sales_summary(seller_id, start, end, limit=10):
+    """Totals, daily series and best-selling products of a seller from `start` to `end`, both dates included."""
+    days = list(
+        SellerDailySales.objects.filter(seller_id=seller_id, day__range=(start, end))
+        .order_by('day').values('day', 'revenue', 'units', 'orders')
+    )
+    products = list(
+        ProductDailySales.objects.filter(seller_id=seller_id, day__range=(start, end))
+        .values('product_id')
+        .annotate(revenue=Sum('revenue'), units=Sum('units'), orders=Sum('orders'))
+        .order_by('-revenue', 'product_id')[:limit]
+    )
+    names = dict(Product.objects.filter(pk__in=[row['product_id'] for row in products]).values_list('pk', 'name'))
+    for row in products:
+        row['name'] = names.get(row['product_id'])
+    return {
+        'from': start,
+        'to': end,
+        'revenue': sum((row['revenue'] for row in days), Decimal(0)),
+        'units': sum(row['units'] for row in days),
+        'orders': sum(row['orders'] for row in days),
+        'days': days,
+        'products': products,
+    }
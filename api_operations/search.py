@@ -0,0 +1,132 @@
+"""
+Full-text search over the product catalog.
+
+Every product is tokenized into one SearchDocument (its weighted length) and
+one SearchPosting per distinct term. A query only reads the postings of its
+own terms, so the cost depends on how many products match, not on the size
+of the catalog. Matches are ranked with Okapi BM25.
+"""
+import math
+import re
+from collections import Counter, defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Avg, Count
+
+from .models import Product, SearchDocument, SearchPosting
+
+
+# A term found in the name counts three times, brand/model/keywords twice
+FIELD_WEIGHTS = {
+    'name': 3,
+    'brand': 2,
+    'model': 2,
+    'keywords': 2,
+    'description': 1,
+}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+MAX_TERM_LENGTH = 64
+
+POSTING_INSERT_SQL = (
+    f'INSERT INTO {SearchPosting._meta.db_table} (term, product_id, frequency) VALUES (%s, %s, %s)'
+)
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(text.lower())]
+
+
+def product_terms(product):
+    terms = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        for token in tokenize(getattr(product, field)):
+            terms[token] += weight
+    return terms
+
+
+def index_products(products):
+    """Replace the index entries of the given products in one transaction."""
+    products = [product for product in products if product.pk is not None]
+    if not products:
+        return
+    product_ids = [product.pk for product in products]
+
+    documents = []
+    postings = []
+    for product in products:
+        terms = product_terms(product)
+        documents.append(SearchDocument(product_id=product.pk, length=sum(terms.values())))
+        postings.extend((term, product.pk, frequency) for term, frequency in terms.items())
+
+    with transaction.atomic():
+        SearchPosting.objects.filter(product_id__in=product_ids).delete()
+        SearchDocument.objects.filter(product_id__in=product_ids).delete()
+        SearchDocument.objects.bulk_create(documents)
+        # Postings are the bulk of an index write (about ten per product), a plain
+        # executemany skips the per-object work bulk_create does for each row
+        with connection.cursor() as cursor:
+            cursor.executemany(POSTING_INSERT_SQL, postings)
+
+
+def index_product(product):
+    index_products([product])
+
+
+def rebuild_index(batch_size=500):
+    """Drop the whole index and rebuild it from the Product table. Returns the number of products indexed."""
+    fields = ['pk', *FIELD_WEIGHTS]
+    with transaction.atomic():
+        SearchPosting.objects.all().delete()
+        SearchDocument.objects.all().delete()
+
+    indexed = 0
+    batch = []
+    for product in Product.objects.only(*fields).iterator(chunk_size=batch_size):
+        batch.append(product)
+        if len(batch) >= batch_size:
+            index_products(batch)
+            indexed += len(batch)
+            batch = []
+    if batch:
+        index_products(batch)
+        indexed += len(batch)
+    return indexed
+
+
+def search_products(query):
+    """Return the ids of the products matching `query`, best match first."""
+    terms = set(tokenize(query))
+    if not terms:
+        return []
+
+    postings = list(
+        SearchPosting.objects.filter(term__in=terms).values_list('term', 'product_id', 'frequency')
+    )
+    if not postings:
+        return []
+
+    stats = SearchDocument.objects.aggregate(count=Count('pk'), avg_length=Avg('length'))
+    document_count = stats['count'] or 1
+    avg_length = stats['avg_length'] or 1
+    lengths = dict(
+        SearchDocument.objects.filter(product_id__in={product_id for _, product_id, _ in postings})
+        .values_list('product_id', 'length')
+    )
+    document_frequency = Counter(term for term, _, _ in postings)
+
+    scores = defaultdict(float)
+    for term, product_id, frequency in postings:
+        df = document_frequency[term]
+        idf = math.log(1 + (document_count - df + 0.5) / (df + 0.5))
+        length = lengths.get(product_id, avg_length)
+        norm = frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+        scores[product_id] += idf * frequency * (BM25_K1 + 1) / norm
+
+    # Newer products win ties
+    return sorted(scores, key=lambda product_id: (-scores[product_id], -product_id))
@@ -13,9 +13,46 @@ from .models import (
     PaymentMethod,
     Payment,
     CartItem,
-    
+    Tag,
+    ProductListing,
 )
 from django.contrib.auth import get_user_model
+from django.db.models import Prefetch
+from django.core.files.storage import default_storage
+
+
+# Serializers that read related objects declare them here, so that list views
+# can load a whole page in a fixed number of queries instead of one per row.
+class EagerLoadingMixin:
+    select_related_fields = ()
+    prefetch_related_fields = ()
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        if cls.select_related_fields:
+            queryset = queryset.select_related(*cls.select_related_fields)
+        if cls.prefetch_related_fields:
+            queryset = queryset.prefetch_related(*cls.prefetch_related_fields)
+        return queryset
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """
+    Exposes the resized variants recorded by api_operations/image_variants.py
+    as {variant: {'webp': url, 'fallback': url}}.
+    """
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        variants = {}
+        for variant, formats in (value or {}).items():
+            if variant == 'source':
+                continue
+            variants[variant] = {}
+            for kind, name in formats.items():
+                url = default_storage.url(name)
+                variants[variant][kind] = request.build_absolute_uri(url) if request is not None else url
+        return variants
 
 
 # This line retrieves the User model. The get_user_model function is a Django function that retrieves the currently active user model.
@@ -80,13 +117,16 @@ class ProductSerializer(serializers.ModelSerializer):
 class UserProfileSerializer(serializers.ModelSerializer):
     user = CustomUserSerializer(read_only=True)
     wishlist = ProductSerializer(many=True, read_only=True)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = UserProfile
-        fields = ['id', 'country', 'city', 'adress', 'phone_number', 'profile_picture', 'user', 'wishlist']
+        fields = ['id', 'country', 'city', 'adress', 'phone_number', 'profile_picture', 'image_variants', 'user', 'wishlist']
 
 
 class CategorySerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Category
         fields = '__all__'
@@ -101,7 +141,12 @@ class ProductSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'brand', 'model', 'produced_year', 'country_of_origin', 'description', 'keywords', 'condition', 'price', 'publishing_date', 'quantity', 'image', 'category', 'user', 'category_name']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(EagerLoadingMixin, serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+    # derived from keywords, which stays the writable field
+    tags = serializers.SlugRelatedField(slug_field='slug', many=True, read_only=True)
+
+    prefetch_related_fields = (Prefetch('tags', queryset=Tag.objects.order_by('slug')),)
 
     class Meta:
         model = Product
@@ -109,43 +154,124 @@ class ProductSerializer(serializers.ModelSerializer):
         
         
 
+class ProductListingSerializer(serializers.ModelSerializer):
+    """Product cards: ProductSerializer's fields plus the denormalized ones, read from ProductListing."""
+    image_variants = ImageVariantsField()
+
+    class Meta:
+        model = ProductListing
+        fields = ['id', 'image_variants', 'tags', 'name', 'brand', 'model', 'produced_year', 'country_of_origin',
+                  'description', 'keywords', 'condition', 'price', 'publishing_date', 'updated_at', 'quantity',
+                  'image', 'category', 'user', 'category_name', 'seller_username', 'in_stock', 'wishlist_count']
+        read_only_fields = fields
+
+
 class ProductConditionSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductCondition
         fields = '__all__'
         
         
+class CategoryLookupField(serializers.RelatedField):
+    """
+    Resolves a category id against the categories passed in the serializer
+    context, so validating thousands of rows does not query once per row.
+    """
+    default_error_messages = {
+        'does_not_exist': 'Invalid pk "{pk_value}" - object does not exist.',
+        'incorrect_type': 'Incorrect type. Expected pk value, received {data_type}.',
+    }
+
+    def to_internal_value(self, data):
+        try:
+            return self.context['categories'][int(data)]
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+
+    def to_representation(self, value):
+        return value.pk
+
+
+class ProductImportSerializer(ProductSerializer):
+    category = CategoryLookupField(queryset=Category.objects.all(), required=False, allow_null=True)
+
+    class Meta(ProductSerializer.Meta):
+        # the owner is the importing user and images are uploaded separately
+        fields = ['name', 'brand', 'model', 'produced_year', 'country_of_origin', 'description', 'keywords',
+                  'category', 'condition', 'price', 'quantity']
+
 
-class CartItemSerializer(serializers.ModelSerializer):
+
+class CartItemSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     product = ProductSerializer()
     user = serializers.ReadOnlyField(source='product.user.username')
 
+    select_related_fields = ('product__user',)
+    prefetch_related_fields = (Prefetch('product__tags', queryset=Tag.objects.order_by('slug')),)
+
     class Meta:
         model = CartItem
         fields = ['id', 'product', 'quantity', 'user']
 
 
-class ShoppingCartSerializer(serializers.ModelSerializer):
+class ShoppingCartSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
 
+    prefetch_related_fields = (
+        Prefetch('items', queryset=CartItemSerializer.setup_eager_loading(CartItem.objects.all())),
+    )
+
     class Meta:
         model = ShoppingCart
-        fields = '__all__'
+        # version is the bookkeeping of api_operations/cart_store.py
+        exclude = ['version']
+
+
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, required=False)
 
+    def validate(self, data):
+        if data['op'] == 'add':
+            data.setdefault('quantity', 1)
+            if data['quantity'] < 1:
+                raise serializers.ValidationError({'quantity': 'Ensure this value is greater than or equal to 1.'})
+        elif data['op'] == 'set' and 'quantity' not in data:
+            raise serializers.ValidationError({'quantity': 'This field is required.'})
+        elif data['op'] == 'remove':
+            data['quantity'] = 0
+        return data
 
-class OrderProductSerializer(serializers.ModelSerializer):
+
+class CartBatchSerializer(serializers.Serializer):
+    MAX_OPERATIONS = 100
+
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=MAX_OPERATIONS)
+
+
+class OrderProductSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     buyer_username = serializers.ReadOnlyField(source='order.user.username')
 
+    select_related_fields = ('product', 'order__user')
+    prefetch_related_fields = (Prefetch('product__tags', queryset=Tag.objects.order_by('slug')),)
+
     class Meta:
         model = OrderProduct
         fields = ['product', 'quantity', 'price', 'order', 'buyer_username']
         
         
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(EagerLoadingMixin, serializers.ModelSerializer):
     orderproduct_set = OrderProductSerializer(many=True, read_only=True)
 
+    prefetch_related_fields = (
+        Prefetch('orderproduct_set', queryset=OrderProductSerializer.setup_eager_loading(OrderProduct.objects.order_by('pk'))),
+    )
+
     class Meta:
         model = Order
         fields = ['id', 'user', 'total_price', 'shipping_address', 'order_date', 'status', 'orderproduct_set']
@@ -0,0 +1,15 @@
+from django.dispatch import Signal
+
+# Sent after Product rows are written with bulk_create, which bypasses post_save.
+# Receivers get `instances`, the saved products (with their primary keys).
+products_bulk_created = Signal()
+
+# Sent once the resized variants of an uploaded image have been recorded with a
+# queryset update, which bypasses post_save. Receivers get the model as sender
+# and `pk`, the primary key of the updated row.
+image_variants_ready = Signal()
+
+# Sent after checkout takes products out of stock with a conditional queryset update,
+# which bypasses post_save. Receivers get `instances`, the products as loaded, with
+# quantity and updated_at set to their new values.
+products_stock_taken = Signal()
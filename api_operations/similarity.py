@@ -0,0 +1,268 @@
+"""
+Content-based "similar products".
+
+Each product is turned into a sparse TF-IDF vector over its brand, model,
+category, decade and name/description terms, normalized to unit length and
+stored one ProductFeature row per non-zero component. The cosine similarity
+of two products is then the sum of weight products over their shared
+features, which a single self-join on the (feature, product, weight) index
+computes for one product against the whole catalog. Features carried by more
+than MAX_FEATURE_PRODUCTS products are left out of the vectors: they say
+little about similarity and would make that join grow with the catalog.
+
+The top SIMILAR_PRODUCTS_PER_PRODUCT neighbours of every product are kept in
+SimilarProduct, so serving them is one indexed lookup. Saving a product, or
+importing products in bulk, only rewrites their vectors and leaves their
+neighbour lists pending; deleting one leaves the lists it was in pending. A
+pending list is computed on first read or by rebuild_similar_products
+--pending, which also offers the product to its neighbours' lists and
+recomputes the lists it dropped out of. Requests therefore never run the
+neighbour join. Weights use the document frequencies at write time, a full
+rebuild re-weights everything.
+"""
+import math
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import Count
+
+from .models import Product, ProductFeature, SimilarityDocument, SimilarProduct
+from .search import tokenize
+
+
+SIMILAR_PRODUCTS_PER_PRODUCT = 12
+
+# Multiplier of each kind of feature: sharing a brand or model says more than sharing a word
+FEATURE_WEIGHTS = {
+    'brand': 3.0,
+    'model': 3.0,
+    'category': 2.0,
+    'decade': 2.0,
+    'term': 1.0,
+}
+
+MAX_FEATURE_PRODUCTS = 1000
+MAX_FEATURE_LENGTH = 80
+
+# Product fields the vectors are built from, saves that change none of them skip the refresh
+SOURCE_FIELDS = ('name', 'brand', 'model', 'category_id', 'produced_year', 'description')
+
+FEATURE_INSERT_SQL = (
+    f'INSERT INTO {ProductFeature._meta.db_table} (feature, product_id, weight) VALUES (%s, %s, %s)'
+)
+NEIGHBOURS_SQL = f'''
+    SELECT other.product_id, SUM(own.weight * other.weight) AS score
+    FROM {ProductFeature._meta.db_table} own
+    JOIN {ProductFeature._meta.db_table} other ON other.feature = own.feature
+    WHERE own.product_id = %s AND other.product_id <> %s
+    GROUP BY other.product_id
+    ORDER BY score DESC, other.product_id DESC
+    LIMIT %s
+'''
+
+
+def product_features(product):
+    """Raw term frequencies of a product's features, keyed by 'kind:value'."""
+    features = Counter()
+    if product.brand:
+        features[f'brand:{product.brand.strip().lower()}'] += 1
+    if product.model:
+        features[f'model:{product.model.strip().lower()}'] += 1
+    if product.category_id:
+        features[f'category:{product.category_id}'] += 1
+    if product.produced_year:
+        features[f'decade:{product.produced_year // 10 * 10}'] += 1
+    for field in ('name', 'description'):
+        for token in tokenize(getattr(product, field)):
+            features[f'term:{token}'] += 1
+    return {feature[:MAX_FEATURE_LENGTH]: count for feature, count in features.items()}
+
+
+def feature_vector(features, document_frequency, document_count):
+    """Unit-length TF-IDF vector of the raw features, as {feature: weight}."""
+    vector = {}
+    for feature, count in features.items():
+        df = document_frequency.get(feature, 0)
+        if df > MAX_FEATURE_PRODUCTS:
+            continue
+        kind = feature.split(':', 1)[0]
+        idf = math.log((document_count + 1) / (df + 1)) + 1
+        vector[feature] = FEATURE_WEIGHTS[kind] * (1 + math.log(count)) * idf
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    return {feature: weight / norm for feature, weight in vector.items()} if norm else {}
+
+
+def _write_vectors(vectors, neighbours_computed=False):
+    """Replace the stored vectors of {product id: vector}."""
+    with transaction.atomic():
+        ProductFeature.objects.filter(product_id__in=vectors).delete()
+        SimilarityDocument.objects.filter(product_id__in=vectors).delete()
+        SimilarityDocument.objects.bulk_create([
+            SimilarityDocument(product_id=product_id, neighbours_computed=neighbours_computed)
+            for product_id in vectors
+        ])
+        with connection.cursor() as cursor:
+            cursor.executemany(FEATURE_INSERT_SQL, [
+                (feature, product_id, weight)
+                for product_id, vector in vectors.items() for feature, weight in vector.items()
+            ])
+
+
+def index_features(products):
+    """Store the vectors of `products`, weighted with the current document frequencies."""
+    features = {product.pk: product_features(product) for product in products}
+    all_features = set().union(*features.values())
+    document_frequency = Counter(dict(
+        ProductFeature.objects.filter(feature__in=all_features).exclude(product_id__in=features)
+        .values_list('feature').annotate(count=Count('pk')).order_by()
+    ))
+    # the products being indexed count towards the frequencies of their own features
+    for raw in features.values():
+        document_frequency.update(raw.keys())
+    document_count = Product.objects.count()
+    _write_vectors({
+        product_id: feature_vector(raw, document_frequency, document_count)
+        for product_id, raw in features.items()
+    })
+
+
+def nearest_neighbours(product_id, limit=SIMILAR_PRODUCTS_PER_PRODUCT):
+    """[(product id, cosine similarity)] of the closest products, computed from the stored vectors."""
+    with connection.cursor() as cursor:
+        cursor.execute(NEIGHBOURS_SQL, [product_id, product_id, limit])
+        return [(other_id, score) for other_id, score in cursor.fetchall() if score > 0]
+
+
+def _store_neighbours(product_id, neighbours):
+    SimilarProduct.objects.filter(product_id=product_id).delete()
+    SimilarProduct.objects.bulk_create([
+        SimilarProduct(product_id=product_id, similar_id=other_id, score=score) for other_id, score in neighbours
+    ])
+
+
+def _offer(product_id, candidate_id, score):
+    """Add candidate_id to product_id's list if it beats the weakest neighbour."""
+    listed = list(SimilarProduct.objects.filter(product_id=product_id).values_list('pk', 'score'))
+    if len(listed) >= SIMILAR_PRODUCTS_PER_PRODUCT:
+        weakest_pk, weakest_score = min(listed, key=lambda row: row[1])
+        if score <= weakest_score:
+            return
+        SimilarProduct.objects.filter(pk=weakest_pk).delete()
+    SimilarProduct.objects.create(product_id=product_id, similar_id=candidate_id, score=score)
+
+
+def listed_by(product_id):
+    """Ids of the products whose neighbour list holds `product_id`."""
+    return list(SimilarProduct.objects.filter(similar_id=product_id).values_list('product_id', flat=True))
+
+
+def recompute_neighbours(product_ids):
+    """Recompute the lists of `product_ids` from the stored vectors, e.g. after one of their neighbours was deleted."""
+    with transaction.atomic():
+        for product_id in product_ids:
+            _store_neighbours(product_id, nearest_neighbours(product_id))
+
+
+def mark_pending(product_ids):
+    """Leave the lists of `product_ids` to be recomputed on first read, e.g. after one of their neighbours was deleted."""
+    SimilarityDocument.objects.filter(product_id__in=product_ids).update(neighbours_computed=False)
+
+
+def update_neighbours(product_id):
+    """Refresh the list of `product_id` and the lists it enters or leaves."""
+    neighbours = nearest_neighbours(product_id)
+    with transaction.atomic():
+        previously_listed_by = set(listed_by(product_id))
+        SimilarProduct.objects.filter(similar_id=product_id).delete()
+        _store_neighbours(product_id, neighbours)
+        # cosine similarity is symmetric, so the product may now belong in its neighbours' lists
+        for other_id, score in neighbours:
+            _offer(other_id, product_id, score)
+        # lists it was taken out of are one short, recompute them
+        recompute_neighbours(previously_listed_by - {other_id for other_id, _ in neighbours})
+        SimilarityDocument.objects.filter(product_id=product_id).update(neighbours_computed=True)
+
+
+def refresh_products(products, neighbours=True):
+    """
+    Re-vectorize `products`. Their neighbour lists are refreshed right away, or
+    left pending when `neighbours` is False.
+    """
+    products = [product for product in products if product.pk is not None]
+    if not products:
+        return
+    with transaction.atomic():
+        index_features(products)
+        if neighbours:
+            for product in products:
+                update_neighbours(product.pk)
+
+
+def compute_pending(batch_size=500):
+    """Compute the neighbour lists left pending by saves, imports and deletes. Returns the number of lists computed."""
+    computed = 0
+    while True:
+        pending = list(
+            SimilarityDocument.objects.filter(neighbours_computed=False)
+            .values_list('product_id', flat=True)[:batch_size]
+        )
+        if not pending:
+            return computed
+        with transaction.atomic():
+            for product_id in pending:
+                update_neighbours(product_id)
+        computed += len(pending)
+
+
+def rebuild_similar_products(batch_size=2000):
+    """
+    Re-vectorize the whole catalog with fresh document frequencies and recompute
+    every neighbour list. Returns the number of products processed.
+    """
+    products = Product.objects.only('pk', 'name', 'brand', 'model', 'category', 'produced_year', 'description')
+    features = {product.pk: product_features(product) for product in products.iterator(chunk_size=batch_size)}
+    document_frequency = Counter()
+    for raw in features.values():
+        document_frequency.update(raw.keys())
+
+    with transaction.atomic():
+        ProductFeature.objects.all().delete()
+        SimilarityDocument.objects.all().delete()
+        SimilarProduct.objects.all().delete()
+    product_ids = list(features)
+    for start in range(0, len(product_ids), batch_size):
+        batch = product_ids[start:start + batch_size]
+        _write_vectors({
+            product_id: feature_vector(features[product_id], document_frequency, len(features))
+            for product_id in batch
+        }, neighbours_computed=True)
+
+    for start in range(0, len(product_ids), batch_size):
+        with transaction.atomic():
+            rows = []
+            for product_id in product_ids[start:start + batch_size]:
+                rows.extend(
+                    SimilarProduct(product_id=product_id, similar_id=other_id, score=score)
+                    for other_id, score in nearest_neighbours(product_id)
+                )
+            SimilarProduct.objects.bulk_create(rows, batch_size=500)
+    return len(product_ids)
+
+
+def similar_product_ids(product, limit=SIMILAR_PRODUCTS_PER_PRODUCT):
+    """
+    Ids of the products most similar to `product`, best first, read from the
+    precomputed table. A pending or missing list is computed first.
+    """
+    computed = (
+        SimilarityDocument.objects.filter(product_id=product.pk)
+        .values_list('neighbours_computed', flat=True).first()
+    )
+    if computed is None:
+        refresh_products([Product.objects.get(pk=product.pk)])
+    elif not computed:
+        update_neighbours(product.pk)
+    return list(
+        SimilarProduct.objects.filter(product_id=product.pk).order_by('-score', '-similar_id')
+        .values_list('similar_id', flat=True)[:limit]
+    )
@@ -0,0 +1,149 @@
+"""
+Stock reservations for cart lines.
+
+Putting a product in a cart holds that quantity of it for STOCK_HOLD_TTL
+seconds, and every click on the line renews the hold. The stock available to
+a user is the on-hand quantity minus the unexpired holds of everybody else,
+read in one query over the (product, expires_at) index. The cart checks it
+before a line grows and ordering checks it before stock is taken, so two
+buyers cannot both get the last item.
+
+A reservation locks the product rows (SELECT ... FOR UPDATE where the
+database has it), writes the holds and only then checks the available stock,
+all in one transaction that is rolled back when it falls short. Concurrent
+reservations of a product therefore serialize on its row lock, or on SQLite's
+write lock, instead of both passing the check.
+
+Expired holds stop counting as soon as they expire. Deleting them is only
+housekeeping, done by a daemon thread every STOCK_HOLD_SWEEP_INTERVAL seconds
+and by the sweep_stock_holds command.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, StockHold
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientStock(Exception):
+    def __init__(self, available):
+        super().__init__(available)
+        # {product id: quantity available to the user}
+        self.available = available
+
+
+def available_stock(product_ids, user_id=None):
+    """{product id: on-hand quantity minus the unexpired holds of users other than `user_id`}, in one query."""
+    holds = StockHold.objects.filter(product=OuterRef('pk'), expires_at__gt=timezone.now())
+    if user_id is not None:
+        holds = holds.exclude(user_id=user_id)
+    held = holds.values('product').annotate(total=Sum('quantity')).values('total')
+    rows = (
+        Product.objects.filter(pk__in=product_ids)
+        .annotate(held=Coalesce(Subquery(held, output_field=IntegerField()), Value(0)))
+        .values_list('pk', F('quantity') - F('held'))
+    )
+    return {product_id: max(available, 0) for product_id, available in rows}
+
+
+def hold(user_id, quantities, checked=None):
+    """
+    Set the user's holds to {product id: quantity} and renew them, a quantity of 0 releasing the hold. Raises
+    InsufficientStock, holding nothing, when one of the `checked` products (all of them by default) does not have
+    that quantity available.
+    """
+    released = [product_id for product_id, quantity in quantities.items() if not quantity]
+    held = {product_id: quantity for product_id, quantity in quantities.items() if quantity}
+    checked = held.keys() if checked is None else held.keys() & set(checked)
+    expires_at = timezone.now() + timedelta(seconds=settings.STOCK_HOLD_TTL)
+    with transaction.atomic():
+        if released:
+            StockHold.objects.filter(user_id=user_id, product_id__in=released).delete()
+        if held:
+            if checked:
+                list(Product.objects.select_for_update().filter(pk__in=checked).order_by('pk').values_list('pk'))
+            StockHold.objects.bulk_create(
+                [StockHold(product_id=product_id, user_id=user_id, quantity=quantity, expires_at=expires_at)
+                 for product_id, quantity in held.items()],
+                update_conflicts=True, unique_fields=['product', 'user'], update_fields=['quantity', 'expires_at'],
+            )
+        if checked:
+            available = available_stock(checked, user_id)
+            short = {product_id: available.get(product_id, 0)
+                     for product_id in checked if held[product_id] > available.get(product_id, 0)}
+            if short:
+                raise InsufficientStock(short)
+    if held:
+        sweeper.start()
+
+
+def release(user_id, product_ids=None):
+    """Drop the user's holds on `product_ids`, or all of them."""
+    holds = StockHold.objects.filter(user_id=user_id)
+    if product_ids is not None:
+        holds = holds.filter(product_id__in=product_ids)
+    holds.delete()
+
+
+def take(user_id, product, quantity):
+    """
+    Take `quantity` of a product locked with select_for_update() out of stock for an order line, counting the
+    user's own hold as theirs. Raises InsufficientStock. Runs inside the order's transaction.
+    """
+    available = available_stock([product.pk], user_id).get(product.pk, 0)
+    if quantity > available:
+        raise InsufficientStock({product.pk: available})
+    product.quantity -= quantity
+    product.save()
+    # what is left of the hold keeps reserving the rest of the cart line
+    held = StockHold.objects.filter(product=product, user_id=user_id)
+    held.filter(quantity__lte=quantity).delete()
+    held.update(quantity=F('quantity') - quantity)
+
+
+def sweep(batch_size=1000):
+    """Delete the expired holds, `batch_size` per transaction. Returns the number deleted."""
+    now = timezone.now()
+    deleted = 0
+    while True:
+        expired = list(StockHold.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:batch_size])
+        if not expired:
+            return deleted
+        deleted += StockHold.objects.filter(pk__in=expired).delete()[0]
+
+
+class HoldSweeper:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        interval = settings.STOCK_HOLD_SWEEP_INTERVAL
+        if not interval or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, args=(interval,), name='stock-hold-sweeper', daemon=True)
+                self._thread.start()
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                sweep()
+            except Exception:
+                logger.exception('Sweeping expired stock holds failed')
+            finally:
+                connections.close_all()
+
+
+sweeper = HoldSweeper()
@@ -0,0 +1,142 @@
+"""
+Normalized product tags.
+
+Product.keywords stays the free-text field sellers edit; every write splits it
+on commas into Tag rows linked through ProductTag. Tag filters then resolve
+through the (tag, product) index instead of scanning keyword strings, and each
+Tag keeps a denormalized product_count for the tag cloud.
+"""
+import re
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils.text import slugify
+
+from .catalog_cache import bump_versions
+from .models import Product, ProductTag, Tag
+
+
+TAG_NAME_MAX_LENGTH = 50
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def parse_keywords(keywords):
+    """Split a comma-separated keyword string into {slug: name}, first spelling wins."""
+    tags = {}
+    for keyword in (keywords or '').split(','):
+        name = WHITESPACE_RE.sub(' ', keyword).strip().lower()[:TAG_NAME_MAX_LENGTH]
+        slug = slugify(name, allow_unicode=True)
+        if slug and slug not in tags:
+            tags[slug] = name
+    return tags
+
+
+def parse_slugs(value):
+    """Split the value of a tag filter (comma-separated slugs) into a list."""
+    return [slug for slug in (slugify(part, allow_unicode=True) for part in (value or '').split(',')) if slug]
+
+
+def _get_or_create_tags(names):
+    """Return {slug: tag id} for the given {slug: name}, creating missing tags."""
+    if not names:
+        return {}
+    existing = dict(Tag.objects.filter(slug__in=names).values_list('slug', 'pk'))
+    missing = [Tag(slug=slug, name=name) for slug, name in names.items() if slug not in existing]
+    if missing:
+        # another writer may create the same tag in the meantime
+        Tag.objects.bulk_create(missing, ignore_conflicts=True)
+        existing = dict(Tag.objects.filter(slug__in=names).values_list('slug', 'pk'))
+    return existing
+
+
+def sync_product_tags(products):
+    """Make the ProductTag rows of `products` match their keywords."""
+    products = [product for product in products if product.pk is not None]
+    if not products:
+        return
+
+    wanted = {product.pk: parse_keywords(product.keywords) for product in products}
+    names = {}
+    for tags in wanted.values():
+        for slug, name in tags.items():
+            names.setdefault(slug, name)
+
+    with transaction.atomic():
+        tag_ids = _get_or_create_tags(names)
+        current = set(
+            ProductTag.objects.filter(product_id__in=wanted).values_list('product_id', 'tag_id')
+        )
+        target = {(product_id, tag_ids[slug]) for product_id, tags in wanted.items() for slug in tags}
+
+        removed = current - target
+        added = target - current
+        removed_by_product = {}
+        for product_id, tag_id in removed:
+            removed_by_product.setdefault(product_id, []).append(tag_id)
+        for product_id, removed_tag_ids in removed_by_product.items():
+            ProductTag.objects.filter(product_id=product_id, tag_id__in=removed_tag_ids).delete()
+        if added:
+            ProductTag.objects.bulk_create(
+                [ProductTag(product_id=product_id, tag_id=tag_id) for product_id, tag_id in added]
+            )
+
+        deltas = Counter()
+        deltas.subtract(tag_id for _, tag_id in removed)
+        deltas.update(tag_id for _, tag_id in added)
+        apply_count_deltas(deltas)
+
+
+def apply_count_deltas(deltas):
+    """Apply {tag id: delta} to the denormalized product counts, one UPDATE per distinct delta."""
+    by_delta = {}
+    for tag_id, delta in deltas.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(tag_id)
+    for delta, tag_ids in by_delta.items():
+        Tag.objects.filter(pk__in=tag_ids).update(product_count=F('product_count') + delta)
+    if by_delta:
+        bump_versions('tags')
+
+
+def remove_product_tags(product_id):
+    """Drop a product's counts before its ProductTag rows are cascaded away."""
+    tag_ids = list(ProductTag.objects.filter(product_id=product_id).values_list('tag_id', flat=True))
+    apply_count_deltas(Counter(dict.fromkeys(tag_ids, -1)))
+
+
+def rebuild_tags(batch_size=2000):
+    """Re-split every product's keywords and recount the tags. Returns the number of products processed."""
+    processed = 0
+    batch = []
+    for product in Product.objects.only('pk', 'keywords').iterator(chunk_size=batch_size):
+        batch.append(product)
+        if len(batch) >= batch_size:
+            sync_product_tags(batch)
+            processed += len(batch)
+            batch = []
+    if batch:
+        sync_product_tags(batch)
+        processed += len(batch)
+
+    recount_tags()
+    return processed
+
+
+def recount_tags():
+    """Recompute every product_count from the ProductTag table."""
+    counts = dict(ProductTag.objects.values_list('tag_id').annotate(count=Count('pk')).order_by())
+    with transaction.atomic():
+        for tag in Tag.objects.only('pk', 'product_count'):
+            if tag.product_count != counts.get(tag.pk, 0):
+                Tag.objects.filter(pk=tag.pk).update(product_count=counts.get(tag.pk, 0))
+    bump_versions('tags')
+
+
+def tag_cloud(limit):
+    """The `limit` most used tags, as [{'name', 'slug', 'product_count'}]."""
+    return list(
+        Tag.objects.filter(product_count__gt=0)
+        .order_by('-product_count', 'slug')
+        .values('name', 'slug', 'product_count')[:limit]
+    )
@@ -11,6 +11,7 @@ from .views import (
     CustomUserUpdateView,
     OrderCreateView,
     OrderProductCreateView,
+    CheckoutView,
     PaymentProcessView,
     OrderListView,
     OrderDetailView,
@@ -24,8 +25,16 @@ from .views import (
     WishlistView,
     ClearCartView,
     CategoryProductsList,
-    SoldOrdersView
-    
+    SoldOrdersView,
+    SoldOrdersSummaryView,
+    CatalogCacheStatsView,
+    ProductFacetsView,
+    ProductImportView,
+    TagCloudView,
+    SimilarProductsView,
+    TrendingProductsView,
+    AutocompleteView,
+    ProductExportView,
 )
 
 app_name = 'api_operations'
@@ -35,13 +44,21 @@ urlpatterns = [
     path('api/categories/<int:pk>/', CategoryDetailView.as_view(), name='category-detail'),
     path('api/categories/', CategoryList.as_view(), name='category_list'),
     path('api/categories/<int:category_id>/products/', CategoryProductsList.as_view(), name='category-products'),
+    path('api/cache/stats/', CatalogCacheStatsView.as_view(), name='catalog_cache_stats'),
     
      #Products
     path('api/products/create/', ProductCreate.as_view(), name='product_create'),
+    path('api/products/import/', ProductImportView.as_view(), name='product_import'),
+    path('api/products/export.<slug:export_format>', ProductExportView.as_view(), name='product_export'),
     path('api/products/', ProductList.as_view(), name='product_list'),
     path('api/products/<int:pk>/', ProductDetail.as_view(), name='product_detail'),
+    path('api/products/<int:pk>/similar/', SimilarProductsView.as_view(), name='similar_products'),
     # path('api/products/unique-products/', UniqueProductList.as_view(), name='unique-product-list'),
     path('api/products/search/', ProductSearchView.as_view(), name='product_search'),
+    path('api/products/facets/', ProductFacetsView.as_view(), name='product_facets'),
+    path('api/products/trending/', TrendingProductsView.as_view(), name='trending_products'),
+    path('api/products/autocomplete/', AutocompleteView.as_view(), name='product_autocomplete'),
+    path('api/tags/', TagCloudView.as_view(), name='tag_cloud'),
     
     #Wishlist
     path('api/wishlist/', WishlistView.as_view(), name='wishlist'),
@@ -60,11 +77,13 @@ urlpatterns = [
     #Orders
     path('order/create/', OrderCreateView.as_view(), name='order_create'),
     path('order/product/add/', OrderProductCreateView.as_view(), name='order_product_add'),
+    path('checkout/', CheckoutView.as_view(), name='checkout'),
     path('api/orders/', OrderListView.as_view(), name='order_list'),
     path('api/orders/<int:pk>/', OrderDetailView.as_view(), name='order_detail'),
     
     #Selling
     path('api/sold_orders', SoldOrdersView.as_view(), name='sold_orders'),
+    path('api/sold_orders/summary/', SoldOrdersSummaryView.as_view(), name='sold_orders_summary'),
     
     #Payments
     path('payment/process/', PaymentProcessView.as_view(), name='payment_process'),
@@ -72,6 +91,7 @@ urlpatterns = [
     #Shopping Cart
     path('api/shopping-cart/', ShoppingCartViewSet.as_view({'get': 'list'}), name='shoppingcart_list'),
     path('api/shopping-cart/add-product/', ShoppingCartViewSet.as_view({'post': 'add_product'}), name='shoppingcart_add_product'),
+    path('api/shopping-cart/batch/', ShoppingCartViewSet.as_view({'post': 'batch'}), name='shoppingcart_batch'),
     path('api/shopping-cart/<int:pk>/remove-product/', ShoppingCartViewSet.as_view({'delete': 'remove_product'}), name='shoppingcart_remove_product'),
     path('api/shopping-cart/<int:pk>/delete-product/', ShoppingCartViewSet.as_view({'delete': 'delete_product'}), name='shoppingcart_delete_product'),
     path('api/shopping-cart/<int:pk>/increment-product/', ShoppingCartViewSet.as_view({'post': 'increment_product'}), name='shoppingcart_increment_product'),
@@ -0,0 +1,167 @@
+"""
+Read-only fast path for the large list endpoints.
+
+A ValuesSerializer produces exactly the dicts of its `serializer_class`, but
+from queryset.values() rows: no model instances are built, and only the fields
+whose representation differs from the stored value (dates, decimals, files,
+...) go through their DRF field. Nested serializers and many-to-many fields
+are loaded with one extra query each, for the whole page.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField
+from rest_framework.response import Response
+
+from .models import OrderProduct, ProductTag
+from .serializers import OrderProductSerializer, OrderSerializer, ProductListingSerializer, ProductSerializer
+
+
+# Fields whose to_representation() returns the stored value unchanged
+PASSTHROUGH_FIELDS = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.ChoiceField,
+    serializers.IntegerField,
+    serializers.PrimaryKeyRelatedField,
+    serializers.ReadOnlyField,
+)
+
+
+class ValuesSerializer:
+    serializer_class = None
+    # fields that are not columns, filled in by load_related()
+    related_fields = ()
+
+    def __init__(self, context=None):
+        self.context = context or {}
+        self.model = self.serializer_class.Meta.model
+        self.fields = []  # (name, values() key, converter or None), in the serializer's order
+        for name, field in self.serializer_class(context=self.context).fields.items():
+            if field.write_only:
+                continue
+            if name in self.related_fields:
+                self.fields.append((name, None, None))
+                continue
+            if isinstance(field, (serializers.BaseSerializer, ManyRelatedField)):
+                raise ImproperlyConfigured(f'{type(self).__name__} must list "{name}" in related_fields')
+            self.fields.append((name, self._column(field), self._converter(field)))
+        self.columns = list(dict.fromkeys(column for _, column, _ in self.fields if column))
+
+    def _column(self, field):
+        if isinstance(field, serializers.PrimaryKeyRelatedField):
+            return self.model._meta.get_field(field.source).attname
+        return field.source.replace('.', '__')
+
+    def _converter(self, field):
+        if type(field) in PASSTHROUGH_FIELDS:
+            return None
+        if isinstance(field, serializers.FileField):
+            return self._file_url
+        return field.to_representation
+
+    def _file_url(self, name):
+        # FileField.to_representation, for a stored name instead of a FieldFile
+        url = default_storage.url(name)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+    def values(self, queryset):
+        """The queryset as the values() rows represent() expects."""
+        return queryset.select_related(None).prefetch_related(None).values(*self.columns)
+
+    def load_related(self, rows):
+        """{field name: {row pk: value}} for the related_fields of `rows`."""
+        return {}
+
+    def represent(self, rows):
+        rows = list(rows)
+        related = self.load_related(rows)
+        data = []
+        for row in rows:
+            item = {}
+            for name, column, converter in self.fields:
+                if column is None:
+                    item[name] = related[name].get(row['id'], [])
+                    continue
+                value = row[column]
+                if value is None or value == '' and converter == self._file_url:
+                    item[name] = None
+                else:
+                    item[name] = converter(value) if converter is not None else value
+            data.append(item)
+        return data
+
+
+class ProductValuesSerializer(ValuesSerializer):
+    serializer_class = ProductSerializer
+    related_fields = ('tags',)
+
+    def load_related(self, rows):
+        tags = {}
+        product_tags = (
+            ProductTag.objects.filter(product_id__in=[row['id'] for row in rows])
+            .order_by('tag__slug').values_list('product_id', 'tag__slug')
+        )
+        for product_id, slug in product_tags:
+            tags.setdefault(product_id, []).append(slug)
+        return {'tags': tags}
+
+
+class ProductListingValuesSerializer(ValuesSerializer):
+    # every field is a column of ProductListing, a page is one query
+    serializer_class = ProductListingSerializer
+
+
+class OrderProductValuesSerializer(ValuesSerializer):
+    serializer_class = OrderProductSerializer
+    related_fields = ('product',)
+
+    def __init__(self, context=None):
+        super().__init__(context)
+        self.product_serializer = ProductValuesSerializer(self.context)
+
+    def values(self, queryset):
+        # the line id and the product's own columns, joined in like select_related('product')
+        product_columns = [f'product__{column}' for column in self.product_serializer.columns]
+        return super().values(queryset).values(*self.columns, 'id', *product_columns)
+
+    def load_related(self, rows):
+        prefix = len('product__')
+        product_rows = [
+            {column[prefix:]: value for column, value in row.items() if column.startswith('product__')}
+            for row in rows
+        ]
+        products = self.product_serializer.represent(product_rows)
+        return {'product': {row['id']: product for row, product in zip(rows, products)}}
+
+
+class OrderValuesSerializer(ValuesSerializer):
+    serializer_class = OrderSerializer
+    related_fields = ('orderproduct_set',)
+
+    def load_related(self, rows):
+        line_serializer = OrderProductValuesSerializer(self.context)
+        line_rows = list(line_serializer.values(
+            OrderProduct.objects.filter(order_id__in=[row['id'] for row in rows]).order_by('pk')
+        ))
+        lines = {}
+        for row, item in zip(line_rows, line_serializer.represent(line_rows)):
+            lines.setdefault(item['order'], []).append(item)
+        return {'orderproduct_set': lines}
+
+
+class ValuesListMixin:
+    """
+    Serves list() through `values_serializer_class` instead of the view's
+    serializer. The response body is the same.
+    """
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        values_serializer = self.values_serializer_class(self.get_serializer_context())
+        queryset = values_serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(values_serializer.represent(page))
+        return Response(values_serializer.represent(queryset))
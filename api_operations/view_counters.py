@@ -0,0 +1,156 @@
+"""
+Write-behind product view counters and the trending list.
+
+ProductDetail only bumps an in-memory Counter under a lock, so counting a
+view never touches the database. A daemon thread flushes the buffer every
+VIEW_COUNTER_FLUSH_INTERVAL seconds, or earlier once VIEW_COUNTER_FLUSH_SIZE
+views are buffered, as one transaction of upserts into the lifetime totals
+(ProductViewCount) and the hourly buckets (ProductViewBucket). Each flush
+then re-ranks the products by their views over the trending window into
+TrendingProduct, which is what /api/products/trending/ reads.
+
+Every process has its own buffer. Flushes add to the stored counts instead
+of overwriting them, so any number of workers can flush concurrently.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Sum
+
+from . import autocomplete
+from .models import Product, ProductViewBucket, ProductViewCount, TrendingProduct
+
+logger = logging.getLogger(__name__)
+
+
+TOTAL_UPSERT_SQL = (
+    f'INSERT INTO {ProductViewCount._meta.db_table} (product_id, views) VALUES (%s, %s) '
+    f'ON CONFLICT (product_id) DO UPDATE SET views = {ProductViewCount._meta.db_table}.views + excluded.views'
+)
+BUCKET_UPSERT_SQL = (
+    f'INSERT INTO {ProductViewBucket._meta.db_table} (product_id, hour, views) VALUES (%s, %s, %s) '
+    f'ON CONFLICT (product_id, hour) DO UPDATE SET views = {ProductViewBucket._meta.db_table}.views + excluded.views'
+)
+
+
+def current_hour():
+    """Hours since the epoch, the key of the hourly buckets."""
+    return int(time.time() // 3600)
+
+
+class ViewCounterBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._buffered = 0
+        self._wakeup = threading.Event()
+        self._flusher = None
+
+    def record(self, product_id):
+        with self._lock:
+            self._counts[product_id] += 1
+            self._buffered += 1
+            full = self._buffered >= settings.VIEW_COUNTER_FLUSH_SIZE
+        if self._start_flusher():
+            if full:
+                self._wakeup.set()
+        elif full:
+            self.flush()
+
+    def pending(self):
+        with self._lock:
+            return self._buffered
+
+    def flush(self):
+        """Write the buffered views to the database. Returns the number of views written."""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._buffered = 0
+        if not counts:
+            return 0
+        try:
+            write_views(counts)
+        except Exception:
+            # keep the views for the next flush rather than losing them
+            with self._lock:
+                self._counts.update(counts)
+                self._buffered += sum(counts.values())
+            raise
+        return sum(counts.values())
+
+    def _start_flusher(self):
+        interval = settings.VIEW_COUNTER_FLUSH_INTERVAL
+        if not interval:
+            return False
+        if self._flusher is None:
+            with self._lock:
+                if self._flusher is None:
+                    self._flusher = threading.Thread(
+                        target=self._run, args=(interval,), name='view-counter-flusher', daemon=True)
+                    self._flusher.start()
+                    atexit.register(self.flush)
+        return True
+
+    def _run(self, interval):
+        while True:
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing product view counters failed')
+            finally:
+                connections.close_all()
+
+
+buffer = ViewCounterBuffer()
+
+
+def record_view(product_id):
+    buffer.record(int(product_id))
+
+
+def flush_views():
+    return buffer.flush()
+
+
+def write_views(counts, hour=None):
+    """Add {product id: views} to the totals and to the bucket of `hour`, then re-rank the trending list."""
+    hour = current_hour() if hour is None else hour
+    # products deleted since they were viewed have nothing left to count against
+    existing = set(Product.objects.filter(pk__in=counts).values_list('pk', flat=True))
+    counts = {product_id: views for product_id, views in counts.items() if product_id in existing}
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.executemany(TOTAL_UPSERT_SQL, list(counts.items()))
+            cursor.executemany(BUCKET_UPSERT_SQL, [(product_id, hour, views) for product_id, views in counts.items()])
+        refresh_trending(hour)
+        transaction.on_commit(lambda: autocomplete.add_views(counts))
+
+
+def refresh_trending(hour=None):
+    """Replace the trending list with the most viewed products of the window ending at `hour`."""
+    hour = current_hour() if hour is None else hour
+    window_start = hour - settings.TRENDING_WINDOW_HOURS + 1
+    ranking = (
+        ProductViewBucket.objects.filter(hour__gte=window_start)
+        .values('product_id').annotate(views=Sum('views'))
+        .order_by('-views', '-product_id')[:settings.TRENDING_SIZE]
+    )
+    with transaction.atomic():
+        ProductViewBucket.objects.filter(hour__lt=window_start).delete()
+        TrendingProduct.objects.all().delete()
+        TrendingProduct.objects.bulk_create([
+            TrendingProduct(rank=rank, product_id=row['product_id'], views=row['views'])
+            for rank, row in enumerate(ranking, start=1)
+        ])
+
+
+def trending(limit):
+    """[(product id, views in the window)] of the trending list, best first."""
+    return list(TrendingProduct.objects.order_by('rank').values_list('product_id', 'views')[:limit])
@@ -1,8 +1,9 @@
+from django.conf import settings
 from django.db import transaction
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from .models import ShoppingCart, CartItem, Product
-from .serializers import ShoppingCartSerializer, CartItemSerializer
+from .serializers import ShoppingCartSerializer, CartItemSerializer, CartBatchSerializer
 from rest_framework import generics
 from rest_framework import generics, permissions
 from django_filters.rest_framework import DjangoFilterBackend
@@ -12,14 +13,35 @@ from django.contrib.auth import get_user_model
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
 from rest_framework.generics import RetrieveAPIView
 from rest_framework.parsers import MultiPartParser, FormParser
-from django.db.models import Q
+from django.db.models import Count, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from datetime import timedelta
 from .permissions import IsOrderOwner, IsShoppingCartOwner, IsUserProfileOwner, IsProductOwnerOrReadOnly, IsCustomUserOwner
 from rest_framework.permissions import IsAuthenticated, AllowAny
 # hypothetical payment processor module
 from .payment_processor import process_payment
+from .search import search_products
+from .facets import precomputed_facet_counts, queryset_facet_counts
+from .tags import parse_slugs, tag_cloud
+from .similarity import SIMILAR_PRODUCTS_PER_PRODUCT, similar_product_ids
+from .view_counters import record_view, trending
+from .autocomplete import suggest
+from .catalog_export import EXPORT_FORMATS, accepts_gzip, export_chunks, gzip_stream, parse_updated_since, render_export
+from .product_import import IMPORT_FORMATS, detect_format, import_products
+from .catalog_cache import CatalogCacheMixin, get_stats
+from . import cart_store
+from .stock_holds import InsufficientStock, take
+from .checkout import checkout
+from .idempotency import idempotent
+from .sales_rollups import sales_summary
+from .values_serializers import OrderValuesSerializer, ProductListingValuesSerializer, ValuesListMixin
+from .conditional import conditional_get, product_validators, category_list_validators, shopping_cart_validators, order_validators
+from .pagination import SearchResultsPagination, ProductCursorPagination, OrderCursorPagination, OrderProductCursorPagination
 from django.shortcuts import get_object_or_404
 from rest_framework import permissions, status
 from rest_framework.views import APIView
@@ -39,11 +61,15 @@ from .models import (
     ShoppingCart,
     Category,
     CartItem,
-    OrderStatus
+    CartStatus,
+    OrderStatus,
+    ProductTag,
+    ProductListing,
 )
 
 from .serializers import (
     ProductSerializer,
+    ProductListingSerializer,
     UserProfileSerializer,
     CustomUserSerializer,
     OrderSerializer,
@@ -59,20 +85,125 @@ from .serializers import (
 
 
 class ProductFilter(django_filters.FilterSet):
+    # comma-separated tag slugs; `tags` matches any of them, `tags_all` all of them
+    tags = django_filters.CharFilter(method='filter_tags')
+    tags_all = django_filters.CharFilter(method='filter_all_tags')
+    # inclusive ranges, served by the composite indexes on Product
+    price_min = django_filters.NumberFilter(field_name='price', lookup_expr='gte')
+    price_max = django_filters.NumberFilter(field_name='price', lookup_expr='lte')
+    year_min = django_filters.NumberFilter(field_name='produced_year', lookup_expr='gte')
+    year_max = django_filters.NumberFilter(field_name='produced_year', lookup_expr='lte')
+    published_after = django_filters.IsoDateTimeFilter(field_name='publishing_date', lookup_expr='gte')
+
     class Meta:
         model = Product
         fields = ['category', 'name', 'price', 'brand', 'model', 'produced_year',
-                  'country_of_origin', 'description', 'keywords', 'condition', 'user']
+                  'country_of_origin', 'description', 'condition', 'user']
         filter
 
+    # Both filters are IN subqueries on the (tag, product) index, so no DISTINCT is needed
+    def filter_tags(self, queryset, name, value):
+        slugs = parse_slugs(value)
+        if not slugs:
+            return queryset
+        return queryset.filter(pk__in=ProductTag.objects.filter(tag__slug__in=slugs).values('product_id'))
+
+    def filter_all_tags(self, queryset, name, value):
+        slugs = set(parse_slugs(value))
+        if not slugs:
+            return queryset
+        matches = (
+            ProductTag.objects.filter(tag__slug__in=slugs)
+            .values('product_id').annotate(matched=Count('tag_id')).filter(matched=len(slugs))
+            .values('product_id')
+        )
+        return queryset.filter(pk__in=matches)
+
+
+class ProductListingFilter(ProductFilter):
+    """ProductFilter over the denormalized ProductListing rows the catalog lists are read from."""
+
+    class Meta(ProductFilter.Meta):
+        model = ProductListing
+
+
+class CatalogOrderingFilter(filters.OrderingFilter):
+    """
+    ?ordering= for the cursor-paginated catalog. The id is appended as a
+    tie-breaker so pages are stable, and rows with a null sort key are left
+    out because a cursor cannot point at NULL.
+    """
+    ordering_fields = ['price', 'produced_year', 'publishing_date', 'name']
+    nullable_fields = {'price', 'produced_year'}
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering or request.query_params.get(self.ordering_param) is None:
+            return ordering
+        ordering = [field for field in ordering if field.lstrip('-') != 'id']
+        return (*ordering, '-id' if ordering[0].startswith('-') else 'id')
+
+    def filter_queryset(self, request, queryset, view):
+        ordering = self.get_ordering(request, queryset, view)
+        if ordering and request.query_params.get(self.ordering_param) is not None:
+            for field in ordering:
+                if field.lstrip('-') in self.nullable_fields:
+                    queryset = queryset.exclude(**{f'{field.lstrip("-")}__isnull': True})
+            return queryset.order_by(*ordering)
+        return queryset
 
-class ProductList(generics.ListCreateAPIView):
-    queryset = Product.objects.all()
+
+class ProductFacetsView(APIView):
+    """
+    Per-facet counts of in-stock products for the filters in the query string.
+    The catalog and single-category views are read from the precomputed facet
+    table, any other filter set falls back to GROUP BY queries.
+    """
+
+    def get(self, request):
+        filterset = ProductFilter(request.query_params, queryset=Product.objects.all(), request=request)
+        if not filterset.is_valid():
+            return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        active_filters = {
+            name: value for name, value in filterset.form.cleaned_data.items() if value not in (None, '', [])
+        }
+        if not active_filters:
+            counts = precomputed_facet_counts()
+        elif set(active_filters) == {'category'}:
+            counts = precomputed_facet_counts(category_id=active_filters['category'].pk)
+        else:
+            counts = queryset_facet_counts(filterset.qs)
+        return Response(counts, status=status.HTTP_200_OK)
+
+
+class TagCloudView(CatalogCacheMixin, APIView):
+    """The most used tags with their product counts, read from the denormalized counters."""
+    cache_resource = 'tags'
+    default_limit = 100
+    max_limit = 500
+
+    def get(self, request):
+        return self.cached_response(self.tag_cloud, request)
+
+    def tag_cloud(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(tag_cloud(max(limit, 0)), status=status.HTTP_200_OK)
+
+
+class ProductList(ValuesListMixin, generics.ListCreateAPIView):
+    # listed from the denormalized cards, created through ProductSerializer
+    queryset = ProductListing.objects.all()
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, filters.OrderingFilter,]
+    values_serializer_class = ProductListingValuesSerializer
+    pagination_class = ProductCursorPagination
+    filter_backends = [DjangoFilterBackend, CatalogOrderingFilter,]
     search_fields = ['category', 'name', 'price', 'brand', 'model', 'produced_year',
                      'country_of_origin', 'description', 'keywords', 'condition', 'user']
-    filterset_class = ProductFilter
+    filterset_class = ProductListingFilter
     
     
 class ProductCreate(generics.CreateAPIView):
@@ -93,11 +224,65 @@ class ProductCreate(generics.CreateAPIView):
         
 
 
-class ProductDetail(generics.RetrieveUpdateDestroyAPIView):
+class ProductImportView(APIView):
+    """
+    Bulk product import from a CSV or JSON Lines file upload. Rows are validated
+    and written in batches, invalid rows are reported and skipped.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = (MultiPartParser, FormParser)
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'Please provide a CSV or JSONL file'}, status=status.HTTP_400_BAD_REQUEST)
+
+        import_format = request.data.get('format') or detect_format(upload.name)
+        if import_format not in IMPORT_FORMATS:
+            return Response({'error': f'Unsupported format, use one of: {", ".join(IMPORT_FORMATS)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        result = import_products(upload.file, request.user, import_format)
+        response_status = status.HTTP_201_CREATED if result['created'] else status.HTTP_400_BAD_REQUEST
+        return Response(result, status=response_status)
+
+
+class ProductExportView(APIView):
+    """
+    Streams the whole catalog, or the products changed since ?updated_since=,
+    as NDJSON or CSV. Gzipped on the fly for clients that accept it.
+    """
+
+    def get(self, request, export_format):
+        if export_format not in EXPORT_FORMATS:
+            raise Http404
+        updated_since = request.query_params.get('updated_since')
+        if updated_since:
+            try:
+                updated_since = parse_updated_since(updated_since)
+            except ValueError:
+                return Response({'error': 'updated_since must be an ISO 8601 date or datetime'},
+                                status=status.HTTP_400_BAD_REQUEST)
+        content = render_export(export_format, export_chunks(updated_since or None, {'request': request}))
+        gzipped = accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        response = StreamingHttpResponse(gzip_stream(content) if gzipped else content,
+                                         content_type=EXPORT_FORMATS[export_format])
+        response['Content-Disposition'] = f'attachment; filename="catalog.{export_format}"'
+        if gzipped:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+@method_decorator(conditional_get(product_validators), name='get')
+class ProductDetail(CatalogCacheMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_cache_resource(self):
+        return f"product:{self.kwargs['pk']}"
+
     def get_permissions(self):
         if self.request.method in ['PUT', 'PATCH', 'DELETE']:
             self.permission_classes = [IsAuthenticated, IsProductOwnerOrReadOnly]
@@ -108,6 +293,8 @@ class ProductDetail(generics.RetrieveUpdateDestroyAPIView):
     def retrieve(self, request, *args, **kwargs):
         try:
             response = super().retrieve(request, *args, **kwargs)
+            # buffered in memory, written to the database in batches
+            record_view(self.kwargs['pk'])
             user_id = request.session.get('user_id')
             if user_id:
                 response.data['is_owner'] = user_id == response.data['user']
@@ -127,38 +314,123 @@ class ProductDetail(generics.RetrieveUpdateDestroyAPIView):
 
 
 class ProductSearchView(generics.ListAPIView):
-    serializer_class = ProductSerializer
+    queryset = ProductListing.objects.all()
+    serializer_class = ProductListingSerializer
+    pagination_class = SearchResultsPagination
 
-    def get_queryset(self):
-        query = self.request.query_params.get('search', None)
-        if query:
-            queryset = Product.objects.filter(Q(name__icontains=query))
-            if not queryset:
-                raise Http404("Not Found")
-        else:
+    def list(self, request, *args, **kwargs):
+        query = request.query_params.get('search', None)
+        if not query:
             raise Http404("No search query provided.")
-        return queryset
+
+        # Ranked ids come from the inverted index, only the requested page is loaded
+        ranked_ids = search_products(query)
+        if not ranked_ids:
+            raise Http404("Not Found")
+        page = self.paginate_queryset(ranked_ids)
+        values_serializer = ProductListingValuesSerializer(self.get_serializer_context())
+        listings = {
+            listing['id']: listing
+            for listing in values_serializer.represent(values_serializer.values(ProductListing.objects.filter(pk__in=page)))
+        }
+        return self.get_paginated_response([listings[pk] for pk in page if pk in listings])
     
+class AutocompleteView(APIView):
+    """
+    Typeahead suggestions (product names, brands and models) for ?q=, most
+    popular first, answered from the in-memory prefix index.
+    """
+
+    def get(self, request):
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        query = request.query_params.get('q', '')
+        return Response({'query': query, 'suggestions': suggest(query, max(limit, 0))}, status=status.HTTP_200_OK)
+
+
+class TrendingProductsView(generics.ListAPIView):
+    """
+    Most viewed products over the trending window, read from the ranking the
+    view counter flushes precompute. Each product carries its `views` in the window.
+    """
+    serializer_class = ProductSerializer
+
+    def list(self, request, *args, **kwargs):
+        try:
+            limit = min(int(request.query_params.get('limit', settings.TRENDING_SIZE)), settings.TRENDING_SIZE)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        ranking = trending(max(limit, 0))
+        products = ProductSerializer.setup_eager_loading(Product.objects.all()).in_bulk([pk for pk, _ in ranking])
+        data = []
+        for pk, views in ranking:
+            if pk in products:
+                item = self.get_serializer(products[pk]).data
+                item['views'] = views
+                data.append(item)
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class SimilarProductsView(generics.ListAPIView):
+    """
+    Products most similar to the given one, best first, read from the
+    precomputed nearest-neighbour table. ?limit= caps the number returned.
+    """
+    serializer_class = ProductSerializer
+
+    def list(self, request, *args, **kwargs):
+        product = get_object_or_404(Product.objects.only('pk'), pk=self.kwargs['pk'])
+        try:
+            limit = min(int(request.query_params.get('limit', SIMILAR_PRODUCTS_PER_PRODUCT)), SIMILAR_PRODUCTS_PER_PRODUCT)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        similar_ids = similar_product_ids(product, max(limit, 0))
+        products = ProductSerializer.setup_eager_loading(Product.objects.all()).in_bulk(similar_ids)
+        serializer = self.get_serializer([products[pk] for pk in similar_ids if pk in products], many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
 #-------------Category------------------------------------------------------------------------------------------------------------------------
 
-class CategoryList(generics.ListAPIView):
+@method_decorator(conditional_get(category_list_validators), name='get')
+class CategoryList(CatalogCacheMixin, generics.ListAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    cache_resource = 'categories'
     
 
-class CategoryDetailView(RetrieveAPIView):
+class CategoryDetailView(CatalogCacheMixin, RetrieveAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+
+    def get_cache_resource(self):
+        return f"category:{self.kwargs['pk']}"
     
 
-class CategoryProductsList(generics.ListAPIView):
-    serializer_class = ProductSerializer
+class CategoryProductsList(CatalogCacheMixin, ValuesListMixin, generics.ListAPIView):
+    serializer_class = ProductListingSerializer
+    values_serializer_class = ProductListingValuesSerializer
+    pagination_class = ProductCursorPagination
+    filter_backends = [DjangoFilterBackend, CatalogOrderingFilter]
+    filterset_class = ProductListingFilter
+
+    def get_cache_resource(self):
+        return f"category_products:{self.kwargs['category_id']}"
 
     def get_queryset(self):
-        category_id = self.kwargs['category_id']
-        return Product.objects.filter(category_id=category_id)
+        return ProductListing.objects.filter(category_id=self.kwargs['category_id'])
     
     
+class CatalogCacheStatsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(get_stats(), status=status.HTTP_200_OK)
+
+
 # -----------------------USER-------------------------------------------------------------------------------------------------------------------------
 
 User = get_user_model()
@@ -211,6 +483,7 @@ class RegisterView(APIView):
 
 # -------------------ORDER-----------------------------------------------------------------------------------------------------------------------------
 
+@method_decorator(idempotent, name='post')
 class OrderCreateView(generics.CreateAPIView):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -219,6 +492,7 @@ class OrderCreateView(generics.CreateAPIView):
         serializer.save(user=self.request.user)
 
 
+@method_decorator(idempotent, name='post')
 class OrderProductCreateView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -238,17 +512,14 @@ class OrderProductCreateView(APIView):
         except ObjectDoesNotExist:
             return Response({'message': 'Product or Order not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        # Check if there's enough quantity in stock
-        if product.quantity < quantity:
-            return Response({'message': 'Not enough quantity in stock'}, status=status.HTTP_400_BAD_REQUEST)
-
         try:
             with transaction.atomic():
+                # Reduce the quantity of the product, if enough of it is not held by other carts
+                product = Product.objects.select_for_update().get(pk=product.pk)
+                take(user.pk, product, quantity)
                 order_product = OrderProduct.objects.create(order=order, product=product, quantity=quantity, price=price)
-                
-                # Reduce the quantity of the product
-                product.quantity -= quantity
-                product.save()
+        except InsufficientStock:
+            return Response({'message': 'Not enough quantity in stock'}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({'message': 'Failed to add product to order', 'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
@@ -265,25 +536,48 @@ class OrderProductCreateView(APIView):
         }, status=status.HTTP_201_CREATED)
 
 
-class OrderListView(generics.ListAPIView):
+@method_decorator(idempotent, name='post')
+class CheckoutView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        shipping_address = request.data.get('shipping_address')
+        if not shipping_address:
+            return Response({'message': 'Shipping address is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            order = checkout(request.user, shipping_address)
+        except InsufficientStock as e:
+            return Response({'message': 'Not enough quantity in stock', 'available': e.available}, status=status.HTTP_400_BAD_REQUEST)
+        if order is None:
+            return Response({'message': 'Shopping cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
+
+        order = OrderSerializer.setup_eager_loading(Order.objects.filter(pk=order.pk)).get()
+        return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
+
+
+class OrderListView(ValuesListMixin, generics.ListAPIView):
     serializer_class = OrderSerializer
+    values_serializer_class = OrderValuesSerializer
+    pagination_class = OrderCursorPagination
 
     permission_classes = [permissions.IsAuthenticated, IsOrderOwner]
 
     def get_queryset(self):
         user = self.request.user
-        return Order.objects.filter(user=user)
+        return OrderSerializer.setup_eager_loading(Order.objects.filter(user=user))
 
 
 from rest_framework.response import Response
 
+@method_decorator(conditional_get(order_validators), name='get')
 class OrderDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         user = self.request.user
-        queryset = Order.objects.filter(user=user)
+        queryset = OrderSerializer.setup_eager_loading(Order.objects.filter(user=user))
         return queryset
     
     def retrieve(self, request, *args, **kwargs):
@@ -296,10 +590,38 @@ class OrderDetailView(generics.RetrieveUpdateDestroyAPIView):
 class SoldOrdersView(generics.ListAPIView):
     serializer_class = OrderProductSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = OrderProductCursorPagination
 
     def get_queryset(self):
         user = self.request.user
-        return OrderProduct.objects.filter(product__user=user)
+        return OrderProductSerializer.setup_eager_loading(OrderProduct.objects.filter(product__user=user))
+
+
+class SoldOrdersSummaryView(APIView):
+    """
+    Sales of the seller from `from` to `to` (dates, both included, the last 30 days by default): totals, one
+    entry per day with sales and the `limit` best-selling products, read from the daily sales rollups.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    DEFAULT_DAYS = 30
+    MAX_DAYS = 366
+
+    def get(self, request):
+        today = timezone.localdate()
+        try:
+            end = parse_date(request.query_params.get('to') or today.isoformat())
+            start = parse_date(request.query_params.get('from') or (end - timedelta(days=self.DEFAULT_DAYS - 1)).isoformat())
+        except (TypeError, ValueError):
+            start = end = None
+        if start is None or end is None:
+            return Response({'error': 'from and to must be dates (YYYY-MM-DD)'}, status=status.HTTP_400_BAD_REQUEST)
+        if start > end or (end - start).days >= self.MAX_DAYS:
+            return Response({'error': f'from must be before to, and at most {self.MAX_DAYS} days apart'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 100)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(sales_summary(request.user.pk, start, end, max(limit, 0)), status=status.HTTP_200_OK)
     
     
     
@@ -316,6 +638,7 @@ class OrderView(View):
         
 
 # -------------------PAYMENT--------------------------------------------------------------------------------------------------------------------
+@method_decorator(idempotent, name='post')
 class PaymentProcessView(APIView):
     permission_classes = [permissions.IsAuthenticated, IsOrderOwner]
 
@@ -355,70 +678,105 @@ class PaymentProcessView(APIView):
 
 # -------------------SHOPPING CART API----------------------------------------------------------------------------------------------------------------------
 
+@method_decorator(conditional_get(shopping_cart_validators), name='list')
 class ShoppingCartViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
     
 
     def list(self, request):
-        cart = ShoppingCart.objects.filter(user=request.user).first()
+        cart = ShoppingCartSerializer.setup_eager_loading(ShoppingCart.objects.filter(user=request.user, status=CartStatus.ACTIVE)).first()
         if cart is None:
             return Response({'error': 'No shopping cart found for this user.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self._cart_data(cart))
+
+    def _cart_data(self, cart):
+        # items are serialized by ShoppingCartSerializer from the prefetched rows,
+        # then the clicks not written to them yet are applied
         serializer = ShoppingCartSerializer(cart)
-        response = serializer.data
-        response['items'] = CartItemSerializer(cart.items.all(), many=True).data
-        return Response(response)
+        return cart_store.apply_pending(serializer.data, cart_store.peek(cart.user_id))
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """Apply a list of add/set/remove operations by product id at once, e.g. to merge a guest cart after login."""
+        serializer = CartBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({'error': 'Invalid operations', 'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        operations = [(op['op'], op['product_id'], op['quantity']) for op in serializer.validated_data['operations']]
+
+        existing = set(Product.objects.filter(pk__in={product_id for _, product_id, _ in operations}).values_list('pk', flat=True))
+        missing = {
+            str(index): {'product_id': f'Product {product_id} not found'}
+            for index, (op, product_id, _) in enumerate(operations) if op != 'remove' and product_id not in existing
+        }
+        if missing:
+            return Response({'error': 'Product not found', 'errors': missing}, status=status.HTTP_404_NOT_FOUND)
+
+        # nothing is applied unless every line stays within the available stock, checked in one query
+        unavailable = cart_store.apply_operations(request.user.pk, operations)
+        if unavailable:
+            return Response({
+                'error': 'Not enough product available',
+                'errors': {
+                    str(index): {'quantity': f'You cannot add more than {unavailable[product_id]} of this product'}
+                    for index, (op, product_id, _) in enumerate(operations) if product_id in unavailable and op != 'remove'
+                },
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        cart = ShoppingCartSerializer.setup_eager_loading(ShoppingCart.objects.filter(user=request.user, status=CartStatus.ACTIVE)).first()
+        return Response(self._cart_data(cart), status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['post'])
     def add_product(self, request):
         product_id = request.data.get('product_id')
         quantity = request.data.get('quantity', 1)  # Default to 1 if no quantity is provided
         product = get_object_or_404(Product, pk=product_id)
-        cart, created = ShoppingCart.objects.get_or_create(user=request.user)
-        cart_item, created = CartItem.objects.get_or_create(product=product, cart=cart, defaults={'quantity': quantity})
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+        try:
+            cart_store.add_product(request.user.pk, product.pk, quantity)
+        except InsufficientStock as e:
+            return self._not_available(e.available[product.pk])
         return Response({"message": "Product added to cart"}, status=200)
 
+    def _not_available(self, available):
+        return Response({
+            'error': 'Not enough product available',
+            'message': f'You cannot add more than {available} of this product'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    def _cart_item_data(self, item_id, product_id, quantity):
+        product = Product.objects.select_related('user').get(pk=product_id)
+        return CartItemSerializer(CartItem(id=item_id, product=product, quantity=quantity)).data
+
     @action(detail=True, methods=['delete'])
     def remove_product(self, request, pk=None):
-        cart_item = CartItem.objects.filter(id=pk, cart__user=request.user).first()
-        if cart_item is None:
+        item = cart_store.get_item(request.user.pk, pk)
+        quantity = cart_store.change_quantity(request.user.pk, pk, -1) if item is not None else None
+        if quantity is None:
             return Response({'error': 'Cart item not found'}, status=status.HTTP_404_NOT_FOUND)
-        if cart_item.quantity > 1:
-            cart_item.quantity -= 1
-            cart_item.save()
-            serializer = CartItemSerializer(cart_item)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+        if quantity:
+            return Response(self._cart_item_data(pk, item['product_id'], quantity), status=status.HTTP_200_OK)
         else:
-            cart_item.delete()
             return Response({'message': 'Product removed from cart'}, status=status.HTTP_204_NO_CONTENT)
         
         
     @action(detail=True, methods=['post'])
     def increment_product(self, request, pk=None):
-        cart_item = CartItem.objects.filter(id=pk, cart__user=request.user).first()
-        if cart_item is None:
+        item = cart_store.get_item(request.user.pk, pk)
+        if item is None:
             return Response({'error': 'Cart item not found'}, status=status.HTTP_404_NOT_FOUND)
-        
-        # Check if the quantity exceeds the available stock
-        if cart_item.product.quantity < cart_item.quantity + 1:
-            return Response({
-                'error': 'Not enough product available',
-                'message': f'You cannot add more than {cart_item.product.quantity} of this product'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        cart_item.quantity += 1
-        cart_item.save()
-        serializer = CartItemSerializer(cart_item)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+
+        # the line only grows if the stock not held by other carts covers it
+        try:
+            quantity = cart_store.change_quantity(request.user.pk, pk, 1)
+        except InsufficientStock as e:
+            return self._not_available(e.available[item['product_id']])
+        if quantity is None:
+            return Response({'error': 'Cart item not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self._cart_item_data(pk, item['product_id'], quantity), status=status.HTTP_200_OK)
     
 
     @action(detail=True, methods=['delete'])
     def delete_product(self, request, pk=None):
-        cart_item = CartItem.objects.filter(id=pk, cart__user=request.user).first()
-        if cart_item is not None:
-            cart_item.delete()
+        if cart_store.remove_item(request.user.pk, pk):
             return Response({'message': 'Product removed from cart'}, status=status.HTTP_204_NO_CONTENT)
         else:
             return Response({'error': 'Product not found in cart'}, status=status.HTTP_400_BAD_REQUEST)
@@ -428,9 +786,7 @@ class ClearCartView(APIView):
     permission_classes = [IsAuthenticated]
 
     def delete(self, request, *args, **kwargs):
-        cart = ShoppingCart.objects.filter(user=request.user).first()
-        if cart is not None:
-            cart.items.all().delete()  # Use items instead of cartitem_set
+        if cart_store.clear(request.user.pk):
             return Response({'message': 'Shopping cart cleared'}, status=status.HTTP_204_NO_CONTENT)
         else:
             return Response({'error': 'Shopping cart not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -512,7 +868,7 @@ class WishlistView(APIView):
     def get(self, request):
         userprofile = request.user.userprofile_set.first()
         if userprofile:
-            wishlist = userprofile.wishlist.all()
+            wishlist = ProductSerializer.setup_eager_loading(userprofile.wishlist.all())
             serializer = ProductSerializer(wishlist, many=True)
             return Response(serializer.data, status=status.HTTP_200_OK)
         else: